@@ -1,25 +1,92 @@
 # 文物识别服务
 import os
-import base64
 import time
-import tempfile
 import requests
 import logging
 from openai import OpenAI
 from typing import Tuple, Optional, Dict
+from recognition_cache import RecognitionCache, image_digest, open_recognition_cache
+from image_preprocess import prepare_image_bytes
+from image_hashing import (NearDuplicateIndex, SOURCE_CATALOGUE, SOURCE_UPLOAD,
+                           compute_image_hashes, open_near_duplicate_index)
 
 logger = logging.getLogger(__name__)
 
+# 图片识别使用的模型（同时作为缓存键的一部分，更换模型后旧结果不再命中）
+RECOGNITION_MODEL = "ernie-4.5-vl-28b-a3b-thinking"
+
+# 图片识别提示词
+RECOGNITION_PROMPT = """你是一位专业的中国古代文物识别专家。请仔细分析这张图片中的文物，并提供以下信息：
+
+1. 文物类型（如：青铜器、陶俑、壁画、瓷器、玉器等）
+2. 具体文物名称（如：司母戊鼎、兵马俑、清明上河图等，如无法确定具体名称则说"该类文物"）
+3. 识别置信度（0.0-1.0之间的数值）
+4. 简要介绍（50-100字，包括历史背景、艺术特色或文化价值）
+
+请按以下格式回答：
+文物类型：青铜器
+具体名称：司母戊鼎
+置信度：0.95
+介绍：这是商代晚期的青铜器，具有重要的历史价值..."""
+
+def parse_recognition_text(result_text: str) -> Tuple[str, str, float, str]:
+    """解析模型回复
+    
+    Returns:
+        tuple: (artifact_type, artifact_name, confidence, description)
+    """
+    artifact_type = "未知文物"
+    artifact_name = "未知"
+    confidence = 0.0
+    description = "无法解析识别结果"
+    
+    lines = result_text.split('\n')
+    for line in lines:
+        line = line.strip()
+        if line.startswith('文物类型：') or line.startswith('文物类型:'):
+            artifact_type = line.split('：', 1)[-1].split(':', 1)[-1].strip()
+        elif line.startswith('具体名称：') or line.startswith('具体名称:'):
+            artifact_name = line.split('：', 1)[-1].split(':', 1)[-1].strip()
+        elif line.startswith('置信度：') or line.startswith('置信度:'):
+            try:
+                conf_str = line.split('：', 1)[-1].split(':', 1)[-1].strip()
+                confidence = float(conf_str)
+            except:
+                confidence = 0.0
+        elif line.startswith('介绍：') or line.startswith('介绍:'):
+            description = line.split('：', 1)[-1].split(':', 1)[-1].strip()
+    
+    # 如果没有找到介绍，使用整个响应作为描述
+    if description == "无法解析识别结果" and result_text:
+        description = result_text[:200]  # 限制长度
+    
+    return artifact_type, artifact_name, confidence, description
+
+def is_recognized(result: Tuple[str, str, float, str]) -> bool:
+    """是否从模型回复中解析出了识别结果
+    
+    未解析出时（文物类型为“未知文物”且置信度为0）不写入缓存与近重复图片索引，下次重新调用模型识别，
+    避免一次无法解析的回复让同一图片及其近重复图片在缓存有效期内都被识别为“未知”
+    """
+    artifact_type, _, confidence, _ = result
+    return not (artifact_type == "未知文物" and not confidence)
+
 class ArtifactRecognitionService:
     """文物识别服务类"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, cache: Optional[RecognitionCache] = None,
+                 image_index: Optional[NearDuplicateIndex] = None):
         """
         初始化文物识别服务
         
         Args:
             api_key: ERNIE API密钥，如果为None则从环境变量获取
+            cache: 识别结果缓存，为None时按环境变量 RECOGNITION_CACHE_PATH 打开
+            image_index: 近重复图片索引，为None时按环境变量 IMAGE_HASH_INDEX_PATH 打开
         """
+        self.cache = cache if cache is not None else open_recognition_cache()
+        self.image_index = image_index if image_index is not None else open_near_duplicate_index()
+        
         if not api_key:
             api_key = os.environ.get("AI_STUDIO_API_KEY")
         
@@ -30,7 +97,7 @@ class ArtifactRecognitionService:
             try:
                 self.client = OpenAI(
                     api_key=api_key,
-                    base_url="https://aistudio.baidu.com/llm/lmapi/v3",
+                    base_url=os.environ.get("ERNIE_BASE_URL", "https://aistudio.baidu.com/llm/lmapi/v3"),
                 )
                 logger.info("✓ ERNIE客户端初始化成功")
             except Exception as e:
@@ -46,9 +113,7 @@ class ArtifactRecognitionService:
         Returns:
             tuple: (artifact_type, artifact_name, confidence, description)
         """
-        if self.client is None:
-            return "未知文物", "未知", 0.0, "无法识别：客户端未初始化"
-        
+        # 客户端未初始化时仍可命中缓存，由 classify_image_bytes 在未命中时检查客户端
         if not image_url or not image_url.strip():
             return "未知文物", "未知", 0.0, "无法识别：图片地址为空"
         
@@ -58,17 +123,7 @@ class ArtifactRecognitionService:
             if response.status_code != 200:
                 return "未知文物", "未知", 0.0, f"无法识别：下载图片失败（状态码：{response.status_code}）"
             
-            # 将图片保存到临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
-                tmp_file.write(response.content)
-                tmp_image_path = tmp_file.name
-            
-            try:
-                return self._classify_image_file(tmp_image_path)
-            finally:
-                # 清理临时文件
-                if os.path.exists(tmp_image_path):
-                    os.remove(tmp_image_path)
+            return self.classify_image_bytes(response.content)
                     
         except requests.exceptions.RequestException as e:
             return "未知文物", "未知", 0.0, f"无法识别：网络请求失败 - {str(e)}"
@@ -84,9 +139,7 @@ class ArtifactRecognitionService:
         Returns:
             tuple: (artifact_type, artifact_name, confidence, description)
         """
-        if self.client is None:
-            return "未知文物", "未知", 0.0, "无法识别：客户端未初始化"
-        
+        # 客户端未初始化时仍可命中缓存，由 classify_image_bytes 在未命中时检查客户端
         if not image_path or not os.path.exists(image_path):
             return "未知文物", "未知", 0.0, "无法识别：图片文件不存在"
         
@@ -102,80 +155,121 @@ class ArtifactRecognitionService:
             tuple: (artifact_type, artifact_name, confidence, description)
         """
         try:
-            # 读取图片并转换为base64
             with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            # 构建提示词
-            prompt = """你是一位专业的中国古代文物识别专家。请仔细分析这张图片中的文物，并提供以下信息：
-
-1. 文物类型（如：青铜器、陶俑、壁画、瓷器、玉器等）
-2. 具体文物名称（如：司母戊鼎、兵马俑、清明上河图等，如无法确定具体名称则说"该类文物"）
-3. 识别置信度（0.0-1.0之间的数值）
-4. 简要介绍（50-100字，包括历史背景、艺术特色或文化价值）
-
-请按以下格式回答：
-文物类型：青铜器
-具体名称：司母戊鼎
-置信度：0.95
-介绍：这是商代晚期的青铜器，具有重要的历史价值..."""
-            
-            # 调用模型服务
-            start_time = time.time()
-            response = self.client.chat.completions.create(
-                model="ernie-4.5-vl-28b-a3b-thinking",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                temperature=0.1
-            )
-            response_time = time.time() - start_time
-            
-            result_text = response.choices[0].message.content
-            
-            # 提取信息
-            artifact_type = "未知文物"
-            artifact_name = "未知"
-            confidence = 0.0
-            description = "无法解析识别结果"
-            
-            lines = result_text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.startswith('文物类型：') or line.startswith('文物类型:'):
-                    artifact_type = line.split('：', 1)[-1].split(':', 1)[-1].strip()
-                elif line.startswith('具体名称：') or line.startswith('具体名称:'):
-                    artifact_name = line.split('：', 1)[-1].split(':', 1)[-1].strip()
-                elif line.startswith('置信度：') or line.startswith('置信度:'):
-                    try:
-                        conf_str = line.split('：', 1)[-1].split(':', 1)[-1].strip()
-                        confidence = float(conf_str)
-                    except:
-                        confidence = 0.0
-                elif line.startswith('介绍：') or line.startswith('介绍:'):
-                    description = line.split('：', 1)[-1].split(':', 1)[-1].strip()
-            
-            # 如果没有找到介绍，使用整个响应作为描述
-            if description == "无法解析识别结果" and result_text:
-                description = result_text[:200]  # 限制长度
-            
-            logger.info(f"图片识别完成，耗时: {response_time:.2f}秒")
-            return artifact_type, artifact_name, confidence, description
-            
+                image_bytes = image_file.read()
+        except Exception as e:
+            logger.error(f"读取图片失败: {str(e)}")
+            return "未知文物", "未知", 0.0, f"无法识别：识别过程出错 - {str(e)}"
+        return self.classify_image_bytes(image_bytes)
+    
+    def classify_image_bytes(self, image_bytes: bytes,
+                             hashes: Optional[Tuple[int, int]] = None) -> Tuple[str, str, float, str]:
+        """识别图片内容；相同内容的图片识别过时直接返回缓存结果，
+        与已识别图片近似重复（重新编码、缩放、轻微裁剪）时复用其结果，都不再调用模型
+        
+        Args:
+            image_bytes: 图片文件内容
+            hashes: 已计算好的感知哈希，为None时按需计算
+        
+        Returns:
+            tuple: (artifact_type, artifact_name, confidence, description)
+        """
+        digest = image_digest(image_bytes)
+        if self.cache is not None:
+            cached = self.cache.get(digest, RECOGNITION_MODEL)
+            if cached is not None:
+                logger.info(f"图片识别命中缓存（{digest[:12]}）")
+                return cached
+        
+        if self.image_index is not None and hashes is None:
+            hashes = compute_image_hashes(image_bytes)
+        if self.image_index is not None and hashes is not None:
+            match = self.image_index.lookup(hashes, require_recognition=True)
+            if match is not None:
+                recognition = match["recognition"]
+                result = (recognition["artifact_type"], recognition["artifact_name"],
+                          float(recognition["confidence"]), recognition["description"])
+                logger.info(f"图片识别命中近重复图片（{match['source']}，汉明距离 {match['distance']}）")
+                self._cache_result(digest, result)
+                return result
+        
+        if self.client is None:
+            return "未知文物", "未知", 0.0, "无法识别：客户端未初始化"
+        
+        try:
+            result = self._recognize_image_bytes(image_bytes)
         except Exception as e:
+            # 识别失败的结果不写入缓存，下次重新识别
             logger.error(f"识别过程出错: {str(e)}")
             return "未知文物", "未知", 0.0, f"无法识别：识别过程出错 - {str(e)}"
+        
+        if not is_recognized(result):
+            logger.warning(f"⚠️ 无法解析模型的识别结果，不写入缓存（{digest[:12]}）")
+            return result
+        self._cache_result(digest, result)
+        if self.image_index is not None and hashes is not None:
+            artifact_type, artifact_name, confidence, description = result
+            try:
+                self.image_index.add(SOURCE_UPLOAD, digest, hashes, recognition={
+                    "artifact_type": artifact_type,
+                    "artifact_name": artifact_name,
+                    "confidence": confidence,
+                    "description": description
+                })
+            except Exception as e:
+                logger.warning(f"⚠️ 写入近重复图片索引失败: {str(e)}")
+        return result
+    
+    def _cache_result(self, digest: str, result: Tuple[str, str, float, str]) -> None:
+        if self.cache is not None:
+            try:
+                self.cache.put(digest, RECOGNITION_MODEL, result)
+            except Exception as e:
+                logger.warning(f"⚠️ 写入识别缓存失败: {str(e)}")
+    
+    def match_catalogue_artifact(self, hashes: Tuple[int, int]) -> Optional[Dict]:
+        """查找与图片近似重复的文物库图片
+        
+        Returns:
+            dict: 文物信息（文物名称、编号-年代、图片地址）及汉明距离 distance，未找到时返回None
+        """
+        if self.image_index is None:
+            return None
+        match = self.image_index.lookup(hashes, source=SOURCE_CATALOGUE)
+        if match is None:
+            return None
+        return {**(match["artifact"] or {}), "image_url": match["key"], "distance": match["distance"]}
+    
+    def _recognize_image_bytes(self, image_bytes: bytes) -> Tuple[str, str, float, str]:
+        """调用模型识别图片并解析结果（出错时抛出异常）"""
+        # 缩小并重新编码后再发送
+        prepared = prepare_image_bytes(image_bytes)
+        
+        # 调用模型服务
+        start_time = time.time()
+        response = self.client.chat.completions.create(
+            model=RECOGNITION_MODEL,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": RECOGNITION_PROMPT},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": prepared.data_url
+                            }
+                        }
+                    ]
+                }
+            ],
+            temperature=0.1
+        )
+        response_time = time.time() - start_time
+        
+        result_text = response.choices[0].message.content
+        logger.info(f"图片识别完成，耗时: {response_time:.2f}秒")
+        return parse_recognition_text(result_text)
     
     def recognize_and_format(self, image_path: str) -> Dict:
         """识别图片并返回格式化结果
@@ -186,18 +280,37 @@ class ArtifactRecognitionService:
         Returns:
             dict: 包含识别结果的字典
         """
+        hashes = None
         # 判断是URL还是本地路径
         if image_path.startswith('http://') or image_path.startswith('https://'):
             artifact_type, artifact_name, confidence, description = self.classify_artifact_image_from_url(image_path)
+        elif self.image_index is not None and image_path and os.path.exists(image_path):
+            # 本地上传图片：哈希只计算一次，同时用于近重复识别与文物库匹配
+            try:
+                with open(image_path, "rb") as image_file:
+                    image_bytes = image_file.read()
+            except Exception as e:
+                logger.error(f"读取图片失败: {str(e)}")
+                image_bytes = None
+            if image_bytes is None:
+                artifact_type, artifact_name, confidence, description = \
+                    "未知文物", "未知", 0.0, "无法识别：读取图片失败"
+            else:
+                hashes = compute_image_hashes(image_bytes)
+                artifact_type, artifact_name, confidence, description = self.classify_image_bytes(image_bytes, hashes)
         else:
             artifact_type, artifact_name, confidence, description = self.classify_artifact_image_from_file(image_path)
         
-        return {
+        result = {
             "artifact_type": artifact_type,
             "artifact_name": artifact_name,
             "confidence": confidence,
             "description": description
         }
+        if hashes is not None:
+            # 与文物库中某件文物的图片近似重复时附上该文物
+            result["matched_artifact"] = self.match_catalogue_artifact(hashes)
+        return result
     
     def is_ready(self) -> bool:
         """检查服务是否已准备好"""
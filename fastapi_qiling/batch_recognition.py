@@ -0,0 +1,226 @@
+# 批量图片识别：有界并发 + 令牌桶限流 + 抖动退避重试 + 断点续传
+#
+# 离线构建时对整个文物表的图片逐一调用大模型识别，串行执行需要一天以上。
+# 这里用固定大小的线程池并发执行，所有线程共享一个令牌桶控制请求速率；
+# 服务端返回 429 时按 Retry-After 暂停整个令牌桶，其余临时错误按指数退避（带随机抖动）重试。
+# 每个完成的结果立即追加写入检查点文件（JSONL），中断后重新运行只处理尚未完成的任务。
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 默认配置（可通过环境变量覆盖）
+RECOGNITION_WORKERS = int(os.environ.get("RECOGNITION_WORKERS", 8))
+RECOGNITION_RATE = float(os.environ.get("RECOGNITION_RATE", 2.0))          # 每秒请求数
+RECOGNITION_BURST = int(os.environ.get("RECOGNITION_BURST", 4))            # 令牌桶容量
+RECOGNITION_MAX_RETRIES = int(os.environ.get("RECOGNITION_MAX_RETRIES", 5))
+RECOGNITION_BACKOFF_BASE = float(os.environ.get("RECOGNITION_BACKOFF_BASE", 1.0))
+RECOGNITION_BACKOFF_MAX = float(os.environ.get("RECOGNITION_BACKOFF_MAX", 60.0))
+
+
+class RateLimitedError(Exception):
+    """服务端限流（HTTP 429），retry_after 为建议的等待秒数"""
+
+    def __init__(self, message: str = "rate limited", retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TransientError(Exception):
+    """可重试的临时错误（网络错误、超时、5xx 等）"""
+
+
+class TokenBucket:
+    """线程安全的令牌桶限流器"""
+
+    def __init__(self, rate: float, capacity: int = 1,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            rate: 每秒补充的令牌数（即平均请求速率），<=0 表示不限速
+            capacity: 桶容量（允许的突发请求数）
+            clock / sleep: 单调时钟与等待函数（测试时可替换）
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        # 收到 429 后，在此时间点之前所有线程都不发出请求
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """取得一个令牌，必要时阻塞等待"""
+        if self.rate <= 0:
+            self._wait_pause()
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def _wait_pause(self) -> None:
+        while True:
+            with self._lock:
+                wait = self._paused_until - self._clock()
+            if wait <= 0:
+                return
+            self._sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """暂停发放令牌（收到 429 时调用），并清空桶内积累的令牌避免恢复后突发"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+
+
+def backoff_delay(attempt: int, base: float = RECOGNITION_BACKOFF_BASE,
+                  cap: float = RECOGNITION_BACKOFF_MAX) -> float:
+    """第 attempt 次重试前的等待时间：指数退避 + 全抖动（0 ~ min(cap, base*2^attempt) 之间随机）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RecognitionCheckpoint:
+    """识别结果检查点：每行一个 {"key": ..., "result": ...} 的 JSON 记录"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tail_checked = False
+
+    def load(self) -> Dict[str, Dict]:
+        """读取已完成的结果（中断时写了一半的最后一行会被忽略）"""
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        # 截断在多字节字符中间的行按替换字符读出，随后因不是合法 JSON 被跳过
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[record["key"]] = record["result"]
+        return results
+
+    def record(self, key: str, result: Dict) -> None:
+        """追加一条结果并立即落盘"""
+        line = json.dumps({"key": key, "result": result}, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, 'ab+') as f:
+                # 中断时写了一半的最后一行没有换行符，先换行，避免新记录接在它后面一起被忽略
+                if not self._tail_checked:
+                    self._tail_checked = True
+                    if f.seek(0, os.SEEK_END) > 0:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            line = "\n" + line
+                f.write(line.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _call_with_retry(func: Callable, key: str, payload, limiter: TokenBucket, max_retries: int,
+                     sleep: Callable[[float], None] = time.sleep):
+    """限流后调用 func(payload)，对 429 与临时错误重试"""
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            return func(payload)
+        except RateLimitedError as e:
+            delay = e.retry_after if e.retry_after is not None else backoff_delay(attempt)
+            # 429 说明整体速率过高，暂停所有线程而不只是当前线程
+            limiter.pause(delay)
+            reason = f"限流，{delay:.1f} 秒后重试"
+        except TransientError as e:
+            delay = backoff_delay(attempt)
+            reason = f"{str(e)}，{delay:.1f} 秒后重试"
+            sleep(delay)
+        attempt += 1
+        if attempt > max_retries:
+            raise TransientError(f"重试 {max_retries} 次后仍失败")
+        logger.warning(f"  ⚠️ {key}: {reason}（第 {attempt} 次）")
+
+
+def run_batch_recognition(tasks: Iterable[Tuple[str, object]],
+                          recognize: Callable[[object], Dict],
+                          checkpoint: Optional[RecognitionCheckpoint] = None,
+                          workers: int = RECOGNITION_WORKERS,
+                          rate: float = RECOGNITION_RATE,
+                          burst: int = RECOGNITION_BURST,
+                          max_retries: int = RECOGNITION_MAX_RETRIES,
+                          progress_every: int = 100,
+                          clock: Callable[[], float] = time.monotonic,
+                          sleep: Callable[[float], None] = time.sleep) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+    """并发执行一批识别任务
+
+    Args:
+        tasks: (key, payload) 列表，key 相同的任务只执行一次（如同一图片地址）
+        recognize: 识别函数，成功返回结果字典；可重试的错误应抛出 RateLimitedError / TransientError，
+            其余异常视为永久失败
+        checkpoint: 检查点，已记录的 key 直接复用结果，新结果完成后立即写入
+        workers: 并发线程数
+        rate: 每秒请求数上限（<=0 不限速）
+        burst: 令牌桶容量
+        max_retries: 每个任务的最大重试次数
+        clock / sleep: 限流与退避使用的单调时钟与等待函数（测试时可替换）
+
+    Returns:
+        tuple: (results, failures) 成功结果 key -> result，失败任务 key -> 错误信息（未写入检查点，下次运行时重试）
+    """
+    results = checkpoint.load() if checkpoint else {}
+    pending = {}
+    for key, payload in tasks:
+        if key not in results and key not in pending:
+            pending[key] = payload
+    if results:
+        logger.info(f"✓ 从检查点恢复 {len(results)} 个识别结果，剩余 {len(pending)} 个待识别")
+    if not pending:
+        return results, {}
+
+    limiter = TokenBucket(rate, burst, clock, sleep)
+    failures: Dict[str, str] = {}
+    start_time = time.time()
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="recognize") as pool:
+        futures = {
+            pool.submit(_call_with_retry, recognize, key, payload, limiter, max_retries, sleep): key
+            for key, payload in pending.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result = future.result()
+                results[key] = result
+                if checkpoint:
+                    checkpoint.record(key, result)
+            except Exception as e:
+                failures[key] = str(e)
+                logger.warning(f"  ⚠️ {key} 识别失败: {str(e)}")
+            done += 1
+            if done % progress_every == 0 or done == len(futures):
+                elapsed = time.time() - start_time
+                logger.info(f"  已识别 {done}/{len(futures)} 张图片（{done / max(elapsed, 1e-6):.2f} 张/秒，失败 {len(failures)}）")
+    return results, failures
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""ANN索引基准测试：各索引类型的 recall@k 与查询延迟（以 flat 暴力搜索为真值）
+
+用法：
+    # 使用已构建的向量数据库中的向量（需为 flat 索引）
+    python bench_ann_index.py --source db --index-file ./data/vector_db/faiss.index
+
+    # 使用随机生成的向量模拟大规模文物库
+    python bench_ann_index.py --source synthetic --num 200000 --k 10
+
+    # 余弦相似度 + int8 标量量化存储
+    python bench_ann_index.py --metric ip --storage int8
+"""
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from vector_db_service import create_faiss_index, normalize_vectors
+
+# 各索引类型对应的查询参数扫描范围
+SWEEPS = {
+    "flat": [None],
+    "ivf_flat": [1, 4, 16, 64],
+    "ivf_pq": [1, 4, 16, 64],
+    "hnsw": [16, 32, 64, 128],
+}
+
+
+def load_vectors(args):
+    """加载或生成基准向量"""
+    if args.source == "db":
+        index = faiss.read_index(args.index_file)
+        vectors = index.reconstruct_n(0, index.ntotal)
+        print(f"✓ 从 {args.index_file} 读取 {len(vectors)} 条向量")
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    rng = np.random.default_rng(42)
+    # 带聚类结构的随机向量，比均匀噪声更接近真实词向量分布
+    centers = rng.normal(size=(max(1, args.num // 500), args.dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=args.num)
+    vectors = centers[labels] + 0.3 * rng.normal(size=(args.num, args.dim)).astype(np.float32)
+    print(f"✓ 生成 {args.num} 条 {args.dim} 维随机向量")
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def make_queries(vectors, num_queries):
+    """从库中抽样并加噪声作为查询向量"""
+    rng = np.random.default_rng(7)
+    picks = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    noise = 0.05 * rng.normal(size=(len(picks), vectors.shape[1])).astype(np.float32)
+    return np.ascontiguousarray(vectors[picks] + noise, dtype=np.float32)
+
+
+def search_params(index_type, knob):
+    if knob is None:
+        return None
+    if index_type.startswith("ivf"):
+        return faiss.SearchParametersIVF(nprobe=knob)
+    return faiss.SearchParametersHNSW(efSearch=knob)
+
+
+def recall_at_k(result_ids, truth_ids):
+    """recall@k：返回结果中命中真值 top-k 的比例"""
+    hits = sum(len(set(r) & set(t)) for r, t in zip(result_ids, truth_ids))
+    return hits / truth_ids.size
+
+
+def run_benchmark(args):
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries)
+
+    # 真值：同一度量下的 flat 暴力搜索
+    if args.metric == "ip":
+        queries = normalize_vectors(queries)
+        truth_index = faiss.IndexFlatIP(vectors.shape[1])
+        truth_index.add(normalize_vectors(vectors))
+    else:
+        truth_index = faiss.IndexFlatL2(vectors.shape[1])
+        truth_index.add(vectors)
+    _, truth_ids = truth_index.search(queries, args.k)
+    print(f"度量: {args.metric}，存储精度: {args.storage}")
+
+    print("=" * 78)
+    print(f"{'索引类型':<10}{'参数':>10}{'构建(秒)':>12}{'recall@' + str(args.k):>12}{'延迟(毫秒/次)':>16}{'QPS':>10}")
+    print("=" * 78)
+
+    for index_type in args.types:
+        start = time.perf_counter()
+        index, meta = create_faiss_index(vectors, index_type, {"metric": args.metric, "storage": args.storage})
+        build_time = time.perf_counter() - start
+        actual_type = meta["index_type"]
+
+        for knob in SWEEPS[actual_type]:
+            params = search_params(actual_type, knob)
+            result_ids = np.empty_like(truth_ids)
+            start = time.perf_counter()
+            # 逐条查询，模拟线上单请求场景
+            for i in range(len(queries)):
+                q = queries[i:i + 1]
+                if params is None:
+                    _, ids = index.search(q, args.k)
+                else:
+                    _, ids = index.search(q, args.k, params=params)
+                result_ids[i] = ids[0]
+            elapsed = time.perf_counter() - start
+
+            latency_ms = elapsed / len(queries) * 1000
+            knob_text = "-" if knob is None else str(knob)
+            print(f"{actual_type:<12}{knob_text:>10}{build_time:>12.2f}"
+                  f"{recall_at_k(result_ids, truth_ids):>12.4f}{latency_ms:>16.3f}{len(queries) / elapsed:>10.0f}")
+        print("-" * 78)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ANN索引 recall@k 与延迟基准测试")
+    parser.add_argument("--source", choices=["db", "synthetic"], default="synthetic")
+    parser.add_argument("--index-file", default="./data/vector_db/faiss.index", help="source=db 时读取的索引文件")
+    parser.add_argument("--num", type=int, default=100000, help="随机向量数量")
+    parser.add_argument("--dim", type=int, default=300, help="随机向量维度")
+    parser.add_argument("--queries", type=int, default=500, help="查询数量")
+    parser.add_argument("--k", type=int, default=10, help="recall@k 中的 k")
+    parser.add_argument("--metric", choices=["l2", "ip"], default="l2", help="相似度度量")
+    parser.add_argument("--storage", choices=["float32", "float16", "int8"], default="float32", help="向量存储精度")
+    parser.add_argument("--types", nargs="+", default=["flat", "ivf_flat", "ivf_pq", "hnsw"],
+                        help="参与测试的索引类型")
+    args = parser.parse_args()
+
+    run_benchmark(args)
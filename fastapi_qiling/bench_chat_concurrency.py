@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""并发压测 /api/chat/send：验证并发请求是否重叠执行而不是串行排队
+
+用法：
+    python bench_chat_concurrency.py --url http://127.0.0.1:8000 --user-id 123 --concurrency 8
+
+输出总耗时、单请求平均耗时以及"重叠度"（所有请求耗时之和 / 总耗时）。
+重叠度接近并发数说明请求在服务端并行处理；接近 1 说明事件循环被阻塞、请求被串行化。
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def send_one(url, user_id, message):
+    """发送一次聊天请求，返回 (耗时秒数, 状态码)"""
+    start = time.perf_counter()
+    response = requests.post(
+        f"{url}/api/chat/send",
+        data={"message": message},
+        headers={"x-user-id": str(user_id)},
+        timeout=300,
+    )
+    return time.perf_counter() - start, response.status_code
+
+
+def run_benchmark(url, user_id, concurrency, rounds, message):
+    """执行压测并打印结果"""
+    print(f"目标: {url}/api/chat/send")
+    print(f"并发数: {concurrency}，轮数: {rounds}")
+    print("=" * 60)
+
+    for round_no in range(1, rounds + 1):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(send_one, url, user_id, f"{message}（请求{i + 1}）")
+                for i in range(concurrency)
+            ]
+            results = [f.result() for f in futures]
+        wall_time = time.perf_counter() - start
+
+        latencies = [r[0] for r in results]
+        status_codes = [r[1] for r in results]
+        overlap = sum(latencies) / wall_time if wall_time > 0 else 0.0
+
+        print(f"【第 {round_no} 轮】")
+        print(f"  总耗时:       {wall_time:.2f} 秒")
+        print(f"  平均耗时:     {statistics.mean(latencies):.2f} 秒")
+        print(f"  最长耗时:     {max(latencies):.2f} 秒")
+        print(f"  重叠度:       {overlap:.2f}（理想值 ≈ {concurrency}）")
+        print(f"  状态码分布:   {dict((c, status_codes.count(c)) for c in set(status_codes))}")
+
+        if overlap < 1.5 and concurrency > 1:
+            print("  ⚠️  请求几乎完全串行，事件循环可能被阻塞")
+        else:
+            print("  ✅ 并发请求处理存在重叠")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并发压测 /api/chat/send")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="服务地址")
+    parser.add_argument("--user-id", default="1", help="请求头 x-user-id")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数")
+    parser.add_argument("--rounds", type=int, default=3, help="压测轮数")
+    parser.add_argument("--message", default="请介绍一下青花瓷", help="发送的消息内容")
+    args = parser.parse_args()
+
+    run_benchmark(args.url, args.user_id, args.concurrency, args.rounds, args.message)
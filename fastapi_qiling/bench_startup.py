@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""启动耗时基准测试：启动服务进程，测量开始接受请求（存活）与全部组件就绪的耗时
+
+用法：
+    python bench_startup.py --runs 3
+    python bench_startup.py --port 8010 --timeout 600
+
+每轮启动一个 uvicorn 进程，轮询 /api/health（存活）与 /api/health/ready（就绪），
+输出两者的耗时以及各组件的加载耗时，结束后关闭进程。
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+
+def wait_for(url, deadline, expect_ready=False):
+    """轮询接口直到返回200，返回响应内容；超时返回None"""
+    while time.perf_counter() < deadline:
+        try:
+            response = requests.get(url, timeout=2)
+            if response.status_code == 200:
+                return response.json()
+        except requests.RequestException:
+            pass
+        time.sleep(0.05 if not expect_ready else 0.2)
+    return None
+
+
+def run_once(port, timeout):
+    """启动一次服务，返回 (存活耗时, 就绪耗时, 健康检查内容)"""
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fastapi_app:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + timeout
+        if wait_for(f"{base_url}/api/health", deadline) is None:
+            return None, None, None
+        live_time = time.perf_counter() - start
+        health = wait_for(f"{base_url}/api/health/ready", deadline, expect_ready=True)
+        ready_time = time.perf_counter() - start if health is not None else None
+        return live_time, ready_time, health
+    finally:
+        process.terminate()
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务启动耗时基准测试")
+    parser.add_argument("--port", type=int, default=8010, help="测试用端口")
+    parser.add_argument("--runs", type=int, default=3, help="启动次数")
+    parser.add_argument("--timeout", type=float, default=600, help="每次启动的最长等待时间（秒）")
+    args = parser.parse_args()
+
+    live_times, ready_times = [], []
+    for run in range(1, args.runs + 1):
+        live_time, ready_time, health = run_once(args.port, args.timeout)
+        if live_time is None:
+            print(f"第 {run} 次：{args.timeout:.0f} 秒内未能开始接受请求")
+            continue
+        live_times.append(live_time)
+        ready_text = f"{ready_time:.2f}s" if ready_time is not None else "超时"
+        print(f"第 {run} 次：存活 {live_time:.2f}s，就绪 {ready_text}")
+        if health is not None:
+            ready_times.append(ready_time)
+            for name, component in health["components"].items():
+                load = component.get("load_seconds")
+                load_text = f"，加载 {load:.2f}s" if load is not None else ""
+                print(f"    {name:<12} {component['status']:<12}{load_text}")
+
+    print("=" * 60)
+    if live_times:
+        print(f"存活耗时：中位数 {statistics.median(live_times):.2f}s，最大 {max(live_times):.2f}s")
+    if ready_times:
+        print(f"就绪耗时：中位数 {statistics.median(ready_times):.2f}s，最大 {max(ready_times):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
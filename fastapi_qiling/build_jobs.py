@@ -0,0 +1,345 @@
+# 向量数据库后台构建任务
+#
+# 构建接口只提交任务并返回任务ID，构建在独立的子进程中执行（本文件同时是子进程的入口），
+# 不占用服务进程的 CPU 与 GIL。子进程把新数据库写入与当前数据库同级的临时目录，
+# 并通过标准输出逐行报告进度（JSON）；构建成功后由服务进程加载新数据库并原子切换，
+# 构建期间搜索继续使用旧索引。取消任务时终止子进程并删除临时目录，当前数据库不受影响。
+#
+# 子进程用法（由 BuildJobManager 启动，一般无需手动执行）：
+#     python build_jobs.py --excel ./故宫博物院数字文物库.xlsx --output ./data/vector_db.build-xxxx
+import argparse
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不支持跨进程构建锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 取消任务时等待子进程退出的时间（秒），超时后强制结束
+BUILD_JOB_CANCEL_GRACE = float(os.environ.get("BUILD_JOB_CANCEL_GRACE", 10))
+# 保留的已结束任务数
+BUILD_JOB_HISTORY = int(os.environ.get("BUILD_JOB_HISTORY", 20))
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+# 子进程报告的进度阶段 -> 任务的进度字段
+_PROGRESS_FIELDS = {"read": "rows_read", "embedded": "rows_embedded", "indexed": "rows_indexed"}
+
+
+class BuildJob:
+    """一次向量数据库构建任务"""
+
+    def __init__(self, force_rebuild: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.force_rebuild = force_rebuild
+        self.status = STATUS_PENDING
+        # 当前阶段：pending / read / embedded / indexed / swapping / 结束状态
+        self.phase = STATUS_PENDING
+        self.rows_read = 0
+        self.rows_embedded = 0
+        self.rows_indexed = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        self.process: Optional[subprocess.Popen] = None
+        # 跨进程的构建锁（多个 worker 共用同一个数据库目录时只允许一个进程构建）
+        self.lock_file = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> Dict:
+        end_time = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "phase": self.phase,
+            "force_rebuild": self.force_rebuild,
+            "rows_read": self.rows_read,
+            "rows_embedded": self.rows_embedded,
+            "rows_indexed": self.rows_indexed,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": end_time - self.started_at if self.started_at else 0.0
+        }
+
+
+class BuildJobManager:
+    """管理向量数据库的后台构建任务（同一时间最多运行一个）"""
+
+    def __init__(self, service):
+        """
+        Args:
+            service: 当前提供搜索的 VectorDatabaseService，构建成功后切换到新数据库
+        """
+        self.service = service
+        self._jobs: "OrderedDict[str, BuildJob]" = OrderedDict()
+        self._active: Optional[BuildJob] = None
+        self._lock = threading.Lock()
+
+    def submit(self, force_rebuild: bool = False) -> BuildJob:
+        """提交构建任务
+
+        Raises:
+            RuntimeError: 已有构建任务在运行（本进程或共用数据库目录的其他进程）
+        """
+        with self._lock:
+            if self._active is not None:
+                raise RuntimeError(f"已有构建任务在运行: {self._active.id}")
+            job = BuildJob(force_rebuild)
+            job.lock_file = self._acquire_build_lock()
+            self._jobs[job.id] = job
+            self._active = job
+            finished = [job_id for job_id, item in self._jobs.items() if item.finished]
+            for job_id in finished[:max(0, len(finished) - BUILD_JOB_HISTORY)]:
+                del self._jobs[job_id]
+        threading.Thread(target=self._run, args=(job,), name=f"vector-build-{job.id}", daemon=True).start()
+        logger.info(f"✓ 已提交向量数据库构建任务: {job.id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[BuildJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[BuildJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def active_job(self) -> Optional[BuildJob]:
+        with self._lock:
+            return self._active
+
+    def cancel(self, job_id: str) -> Optional[BuildJob]:
+        """取消任务（已结束的任务不受影响），任务不存在时返回None"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.cancel_requested = True
+        process = job.process
+        if process is not None:
+            # 不等待子进程退出（由任务线程等待），超时仍未退出时强制结束
+            self._signal(process)
+            timer = threading.Timer(BUILD_JOB_CANCEL_GRACE, self._signal, args=(process, True))
+            timer.daemon = True
+            timer.start()
+        logger.info(f"已请求取消向量数据库构建任务: {job.id}")
+        return job
+
+    def shutdown(self) -> None:
+        """服务退出时取消正在运行的任务，并等待子进程退出"""
+        job = self.active_job()
+        if job is not None:
+            job.cancel_requested = True
+            process = job.process
+            if process is not None:
+                self._terminate(process)
+
+    def build_locked_elsewhere(self) -> bool:
+        """共用数据库目录的其他进程是否正在构建（持有构建锁）"""
+        if fcntl is None or not os.path.exists(self._lock_path()):
+            return False
+        with open(self._lock_path(), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        return False
+
+    def _lock_path(self) -> str:
+        return f"{os.path.normpath(self.service.vector_db_path)}.build.lock"
+
+    def _acquire_build_lock(self):
+        """获取跨进程的构建锁，其他进程正在构建时抛出 RuntimeError"""
+        lock_file = open(self._lock_path(), "a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError("其他服务进程正在构建向量数据库")
+        return lock_file
+
+    def _build_path(self, job: BuildJob) -> str:
+        return f"{os.path.normpath(self.service.vector_db_path)}.build-{job.id}"
+
+    def _command(self, build_path: str) -> List[str]:
+        return [
+            sys.executable, os.path.abspath(__file__),
+            "--excel", os.path.abspath(self.service.excel_file_path),
+            "--output", os.path.abspath(build_path),
+            "--index-type", self.service.index_type,
+            "--index-params", json.dumps(self.service.index_params)
+        ]
+
+    def _run(self, job: BuildJob) -> None:
+        build_path = self._build_path(job)
+        try:
+            if job.cancel_requested:
+                job.status = STATUS_CANCELLED
+                return
+            job.status = STATUS_RUNNING
+            job.started_at = time.time()
+            # 子进程在独立的进程组中运行，取消时连同其分词进程池一起结束
+            job.process = subprocess.Popen(
+                self._command(build_path),
+                stdout=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                start_new_session=True
+            )
+            if job.cancel_requested:
+                self._terminate(job.process)
+            result = self._read_events(job)
+            return_code = job.process.wait()
+
+            if job.cancel_requested:
+                job.status = STATUS_CANCELLED
+                logger.info(f"向量数据库构建任务已取消: {job.id}")
+            elif return_code != 0 or result is None:
+                job.status = STATUS_FAILED
+                job.error = job.error or f"构建进程异常退出（返回码 {return_code}）"
+                logger.error(f"❌ 向量数据库构建任务失败: {job.id}，{job.error}")
+            else:
+                job.phase = "swapping"
+                if self.service.install_build(build_path):
+                    job.status = STATUS_SUCCEEDED
+                    logger.info(f"✅ 向量数据库构建任务完成: {job.id}，共 {result.get('count', 0)} 个文档")
+                else:
+                    job.status = STATUS_FAILED
+                    job.error = "新构建的向量数据库无法加载"
+        except Exception as e:
+            job.status = STATUS_FAILED
+            job.error = str(e)
+            logger.error(f"❌ 向量数据库构建任务出错: {job.id}，{str(e)}")
+        finally:
+            job.phase = job.status
+            job.finished_at = time.time()
+            if job.process is not None and job.process.poll() is None:
+                self._terminate(job.process)
+            job.process = None
+            # 切换成功后临时目录已成为当前数据库；其余情况删除未完成的构建结果
+            shutil.rmtree(build_path, ignore_errors=True)
+            # 构建进程与加载新数据库时在临时目录旁创建的跨进程写锁文件
+            write_lock_file = f"{build_path}.write.lock"
+            if os.path.exists(write_lock_file):
+                os.remove(write_lock_file)
+            if job.lock_file is not None:
+                job.lock_file.close()
+                job.lock_file = None
+            with self._lock:
+                if self._active is job:
+                    self._active = None
+
+    def _read_events(self, job: BuildJob) -> Optional[Dict]:
+        """读取子进程的进度事件，返回构建结果（失败时为None）"""
+        result = None
+        for line in job.process.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # 第三方库打印到标准输出的内容
+                logger.debug(line.rstrip())
+                continue
+            if not isinstance(event, dict):
+                continue
+            if event.get("event") == "progress":
+                field = _PROGRESS_FIELDS.get(event.get("stage"))
+                if field:
+                    setattr(job, field, int(event.get("count", 0)))
+                    job.phase = event["stage"]
+            elif event.get("event") == "done":
+                result = event
+            elif event.get("event") == "error":
+                job.error = event.get("message")
+        return result
+
+    @staticmethod
+    def _signal(process: subprocess.Popen, force: bool = False) -> None:
+        """结束子进程及其进程组（force 时强制结束）"""
+        if process.poll() is not None:
+            return
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+            elif force:
+                process.kill()
+            else:
+                process.terminate()
+        except ProcessLookupError:
+            pass
+
+    @classmethod
+    def _terminate(cls, process: subprocess.Popen) -> None:
+        """结束子进程，等待 BUILD_JOB_CANCEL_GRACE 秒后仍未退出则强制结束"""
+        cls._signal(process)
+        try:
+            process.wait(BUILD_JOB_CANCEL_GRACE)
+        except subprocess.TimeoutExpired:
+            cls._signal(process, force=True)
+            process.wait()
+
+
+def _emit(event: str, **fields) -> None:
+    print(json.dumps({"event": event, **fields}, ensure_ascii=False), flush=True)
+
+
+def main(argv=None) -> int:
+    """子进程入口：构建向量数据库到 --output 目录"""
+    parser = argparse.ArgumentParser(description="在独立进程中构建向量数据库")
+    parser.add_argument("--excel", required=True, help="文物表路径（Excel / CSV / Parquet）")
+    parser.add_argument("--output", required=True, help="新数据库的输出目录")
+    parser.add_argument("--index-type", default=None, help="索引类型")
+    parser.add_argument("--index-params", default="{}", help="索引参数（JSON）")
+    args = parser.parse_args(argv)
+
+    # 日志输出到标准错误（与服务进程共用控制台），标准输出只用于进度事件
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from vector_db_service import VectorDatabaseService, create_tokenize_pool
+
+    service = VectorDatabaseService(args.excel, args.output, args.index_type, json.loads(args.index_params))
+    # 构建期间复用同一个分词进程池（各文物块共用，不必每块重新启动工作进程）
+    service.tokenize_pool = create_tokenize_pool()
+    try:
+        success = service.build_vector_database(
+            force_rebuild=True,
+            progress=lambda stage, count: _emit("progress", stage=stage, count=count)
+        )
+    finally:
+        if service.tokenize_pool is not None:
+            service.tokenize_pool.shutdown()
+    if not success:
+        _emit("error", message="向量数据库构建失败，请检查日志")
+        return 1
+    _emit("done", count=service.document_count())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# 对话上下文构建：将数据库中的历史消息转换为发送给大模型的多模态消息
+#
+# 消息表中 content 只保存正文，图片等附件以 JSON 数组保存在 attachments 列中，
+# 构建上下文时图片附件转换为真正的 image_url 消息片段，不需要解析消息正文。
+# 上传的图片文件名是随机生成且不会被修改的，因此按文件ID缓存预处理后的图片（LRU，按字节数限制容量），
+# 连续多轮对话引用同一张图片时不再读取磁盘、解码和 base64 编码。
+import logging
+import os
+from typing import Dict, List, Optional
+
+from image_preprocess import PreparedImage, PreparedImageCache, prepare_image_bytes
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+# 图片片段缓存容量（字节）
+IMAGE_PART_CACHE_BYTES = int(os.environ.get("IMAGE_PART_CACHE_BYTES", 128 * 1024 * 1024))
+
+# 消息类型（messages.content_type）
+CONTENT_TYPE_TEXT = "text"
+CONTENT_TYPE_IMAGE = "image"
+
+
+def image_attachment(file_id: str) -> Dict:
+    """uploads 目录下的图片文件 -> 附件记录"""
+    return {"type": "image", "file_id": file_id}
+
+
+def attachment_url(attachment: Dict) -> str:
+    """附件的访问地址"""
+    return f"/uploads/{attachment['file_id']}"
+
+
+class ContextBuilder:
+    """历史消息 -> 大模型多模态消息（线程安全）"""
+
+    def __init__(self, uploads_dir: str = UPLOADS_DIR, cache_bytes: int = IMAGE_PART_CACHE_BYTES):
+        self.uploads_dir = uploads_dir
+        self.hits = 0
+        self.misses = 0
+        self._cache = PreparedImageCache(cache_bytes)
+        # 已确认不存在的文件，避免每轮对话重复尝试读取
+        self._missing = set()
+
+    def add_image(self, file_id: str, prepared: PreparedImage) -> None:
+        """登记刚保存的上传图片，下一轮对话引用时直接使用"""
+        self._missing.discard(file_id)
+        self._cache.put(file_id, prepared)
+
+    def image_part(self, file_id: str) -> Optional[Dict]:
+        """图片文件ID -> image_url 消息片段，文件不存在时返回None"""
+        prepared = self._cache.get(file_id)
+        if prepared is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # 文件ID只能是 uploads 目录下的文件名
+            if os.path.basename(file_id) != file_id or file_id in self._missing:
+                return None
+            path = os.path.join(self.uploads_dir, file_id)
+            try:
+                with open(path, "rb") as image_file:
+                    image_bytes = image_file.read()
+            except OSError as e:
+                self._missing.add(file_id)
+                logger.warning(f"⚠️ 读取历史图片失败: {file_id} - {str(e)}")
+                return None
+            prepared = prepare_image_bytes(image_bytes, file_id, use_cache=False)
+            self._cache.put(file_id, prepared)
+        return {"type": "image_url", "image_url": {"url": prepared.data_url}}
+
+    def build_message(self, role: str, content: str, attachments: Optional[List[Dict]] = None) -> Dict:
+        """单条历史消息 -> 大模型消息；带图片附件的消息转换为文本片段 + 图片片段"""
+        images = [att for att in attachments or () if att.get("type") == "image"]
+        if not images:
+            return {"role": role, "content": content}
+
+        parts = []
+        if content:
+            parts.append({"type": "text", "text": content})
+        for attachment in images:
+            part = self.image_part(attachment["file_id"])
+            if part is not None:
+                parts.append(part)
+        if not parts:
+            return {"role": role, "content": content}
+        return {"role": role, "content": parts}
+
+    def build_messages(self, messages: List[Dict]) -> List[Dict]:
+        """按时间顺序的历史消息（含 role / content / attachments）-> 大模型消息列表"""
+        return [self.build_message(msg["role"], msg["content"], msg.get("attachments")) for msg in messages]
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,80 @@
+# 对话上下文缓存：每个用户最近的若干条消息常驻内存
+#
+# 每轮对话都需要用户最近的 CONTEXT_WINDOW 条消息作为上下文。首次访问时从数据库读取并缓存，
+# 之后保存消息时同步追加到缓存（写穿透），常见的连续对话不再需要读库。
+# 缓存按用户数限制容量（LRU），并设置有效期（TTL）：多个服务进程同时写同一用户的消息时，
+# 其他进程的缓存最多在 TTL 后重新从数据库加载。
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+# 上下文窗口（条）、最多缓存的用户数、有效期（秒）
+CONTEXT_WINDOW = int(os.environ.get("CONTEXT_WINDOW", 5))
+CONTEXT_CACHE_MAX_USERS = int(os.environ.get("CONTEXT_CACHE_MAX_USERS", 10000))
+CONTEXT_CACHE_TTL = float(os.environ.get("CONTEXT_CACHE_TTL", 600))
+
+
+class ConversationContextCache:
+    """按用户缓存最近消息的 LRU + TTL 缓存（线程安全）"""
+
+    def __init__(self, window: int = CONTEXT_WINDOW, max_users: int = CONTEXT_CACHE_MAX_USERS,
+                 ttl: float = CONTEXT_CACHE_TTL):
+        self.window = window
+        self.max_users = max_users
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # user_id -> (最近消息, 加载时间)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[List[Dict]]:
+        """返回用户最近的消息（从旧到新），未缓存或已过期时返回None"""
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[user_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return list(entry[0])
+
+    def set(self, user_id: str, messages: List[Dict]) -> None:
+        """缓存从数据库读取的最近消息（从旧到新）"""
+        user_id = str(user_id)
+        with self._lock:
+            self._entries[user_id] = (deque(messages[-self.window:], maxlen=self.window), time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def append(self, user_id: str, message: Dict) -> None:
+        """消息保存成功后追加到缓存（用户未缓存时不处理，下次访问时从数据库加载）"""
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry[0].append(message)
+
+    def invalidate(self, user_id: str) -> None:
+        """删除用户的缓存（如保存失败，缓存与数据库可能不一致时）"""
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "users": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
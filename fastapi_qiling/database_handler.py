@@ -1,12 +1,111 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
 import pymysql
 from pymysql import Error
 from typing import List, Dict, Any, Optional
 from dbutils.pooled_db import PooledDB
 
+logger = logging.getLogger(__name__)
+
+# 连接池配置（可通过环境变量覆盖）
+# 每个 uvicorn worker 进程各有一个连接池，数据库总连接数约为 worker 数 × DB_POOL_MAX_CONNECTIONS；
+# 最大连接数应不小于数据库线程池大小（DB_THREAD_POOL_SIZE），否则线程会排队等待连接
+DB_POOL_MAX_CONNECTIONS = int(os.getenv("DB_POOL_MAX_CONNECTIONS", 10))
+DB_POOL_MIN_CACHED = int(os.getenv("DB_POOL_MIN_CACHED", 2))
+DB_POOL_MAX_CACHED = int(os.getenv("DB_POOL_MAX_CACHED", DB_POOL_MAX_CONNECTIONS))
+# 获取连接的最长等待时间（秒）
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 10))
+# 连接闲置超过该时间（秒）后，使用前先 ping 检查是否仍然有效
+DB_PING_IDLE_SECONDS = float(os.getenv("DB_PING_IDLE_SECONDS", 30))
+# 单个数据包上限（字节），需能容纳最大的消息与批量插入语句
+DB_MAX_ALLOWED_PACKET = int(os.getenv("DB_MAX_ALLOWED_PACKET", 64 * 1024 * 1024))
+
+
+class PoolMetrics:
+    """连接池使用指标（线程安全）"""
+
+    # 计算每秒取用次数的时间窗口（秒）
+    RATE_WINDOW = 60.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.pings = 0
+        self.reconnects = 0
+        self._recent_checkouts = deque()
+
+    def record_checkout(self, waited: float, blocked: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.checkouts += 1
+            if blocked:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+            self._recent_checkouts.append(now)
+            while self._recent_checkouts and now - self._recent_checkouts[0] > self.RATE_WINDOW:
+                self._recent_checkouts.popleft()
+
+    def record_checkin(self) -> None:
+        with self._lock:
+            self.in_use -= 1
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def record_ping(self, reconnected: bool = False) -> None:
+        with self._lock:
+            self.pings += 1
+            if reconnected:
+                self.reconnects += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            while self._recent_checkouts and now - self._recent_checkouts[0] > self.RATE_WINDOW:
+                self._recent_checkouts.popleft()
+            return {
+                "max_connections": DB_POOL_MAX_CONNECTIONS,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "checkouts_per_sec": len(self._recent_checkouts) / self.RATE_WINDOW,
+                "waits": self.waits,
+                "avg_wait_ms": self.wait_time / self.waits * 1000 if self.waits else 0.0,
+                "max_wait_ms": self.max_wait_time * 1000,
+                "timeouts": self.timeouts,
+                "pings": self.pings,
+                "reconnects": self.reconnects
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+def pool_stats() -> Dict[str, Any]:
+    """连接池指标"""
+    return pool_metrics.snapshot()
+
+
 class DatabaseHandler:
     """MySQL数据库操作类"""
     
     _pool = None
+    _pool_lock = threading.Lock()
+    # 限制同时取出的连接数，实现带超时的阻塞获取（PooledDB 本身只能无限等待）
+    _slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
     
     def __init__(self, host: str, port: int, user: str, password: str, database: str):
         """初始化数据库连接参数"""
@@ -17,41 +116,89 @@ class DatabaseHandler:
         self.database = database
         self.connection = None
         
-        # 初始化连接池
+        # 初始化连接池（每个进程一次）
         if DatabaseHandler._pool is None:
-            DatabaseHandler._pool = PooledDB(
-                creator=pymysql,
-                maxconnections=5,  # 最大连接数
-                mincached=2,        # 初始化时创建的连接数
-                maxcached=2,       # 连接池中最多闲置的连接数
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                passwd=self.password,
-                db=self.database,
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor,
-                init_command='SET sql_mode=STRICT_TRANS_TABLES',
-                connect_timeout=10,
-                max_allowed_packet=10240  #
-            )
+            with DatabaseHandler._pool_lock:
+                if DatabaseHandler._pool is None:
+                    DatabaseHandler._pool = PooledDB(
+                        creator=pymysql,
+                        maxconnections=DB_POOL_MAX_CONNECTIONS,  # 最大连接数
+                        mincached=DB_POOL_MIN_CACHED,            # 初始化时创建的连接数
+                        maxcached=DB_POOL_MAX_CACHED,            # 连接池中最多闲置的连接数
+                        blocking=True,
+                        ping=0,                                  # 由 _ensure_connection 按闲置时间决定是否 ping
+                        host=self.host,
+                        port=self.port,
+                        user=self.user,
+                        passwd=self.password,
+                        db=self.database,
+                        charset='utf8mb4',
+                        cursorclass=pymysql.cursors.DictCursor,
+                        init_command='SET sql_mode=STRICT_TRANS_TABLES',
+                        connect_timeout=10,
+                        max_allowed_packet=DB_MAX_ALLOWED_PACKET
+                    )
         
-    def connect(self) -> bool:
-        """从连接池获取数据库连接"""
+    def connect(self, timeout: Optional[float] = None) -> bool:
+        """从连接池获取数据库连接，连接池已满时最多等待 timeout 秒"""
+        if self.connection:
+            return True
+        timeout = DB_POOL_ACQUIRE_TIMEOUT if timeout is None else timeout
+        start_time = time.monotonic()
+        blocked = not DatabaseHandler._slots.acquire(blocking=False)
+        if blocked and not DatabaseHandler._slots.acquire(timeout=timeout):
+            pool_metrics.record_timeout()
+            logger.error(f"❌ 等待数据库连接超时（{timeout:.1f}秒），连接池已满: {pool_stats()}")
+            return False
         try:
             self.connection = DatabaseHandler._pool.connection()
-            print("成功从连接池获取MySQL数据库连接")
-            return True
-        except Error as e:
+        except Exception as e:
+            # 任何异常都要归还名额（不只是 pymysql.Error），否则名额逐渐耗尽，之后每次获取都会超时
+            DatabaseHandler._slots.release()
             print(f"从连接池获取连接时出错: {e}")
             return False
+        pool_metrics.record_checkout(time.monotonic() - start_time, blocked)
+        return True
             
     def close(self) -> None:
         """归还数据库连接到连接池"""
         if self.connection:
-            self.connection.close()
-            self.connection = None
-            print("已归还数据库连接到连接池")
+            self._mark_used()
+            try:
+                self.connection.close()
+            finally:
+                self.connection = None
+                pool_metrics.record_checkin()
+                DatabaseHandler._slots.release()
+
+    def _mark_used(self) -> None:
+        """记录底层连接的最后使用时间（连接归还后仍随底层连接保留在池中）"""
+        steady = getattr(self.connection, "_con", None)
+        if steady is not None:
+            steady._qiling_last_used = time.monotonic()
+
+    def _ensure_connection(self) -> bool:
+        """确保持有可用连接：闲置超过 DB_PING_IDLE_SECONDS 的连接先 ping，失效时换一个连接"""
+        if not self.connection and not self.connect():
+            return False
+        steady = getattr(self.connection, "_con", None)
+        last_used = getattr(steady, "_qiling_last_used", None)
+        if last_used is None:
+            # 新建的连接无需检查
+            self._mark_used()
+            return True
+        if time.monotonic() - last_used < DB_PING_IDLE_SECONDS:
+            return True
+        try:
+            self.connection.ping(reconnect=False)
+            pool_metrics.record_ping()
+        except Exception:
+            pool_metrics.record_ping(reconnected=True)
+            self.close()
+            if not self.connect():
+                return False
+        self._mark_used()
+        return True
             
     def execute_query(self, sql: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
         """
@@ -65,17 +212,9 @@ class DatabaseHandler:
         
         while retry_count < max_retries:
             try:
-                # 检查连接是否有效
-                if not self.connection:
-                    if not self.connect():
-                        return []
-                try:
-                    # 测试连接是否仍然有效
-                    self.connection.ping(reconnect=False)
-                except:
-                    self.close()
-                    if not self.connect():
-                        return []
+                # 获取连接；闲置较久的连接先检查是否仍然有效
+                if not self._ensure_connection():
+                    return []
                 
                 with self.connection.cursor() as cursor:
                     cursor.execute(sql, params or ())
@@ -109,17 +248,9 @@ class DatabaseHandler:
         
         while retry_count < max_retries:
             try:
-                # 检查连接是否有效
-                if not self.connection:
-                    if not self.connect():
-                        return 0
-                try:
-                    # 测试连接是否仍然有效
-                    self.connection.ping(reconnect=False)
-                except:
-                    self.close()
-                    if not self.connect():
-                        return 0
+                # 获取连接；闲置较久的连接先检查是否仍然有效
+                if not self._ensure_connection():
+                    return 0
                 
                 with self.connection.cursor() as cursor:
                     affected_rows = cursor.execute(sql, params or ())
@@ -143,7 +274,31 @@ class DatabaseHandler:
                 
         print(f"达到最大重试次数({max_retries})，放弃操作")
         return 0
-            
+
+    def execute_many(self, sql: str, params_list: List[tuple]) -> int:
+        """
+        批量执行插入语句（一次事务提交）
+        INSERT ... VALUES 语句会被驱动改写为多行插入，整批只需一次往返
+        :param sql: SQL语句
+        :param params_list: 每行的参数
+        :return: 受影响的行数，失败时抛出异常（调用方决定重试或逐行写入）
+        """
+        if not params_list:
+            return 0
+        if not self._ensure_connection():
+            raise Error("无法从连接池获取数据库连接")
+        try:
+            with self.connection.cursor() as cursor:
+                affected_rows = cursor.executemany(sql, params_list)
+            self.connection.commit()
+            return affected_rows
+        except Exception:
+            try:
+                self.connection.rollback()
+            except Exception:
+                pass
+            raise
+
     def __enter__(self):
         """支持with语句"""
         self.connect()
@@ -153,14 +308,27 @@ class DatabaseHandler:
         """支持with语句"""
         self.close()
 
+    def __del__(self):
+        """未显式关闭的处理器被回收时归还连接，避免占用的连接名额无法释放"""
+        try:
+            self.close()
+        except Exception:
+            pass
+
 # 快捷连接函数
+_lizi_config = None
+
 def get_lizi_connection():
-    """获取lizi数据库的连接，从环境变量读取配置"""
-    import os
-    return DatabaseHandler(
-        host=os.getenv("DB_HOST", "121.43.193.176"),
-        port=int(os.getenv("DB_PORT", 3306)),
-        user=os.getenv("DB_USER", "root"),
-        password=os.getenv("DB_PASSWORD", "123456"),
-        database=os.getenv("DB_NAME", "lizi")
-    )
\ No newline at end of file
+    """获取lizi数据库的连接，配置从环境变量读取一次后复用
+    返回的处理器只是连接池的轻量包装，连接在首次执行语句（或 connect）时才从池中取出
+    """
+    global _lizi_config
+    if _lizi_config is None:
+        _lizi_config = dict(
+            host=os.getenv("DB_HOST", "121.43.193.176"),
+            port=int(os.getenv("DB_PORT", 3306)),
+            user=os.getenv("DB_USER", "root"),
+            password=os.getenv("DB_PASSWORD", "123456"),
+            database=os.getenv("DB_NAME", "lizi")
+        )
+    return DatabaseHandler(**_lizi_config)
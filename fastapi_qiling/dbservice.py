@@ -1,6 +1,17 @@
+import json
 from database_handler import get_lizi_connection
 from datetime import datetime
 
+
+def _load_attachments(value):
+    """attachments 列（JSON）-> 列表；驱动返回的是 JSON 文本"""
+    if not value:
+        return []
+    if isinstance(value, (bytes, str)):
+        return json.loads(value)
+    return value
+
+
 class DatabaseService:
     @staticmethod
     def register_user(user_data):
@@ -128,9 +139,10 @@ class DatabaseService:
                 db.close()
 
     @staticmethod
-    def save_message(user_id, role, content, timestamp=None):
+    def save_message(user_id, role, content, timestamp=None, content_type="text", attachments=None):
         """保存消息到数据库，使用上下文管理器确保连接安全释放
         支持输入 string (UUID) 或 int (Snowflake ID) 的 user_id
+        content 只保存消息正文，图片等附件以列表形式传入 attachments（保存为 JSON 列）
         """
         import logging
         from datetime import datetime
@@ -149,11 +161,13 @@ class DatabaseService:
             
             with get_lizi_connection() as db:
                 insert_sql = """
-                INSERT INTO messages (userid, role, content, timestamp)
-                VALUES (%s, %s, %s, %s)
+                INSERT INTO messages (userid, role, content_type, content, attachments, timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s)
                 """
                 affected_rows = db.execute_update(insert_sql, (
-                    user_id, role, content, timestamp
+                    user_id, role, content_type, content,
+                    json.dumps(attachments, ensure_ascii=False) if attachments else None,
+                    timestamp
                 ))
                 
                 if affected_rows <= 0:
@@ -167,6 +181,32 @@ class DatabaseService:
             logging.error(f"保存消息失败 - 用户ID: {user_id}, 角色: {role}, 内容: {content[:100]}..., 错误: {str(e)}")
             return False
 
+    @staticmethod
+    def save_messages(messages):
+        """批量保存消息（一条多行 INSERT，一次提交），失败时抛出异常
+
+        Args:
+            messages: 字典列表，字段 user_id / role / content / timestamp / content_type / attachments，
+                按列表顺序插入（自增 id 即消息顺序）
+
+        Returns:
+            int: 受影响的行数
+        """
+        rows = [
+            (
+                int(msg["user_id"]), msg["role"], msg.get("content_type", "text"), msg["content"],
+                json.dumps(msg["attachments"], ensure_ascii=False) if msg.get("attachments") else None,
+                msg["timestamp"]
+            )
+            for msg in messages
+        ]
+        with get_lizi_connection() as db:
+            insert_sql = """
+            INSERT INTO messages (userid, role, content_type, content, attachments, timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """
+            return db.execute_many(insert_sql, rows)
+
     @staticmethod
     def get_recent_messages(user_id, limit=10):
         """获取用户最近的消息"""
@@ -174,11 +214,12 @@ class DatabaseService:
         try:
             db = get_lizi_connection()
             
+            # 使用 (userid, timestamp) 联合索引，无需排序
             query_sql = """
-            SELECT role, content, timestamp 
+            SELECT role, content_type, content, attachments, timestamp 
             FROM messages 
             WHERE userid = %s 
-            ORDER BY timestamp DESC 
+            ORDER BY timestamp DESC, id DESC 
             LIMIT %s
             """
             messages = db.execute_query(query_sql, (user_id, limit))
@@ -187,12 +228,13 @@ class DatabaseService:
                 print(f"未找到用户 {user_id} 的消息记录")
                 return []
             
-            # 只做基本格式转换，不处理图片
             formatted_messages = []
             for msg in reversed(messages):  # 反转顺序，从旧到新
                 formatted_messages.append({
                     "role": msg["role"],
-                    "content": msg["content"]
+                    "content_type": msg["content_type"],
+                    "content": msg["content"],
+                    "attachments": _load_attachments(msg["attachments"])
                 })
             
             print(f"成功获取 {len(formatted_messages)} 条消息")
@@ -206,27 +248,48 @@ class DatabaseService:
                 db.close()
 
     @staticmethod
-    def get_chat_history(user_id, limit=20):
-        """获取用户聊天历史（最新的在前）"""
+    def get_chat_history(user_id, limit=20, before=None):
+        """获取用户聊天历史（最新的在前）
+        
+        按 (timestamp, id) 游标分页：before 为上一页最后一条消息的 (timestamp, id)，
+        只返回排在它之后（更早）的消息。查询在 (userid, timestamp, id) 索引上定位后顺序读取，
+        翻到多深都只读取一页的数据。
+        """
         db = None
         try:
             db = get_lizi_connection()
             
-            query_sql = """
-            SELECT role, content, timestamp 
-            FROM messages 
-            WHERE userid = %s 
-            ORDER BY timestamp DESC 
-            LIMIT %s
-            """
-            messages = db.execute_query(query_sql, (user_id, limit))
+            if before is None:
+                query_sql = """
+                SELECT id, role, content_type, content, attachments, timestamp 
+                FROM messages 
+                WHERE userid = %s 
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT %s
+                """
+                params = (user_id, limit)
+            else:
+                # 等价于 (timestamp, id) < (%s, %s)，展开写法保证使用索引范围扫描
+                query_sql = """
+                SELECT id, role, content_type, content, attachments, timestamp 
+                FROM messages 
+                WHERE userid = %s AND timestamp <= %s AND (timestamp < %s OR id < %s) 
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT %s
+                """
+                before_timestamp, before_id = before
+                params = (user_id, before_timestamp, before_timestamp, before_id, limit)
+            messages = db.execute_query(query_sql, params)
             
             # 转换为前端需要的格式（保持时间降序）
             formatted_messages = []
             for msg in messages:
                 formatted_messages.append({
+                    "id": msg["id"],
                     "role": msg["role"],
+                    "content_type": msg["content_type"],
                     "content": msg["content"],
+                    "attachments": _load_attachments(msg["attachments"]),
                     "timestamp": msg["timestamp"].isoformat() if hasattr(msg["timestamp"], 'isoformat') else str(msg["timestamp"])
                 })
             
@@ -0,0 +1,235 @@
+# 文物文档存储：内存映射的字符串堆 + 偏移数组
+#
+# 文件布局（以 prefix 为前缀，{version} 为每次写入生成的版本号）：
+#   {prefix}.{version}.heap         所有字段的 UTF-8 字节依次拼接
+#   {prefix}.{version}.offsets.npy  int64 偏移数组，长度为 N*F+1，
+#                                   第 i 个文档的第 f 个字段为 heap[off[i*F+f]:off[i*F+f+1]]
+#   {prefix}.meta.json              当前版本号、字段列表与文档数
+#
+# 重新写入时先写出新版本的数据文件，再原子替换 meta.json 一次性发布，其他进程不会读到
+# 新偏移数组配旧数据的存储；上一个版本的数据文件保留到下次写入，供正在打开旧版本的读者使用。
+# 打开时只做内存映射，不解析任何内容；字段在访问时才解码，
+# 多个进程映射同一文件时共享操作系统的页缓存。
+import glob
+import json
+import mmap
+import os
+import uuid
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+STORE_VERSION = 1
+
+# 以独立字段存储的 metadata 键，其余键合并存入 extra（JSON）
+METADATA_FIELDS = ("artifact_name", "image_url", "number_period", "history", "craft")
+# 整数字段与JSON字段
+INT_FIELDS = ("index",)
+JSON_FIELDS = ("recognition_result", "extra")
+
+FIELDS = ("content",) + METADATA_FIELDS + INT_FIELDS + JSON_FIELDS
+
+
+def _meta_path(prefix: str) -> str:
+    return f"{prefix}.meta.json"
+
+
+def _data_files(prefix: str, version: Optional[str]) -> List[str]:
+    """某个版本的数据文件 (heap, offsets)；旧格式的存储没有版本号"""
+    if version is None:
+        return [f"{prefix}.heap", f"{prefix}.offsets.npy"]
+    return [f"{prefix}.{version}.heap", f"{prefix}.{version}.offsets.npy"]
+
+
+def _read_meta(prefix: str) -> Dict:
+    with open(_meta_path(prefix), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def store_files(prefix: str) -> List[str]:
+    """文档存储包含的所有文件（各版本的数据文件，最后一个为 meta.json）"""
+    pattern = glob.escape(prefix)
+    data_files = [path for path in _data_files(prefix, None) if os.path.exists(path)]
+    data_files += sorted(glob.glob(f"{pattern}.*.heap") + glob.glob(f"{pattern}.*.offsets.npy"))
+    return data_files + [_meta_path(prefix)]
+
+
+def store_exists(prefix: str) -> bool:
+    try:
+        meta = _read_meta(prefix)
+    except (OSError, ValueError):
+        return False
+    return all(os.path.exists(path) for path in _data_files(prefix, meta.get("data_version")))
+
+
+def _encode_document(doc: Dict) -> List[bytes]:
+    """将文档拆分为各字段的字节串"""
+    metadata = dict(doc.get("metadata", {}))
+    values = [doc.get("content", "")]
+    for name in METADATA_FIELDS:
+        values.append(metadata.pop(name, "") or "")
+    index = metadata.pop("index", None)
+    values.append("" if index is None else str(int(index)))
+    recognition_result = metadata.pop("recognition_result", None)
+    values.append(json.dumps(recognition_result, ensure_ascii=False) if recognition_result else "")
+    values.append(json.dumps(metadata, ensure_ascii=False) if metadata else "")
+    return [str(v).encode("utf-8") for v in values]
+
+
+class DocumentStoreWriter:
+    """顺序写入文档存储（支持流式追加，内存占用与文档内容无关）"""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        # 写入新版本的数据文件，关闭时才通过替换 meta.json 发布，避免读者看到写了一半的存储
+        self.version = uuid.uuid4().hex[:12]
+        self._heap_path, self._offsets_path = _data_files(prefix, self.version)
+        self._heap = open(self._heap_path, "wb")
+        self._offsets = array("q", [0])
+        self._position = 0
+        self.count = 0
+
+    def append(self, doc: Dict) -> int:
+        """追加一个文档，返回其行号"""
+        for value in _encode_document(doc):
+            self._heap.write(value)
+            self._position += len(value)
+            self._offsets.append(self._position)
+        self.count += 1
+        return self.count - 1
+
+    def extend(self, documents) -> None:
+        for doc in documents:
+            self.append(doc)
+
+    def close(self) -> None:
+        """写入偏移数组，再原子替换 meta.json 发布新版本，并清理更早版本的数据文件"""
+        self._heap.close()
+        offsets = np.frombuffer(self._offsets, dtype=np.int64)
+        with open(self._offsets_path, "wb") as f:
+            np.save(f, offsets)
+        try:
+            previous = _read_meta(self.prefix).get("data_version")
+        except (OSError, ValueError):
+            previous = None
+        meta_path = _meta_path(self.prefix)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": STORE_VERSION, "data_version": self.version,
+                       "fields": list(FIELDS), "count": self.count}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+        # 保留当前与上一个版本（可能有读者刚读到旧的 meta.json），其余版本删除
+        keep = set(_data_files(self.prefix, self.version) + _data_files(self.prefix, previous))
+        for path in store_files(self.prefix)[:-1]:
+            if path not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def discard(self) -> None:
+        """放弃写入，删除未发布的数据文件"""
+        self._heap.close()
+        for path in (self._heap_path, self._offsets_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def write_documents(prefix: str, documents) -> int:
+    """一次性写入全部文档，返回文档数"""
+    with DocumentStoreWriter(prefix) as writer:
+        writer.extend(documents)
+    return writer.count
+
+
+class DocumentStore:
+    """只读文档存储，行为类似于文档字典的列表（支持 len / 下标 / 迭代）"""
+
+    # 打开期间其他进程发布了新版本、旧版本文件已被删除时，重新读取 meta.json 的次数
+    OPEN_RETRIES = 3
+
+    def __init__(self, prefix: str):
+        for attempt in range(self.OPEN_RETRIES):
+            meta = _read_meta(prefix)
+            heap_path, offsets_path = _data_files(prefix, meta.get("data_version"))
+            try:
+                self._offsets = np.load(offsets_path, mmap_mode="r")
+                self._heap_file = open(heap_path, "rb")
+                break
+            except FileNotFoundError:
+                if attempt == self.OPEN_RETRIES - 1:
+                    raise
+        self.prefix = prefix
+        self.fields = meta["fields"]
+        self._field_pos = {name: i for i, name in enumerate(self.fields)}
+        self._count = int(meta["count"])
+        if os.fstat(self._heap_file.fileno()).st_size > 0:
+            self._heap = mmap.mmap(self._heap_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._heap = b""
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _raw(self, row: int, field_pos: int) -> bytes:
+        pos = row * len(self.fields) + field_pos
+        start, end = int(self._offsets[pos]), int(self._offsets[pos + 1])
+        return self._heap[start:end]
+
+    def get_field(self, row: int, name: str):
+        """只解码单个字段"""
+        if row < 0:
+            row += self._count
+        if not 0 <= row < self._count:
+            raise IndexError(f"文档行号越界: {row}")
+        text = self._raw(row, self._field_pos[name]).decode("utf-8")
+        if name in INT_FIELDS:
+            return int(text) if text else None
+        if name in JSON_FIELDS:
+            return json.loads(text) if text else None
+        return text
+
+    def __getitem__(self, row: int) -> Dict:
+        """解码一个完整文档：{"content": ..., "metadata": {...}}"""
+        row = int(row)
+        metadata = {}
+        for name in METADATA_FIELDS:
+            metadata[name] = self.get_field(row, name)
+        index = self.get_field(row, "index")
+        if index is not None:
+            metadata["index"] = index
+        recognition_result = self.get_field(row, "recognition_result")
+        if recognition_result:
+            metadata["recognition_result"] = recognition_result
+        extra = self.get_field(row, "extra")
+        if extra:
+            metadata.update(extra)
+        return {"content": self.get_field(row, "content"), "metadata": metadata}
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(self._count):
+            yield self[row]
+
+    def close(self) -> None:
+        if isinstance(self._heap, mmap.mmap):
+            self._heap.close()
+        self._heap_file.close()
+
+
+def open_document_store(prefix: str) -> Optional[DocumentStore]:
+    """打开文档存储，不存在时返回None"""
+    if not store_exists(prefix):
+        return None
+    return DocumentStore(prefix)
@@ -1,42 +1,132 @@
 import os
-import base64
 import json
 import requests
+import httpx
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from image_preprocess import prepare_image_file
+from task_executor import run_blocking
 
 # 加载环境变量
 load_dotenv()
 
+DEFAULT_BASE_URL = "https://aistudio.baidu.com/llm/lmapi/v3"
+
+# 连接池与超时配置（秒），可通过环境变量覆盖
+ERNIE_POOL_SIZE = int(os.environ.get("ERNIE_POOL_SIZE", 20))
+ERNIE_CONNECT_TIMEOUT = float(os.environ.get("ERNIE_CONNECT_TIMEOUT", 10))
+ERNIE_READ_TIMEOUT = float(os.environ.get("ERNIE_READ_TIMEOUT", 120))
+
+
+def _format_http_error(status_code, error_data=None, detail=""):
+    """将HTTP错误状态码转换为可读的错误信息"""
+    if status_code == 400:
+        # 400错误通常是请求格式问题
+        if error_data is not None:
+            return f"请求格式错误: {error_data.get('error', detail)}"
+        return f"HTTP 400错误: 请求格式不正确 - {detail}"
+    elif status_code == 401:
+        return "API密钥无效或已过期"
+    elif status_code == 403:
+        return "API访问权限不足"
+    elif status_code == 429:
+        return "API调用频率限制"
+    else:
+        return f"HTTP错误 {status_code}: {detail}"
+
+
+def _extract_message_content(result):
+    """从非流式响应中提取回复内容，格式异常时返回错误信息"""
+    # 检查API返回的错误信息
+    if 'error' in result:
+        return f"API错误: {result['error']}"
+        
+    if 'choices' not in result or len(result['choices']) == 0:
+        return "API返回格式异常: 缺少choices字段"
+        
+    if 'message' not in result['choices'][0]:
+        return "API返回格式异常: 缺少message字段"
+        
+    return result['choices'][0]['message']['content']
+
+
+def _parse_sse_line(line):
+    """解析一行SSE数据
+
+    Returns:
+        tuple: (是否结束, 增量文本)。非数据行返回 (False, None)
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if not line.startswith("data:"):
+        return False, None
+    
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return True, None
+    
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        return False, None
+    
+    if 'error' in chunk:
+        return True, f"API错误: {chunk['error']}"
+    
+    choices = chunk.get("choices") or []
+    if not choices:
+        return False, None
+    
+    delta = choices[0].get("delta") or {}
+    return False, delta.get("content") or None
+
+
 class ERNIE4_5MultimodalClient:
-    def __init__(self):
+    def __init__(self, base_url=None, timeout=None):
         """
         初始化 ERNIE 4.5 多模态客户端
+        
+        Args:
+            base_url: API地址，默认读取环境变量 ERNIE_BASE_URL（便于指向本地模拟服务）
+            timeout: (连接超时, 读取超时)，默认读取环境变量
         """
         self.api_key = os.environ.get("AI_STUDIO_API_KEY")
-        self.base_url = "https://aistudio.baidu.com/llm/lmapi/v3"
+        self.base_url = base_url or os.environ.get("ERNIE_BASE_URL", DEFAULT_BASE_URL)
         self.model = "ernie-4.5-vl-28b-a3b"  # ERNIE-4.5-VL-28B-A3B 的模型参数值
+        self.timeout = timeout or (ERNIE_CONNECT_TIMEOUT, ERNIE_READ_TIMEOUT)
         
         if not self.api_key:
             raise ValueError("AI_STUDIO_API_KEY 环境变量未设置")
+        
+        # 复用连接（HTTP keep-alive），避免每次请求重新握手
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=ERNIE_POOL_SIZE, pool_maxsize=ERNIE_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        })
     
-    def _make_request(self, messages, stream=False):
+    def _make_request(self, messages, stream=False, timeout=None):
         """
         发送请求到百度文心 API
+        
+        stream=True 时返回逐段产出文本的生成器，否则返回完整回复文本
         """
-        url = f"{self.base_url}/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        if stream:
+            return self._stream_request(messages, timeout=timeout)
         
+        url = f"{self.base_url}/chat/completions"
         payload = {
             "model": self.model,
             "messages": messages,
-            "stream": stream
+            "stream": False
         }
         
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.session.post(url, json=payload, timeout=timeout or self.timeout)
             response.raise_for_status()
             
             # 检查响应状态
@@ -50,40 +140,48 @@ class ERNIE4_5MultimodalClient:
                     pass
                 return error_msg
             
-            result = response.json()
-            
-            # 检查API返回的错误信息
-            if 'error' in result:
-                return f"API错误: {result['error']}"
-                
-            if 'choices' not in result or len(result['choices']) == 0:
-                return "API返回格式异常: 缺少choices字段"
-                
-            if 'message' not in result['choices'][0]:
-                return "API返回格式异常: 缺少message字段"
-                
-            return result['choices'][0]['message']['content']
+            return _extract_message_content(response.json())
                 
         except requests.exceptions.HTTPError as e:
+            error_data = None
             if response.status_code == 400:
-                # 400错误通常是请求格式问题
                 try:
                     error_data = response.json()
-                    return f"请求格式错误: {error_data.get('error', str(e))}"
                 except:
-                    return f"HTTP 400错误: 请求格式不正确 - {str(e)}"
-            elif response.status_code == 401:
-                return "API密钥无效或已过期"
-            elif response.status_code == 403:
-                return "API访问权限不足"
-            elif response.status_code == 429:
-                return "API调用频率限制"
-            else:
-                return f"HTTP错误 {response.status_code}: {str(e)}"
+                    pass
+            return _format_http_error(response.status_code, error_data, str(e))
                 
         except Exception as e:
             return f"请求异常: {str(e)}"
     
+    def _stream_request(self, messages, timeout=None):
+        """
+        流式请求：解析SSE并逐段产出回复文本
+        """
+        url = f"{self.base_url}/chat/completions"
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True
+        }
+        
+        try:
+            with self.session.post(url, json=payload, stream=True, timeout=timeout or self.timeout) as response:
+                if response.status_code != 200:
+                    yield _format_http_error(response.status_code, detail=response.reason)
+                    return
+                
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    done, text = _parse_sse_line(line)
+                    if text:
+                        yield text
+                    if done:
+                        return
+        except Exception as e:
+            yield f"请求异常: {str(e)}"
+    
     def text_only_query(self, prompt):
         """
         纯文本查询
@@ -135,8 +233,8 @@ class ERNIE4_5MultimodalClient:
         """
         图片base64输入查询
         """
-        # 编码图片为base64
-        base64_image = self.encode_image(image_path)
+        # 缩小、重新编码后转为 data URL
+        image_data_url = self.encode_image_data_url(image_path)
         
         messages = [
             {
@@ -149,7 +247,7 @@ class ERNIE4_5MultimodalClient:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": image_data_url
                         }
                     }
                 ]
@@ -159,10 +257,15 @@ class ERNIE4_5MultimodalClient:
     
     def encode_image(self, image_path):
         """
-        将图片编码为base64
+        将图片编码为base64（先缩小并重新编码，结果按文件缓存）
         """
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode("utf-8")
+        return prepare_image_file(image_path).base64
+    
+    def encode_image_data_url(self, image_path):
+        """
+        将图片编码为带正确MIME类型的data URL
+        """
+        return prepare_image_file(image_path).data_url
     
     def multimodal_stream(self, text_prompt, image_url=None, image_path=None):
         """
@@ -178,11 +281,10 @@ class ERNIE4_5MultimodalClient:
                 }
             })
         elif image_path:
-            base64_image = self.encode_image(image_path)
             content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_image}"
+                    "url": self.encode_image_data_url(image_path)
                 }
             })
         
@@ -190,6 +292,143 @@ class ERNIE4_5MultimodalClient:
         
         return self._make_request(messages, stream=True)
 
+class AsyncERNIE4_5MultimodalClient:
+    """ERNIE 4.5 多模态异步客户端
+
+    基于 httpx.AsyncClient，复用连接池（HTTP keep-alive），支持单次调用超时与SSE流式输出。
+    """
+    
+    def __init__(self, base_url=None, max_connections=None, timeout=None):
+        """
+        初始化异步客户端
+        
+        Args:
+            base_url: API地址，默认读取环境变量 ERNIE_BASE_URL
+            max_connections: 连接池最大连接数，默认读取环境变量 ERNIE_POOL_SIZE
+            timeout: 默认读取超时（秒）
+        """
+        self.api_key = os.environ.get("AI_STUDIO_API_KEY")
+        self.base_url = base_url or os.environ.get("ERNIE_BASE_URL", DEFAULT_BASE_URL)
+        self.model = "ernie-4.5-vl-28b-a3b"
+        
+        if not self.api_key:
+            raise ValueError("AI_STUDIO_API_KEY 环境变量未设置")
+        
+        max_connections = max_connections or ERNIE_POOL_SIZE
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}"
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            timeout=httpx.Timeout(timeout or ERNIE_READ_TIMEOUT, connect=ERNIE_CONNECT_TIMEOUT)
+        )
+    
+    def _timeout(self, timeout):
+        """构造单次调用的超时设置，None表示使用客户端默认值"""
+        if timeout is None:
+            return httpx.USE_CLIENT_DEFAULT
+        return httpx.Timeout(timeout, connect=ERNIE_CONNECT_TIMEOUT)
+    
+    async def chat_completion(self, messages, timeout=None):
+        """
+        非流式对话，返回完整回复文本
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": False
+        }
+        
+        try:
+            response = await self.client.post("/chat/completions", json=payload, timeout=self._timeout(timeout))
+            if response.status_code != 200:
+                error_data = None
+                if response.status_code == 400:
+                    try:
+                        error_data = response.json()
+                    except:
+                        pass
+                return _format_http_error(response.status_code, error_data, response.reason_phrase)
+            
+            return _extract_message_content(response.json())
+        except httpx.TimeoutException:
+            return "请求超时，请稍后再试"
+        except Exception as e:
+            return f"请求异常: {str(e)}"
+    
+    async def chat_completion_stream(self, messages, timeout=None):
+        """
+        流式对话，异步逐段产出回复文本
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True
+        }
+        
+        try:
+            async with self.client.stream("POST", "/chat/completions", json=payload, timeout=self._timeout(timeout)) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    yield _format_http_error(response.status_code, detail=response.reason_phrase)
+                    return
+                
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    done, text = _parse_sse_line(line)
+                    if text:
+                        yield text
+                    if done:
+                        return
+        except httpx.TimeoutException:
+            yield "请求超时，请稍后再试"
+        except Exception as e:
+            yield f"请求异常: {str(e)}"
+    
+    async def text_only_query(self, prompt, timeout=None):
+        """
+        纯文本查询
+        """
+        messages = [{"role": "user", "content": prompt}]
+        return await self.chat_completion(messages, timeout=timeout)
+    
+    def text_only_stream(self, prompt, timeout=None):
+        """
+        纯文本流式输出（异步生成器）
+        """
+        messages = [{"role": "user", "content": prompt}]
+        return self.chat_completion_stream(messages, timeout=timeout)
+    
+    async def multimodal_stream(self, text_prompt, image_url=None, image_path=None, timeout=None):
+        """
+        多模态流式输出（异步生成器）
+        本地图片的解码、缩小与重新编码在线程池中执行，不阻塞事件循环
+        """
+        content = [{"type": "text", "text": text_prompt}]
+        
+        if image_url:
+            content.append({"type": "image_url", "image_url": {"url": image_url}})
+        elif image_path:
+            prepared_image = await run_blocking("io", prepare_image_file, image_path)
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": prepared_image.data_url}
+            })
+        
+        messages = [{"role": "user", "content": content}]
+        async for text in self.chat_completion_stream(messages, timeout=timeout):
+            yield text
+    
+    async def aclose(self):
+        """关闭连接池"""
+        await self.client.aclose()
+
 def quick_test():
     """
     快速测试函数
@@ -1,72 +1,161 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import os
+import json
 import uuid
 import time
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
 import logging
 from logging_config import setup_logging
 from dbservice import DatabaseService
+from database_handler import pool_stats
 # 导入大模型客户端
-from ernie_multimodal import ERNIE4_5MultimodalClient
+from ernie_multimodal import ERNIE4_5MultimodalClient, AsyncERNIE4_5MultimodalClient
 # 导入向量数据库和文物识别服务
 from vector_db_service import VectorDatabaseService
+from build_jobs import BuildJobManager
 from artifact_recognition_service import ArtifactRecognitionService
+# 图片发送给大模型前的缩小与重新编码
+from image_preprocess import prepare_image_bytes
+# 历史消息 -> 多模态上下文
+from context_builder import CONTENT_TYPE_IMAGE, CONTENT_TYPE_TEXT, ContextBuilder, attachment_url, image_attachment
+# 每个用户最近消息的写穿透缓存
+from context_cache import CONTEXT_WINDOW, ConversationContextCache
+# 消息异步批量写入
+from message_writer import MessageWriter
+# 阻塞任务线程池
+from task_executor import run_llm, run_db, run_search, run_blocking, shutdown_executors
+# 各组件的启动状态
+from readiness import STARTING_STATUSES, STATUS_FAILED, STATUS_LOADING, STATUS_READY, STATUS_UNAVAILABLE, ReadinessRegistry
 
 # 初始化日志系统
 logger = setup_logging()
+readiness = ReadinessRegistry()
 
 # 初始化大模型客户端
 try:
     multimodal_client = ERNIE4_5MultimodalClient()
     logger.info("大模型客户端初始化成功")
+    readiness.register("llm", STATUS_READY)
 except Exception as e:
     logger.error(f"大模型客户端初始化失败: {str(e)}")
     multimodal_client = None
+    readiness.register("llm", STATUS_FAILED, str(e))
+
+# 初始化异步大模型客户端（连接池 + 流式输出，用于对话接口）
+try:
+    async_multimodal_client = AsyncERNIE4_5MultimodalClient()
+    logger.info("异步大模型客户端初始化成功")
+    readiness.register("llm_async", STATUS_READY)
+except Exception as e:
+    logger.error(f"异步大模型客户端初始化失败: {str(e)}")
+    async_multimodal_client = None
+    readiness.register("llm_async", STATUS_FAILED, str(e))
 
 # 初始化文物识别服务
 try:
     recognition_service = ArtifactRecognitionService()
     logger.info("文物识别服务初始化成功")
+    readiness.register("recognition", STATUS_READY)
 except Exception as e:
     logger.error(f"文物识别服务初始化失败: {str(e)}")
     recognition_service = None
+    readiness.register("recognition", STATUS_FAILED, str(e))
+
+# 对话上下文构建器（按文件ID缓存历史图片）与最近消息缓存
+context_builder = ContextBuilder()
+context_cache = ConversationContextCache()
+
+# 消息写入队列：后台线程批量写入数据库，对话接口不等待提交
+def _invalidate_unsaved_context(messages):
+    """消息未能写入数据库时，删除已写穿透到缓存中的这些用户的上下文，下次访问时从数据库重新加载"""
+    for user_id in {message["user_id"] for message in messages}:
+        context_cache.invalidate(user_id)
+
+message_writer = MessageWriter(DatabaseService.save_messages, on_failure=_invalidate_unsaved_context)
+message_writer.start()
 
-# 初始化向量数据库服务
+# 初始化向量数据库服务：此处只创建对象，词嵌入模型与索引在服务启动后由 _warm_up 在后台加载，
+# 构建在后台任务中进行（见 build_jobs.py）
 try:
-    vector_db_service = VectorDatabaseService()
-    # 如果向量数据库不存在，尝试自动构建（需要Excel文件存在）
-    if not vector_db_service.is_ready():
-        logger.info("向量数据库不存在，尝试自动构建...")
-        # 检查Excel文件是否存在
-        import os
-        excel_file = "./故宫博物院数字文物库.xlsx"
-        if os.path.exists(excel_file):
-            logger.info(f"找到Excel文件: {excel_file}，开始构建向量数据库...")
-            logger.info("⚠️  首次构建可能需要几分钟时间，请耐心等待...")
-            build_success = vector_db_service.build_vector_database(force_rebuild=False)
-            if build_success:
-                logger.info("✅ 向量数据库构建成功！")
-            else:
-                logger.warning("⚠️  向量数据库构建失败，相关功能可能无法使用")
-                logger.warning("   您可以通过 API 接口 /api/vector-db/build 手动构建")
-        else:
-            logger.warning(f"⚠️  Excel文件不存在: {excel_file}")
-            logger.warning("   向量数据库功能将不可用，请确保Excel文件存在后再构建")
-            logger.warning("   构建方法：调用 API 接口 POST /api/vector-db/build")
-    else:
-        logger.info("✅ 向量数据库加载成功")
+    vector_db_service = VectorDatabaseService(load=False)
+    build_jobs = BuildJobManager(vector_db_service)
+    readiness.register("vector_db", check=vector_db_service.is_ready)
 except Exception as e:
     logger.error(f"向量数据库服务初始化失败: {str(e)}")
     import traceback
     traceback.print_exc()
     vector_db_service = None
+    build_jobs = None
+    readiness.register("vector_db", STATUS_FAILED, str(e))
+
+def _start_initial_build():
+    """向量数据库不存在时，在后台提交首次构建任务（需要Excel文件存在），不阻塞服务启动"""
+    excel_file = vector_db_service.excel_file_path
+    if os.path.exists(excel_file):
+        try:
+            job = build_jobs.submit()
+        except RuntimeError as e:
+            # 多 worker 部署时由其中一个进程构建，其余进程在构建完成后自动加载
+            logger.info(f"向量数据库不存在，{str(e)}，构建完成后自动加载")
+            readiness.set("vector_db", STATUS_UNAVAILABLE, str(e))
+            return
+        logger.info(f"向量数据库不存在，已在后台开始构建（任务ID: {job.id}），构建完成前搜索功能不可用")
+        logger.info("   构建进度：GET /api/vector-db/build/{job_id}")
+        readiness.set("vector_db", STATUS_UNAVAILABLE, f"正在构建（任务ID: {job.id}）")
+    else:
+        logger.warning(f"⚠️  Excel文件不存在: {excel_file}")
+        logger.warning("   向量数据库功能将不可用，请确保Excel文件存在后再构建")
+        logger.warning("   构建方法：调用 API 接口 POST /api/vector-db/build")
+        readiness.set("vector_db", STATUS_UNAVAILABLE, "向量数据库不存在")
+
+async def _warm_up():
+    """后台加载词嵌入模型与向量数据库；加载完成前对话不附带文物检索结果，搜索接口返回 503"""
+    if not vector_db_service:
+        return
+    readiness.set("vector_db", STATUS_LOADING)
+    try:
+        ready = await run_blocking("build", vector_db_service.warm_up)
+    except Exception as e:
+        logger.error(f"❌ 向量数据库预热失败: {str(e)}")
+        readiness.set("vector_db", STATUS_FAILED, str(e))
+        return
+    # 其他 worker 进程修改或重建数据库后，本进程自动加载新版本
+    vector_db_service.start_generation_watcher()
+    if ready:
+        logger.info(f"✅ 向量数据库加载成功，包含 {vector_db_service.document_count()} 个文档")
+        readiness.set("vector_db", STATUS_READY)
+    elif vector_db_service.embedding_model is None:
+        readiness.set("vector_db", STATUS_FAILED, "词嵌入模型加载失败")
+    elif vector_db_service._vector_db_exists():
+        readiness.set("vector_db", STATUS_FAILED, "向量数据库加载失败")
+    else:
+        _start_initial_build()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 不等待预热完成，服务立即开始接受请求
+    warm_up_task = asyncio.create_task(_warm_up())
+    yield
+    if not warm_up_task.done():
+        warm_up_task.cancel()
+    # 结束正在运行的构建子进程（未完成的构建结果会被删除）
+    if build_jobs:
+        build_jobs.shutdown()
+    # 应用退出时关闭连接池与线程池，等待进行中的任务完成
+    if async_multimodal_client:
+        await async_multimodal_client.aclose()
+    shutdown_executors(wait=True)
+    # 最后写完队列中的消息（此时不会再有新消息入队）
+    message_writer.close()
 
 # 创建FastAPI应用实例
-app = FastAPI(title="Qiling API", version="1.0.0")
+app = FastAPI(title="Qiling API", version="1.0.0", lifespan=lifespan)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -77,10 +166,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 用于存储聊天记录和对话上下文
-user_messages = {}
-user_contexts = {}
-
 # 保留中间件结构但不做认证检查
 @app.middleware("http")
 async def pass_through_middleware(request: Request, call_next):
@@ -134,21 +219,76 @@ class SearchQuery(BaseModel):
     top_k: int = 5
     use_enhanced: bool = True
     image_weight: float = 0.3
+    nprobe: Optional[int] = None      # IVF索引查询的聚类数
+    ef_search: Optional[int] = None   # HNSW索引查询的搜索深度
+
+class ArtifactUpsertRequest(BaseModel):
+    rows: List[Dict[str, Any]]        # 列名与Excel一致，可选 artifact_id
+
+class ArtifactDeleteRequest(BaseModel):
+    ids: List[str]
 
-# 健康检查接口
+# 健康检查接口（存活探针：进程能处理请求即返回200，附带各组件的启动状态）
+# status 与原接口相同始终为 healthy（前端 healthAPI 与已有的监控依赖该字段），整体启动状态见 state
 @app.get("/api/health")
 async def health_check():
     log_request('健康检查')
-    return {"status": "healthy"}
+    return {"status": "healthy", **readiness.snapshot()}
+
+# 就绪探针：仍有组件在加载时返回503
+@app.get("/api/health/ready")
+async def readiness_check():
+    snapshot = readiness.snapshot()
+    if not snapshot["ready"]:
+        return JSONResponse(status_code=503, content=snapshot)
+    return snapshot
+
+# 缓存命中率等运行指标
+@app.get("/api/metrics")
+async def get_metrics():
+    log_request('运行指标')
+    metrics = {
+        "context_cache": context_cache.stats(),
+        "context_images": context_builder.stats(),
+        "message_writer": message_writer.stats(),
+        "db_pool": pool_stats()
+    }
+    if vector_db_service:
+        metrics["search_cache"] = vector_db_service.result_cache.stats()
+    if recognition_service:
+        if recognition_service.cache is not None:
+            metrics["recognition_cache"] = recognition_service.cache.stats()
+        if recognition_service.image_index is not None:
+            metrics["image_index"] = recognition_service.image_index.stats()
+    return metrics
+
+# 辅助函数：将上传的图片写入 uploads 目录，返回保存路径（文件读写较慢，通过 run_blocking("io", ...) 调用）
+def _write_upload(file_ext, content):
+    uploads_dir = os.path.join(os.path.dirname(__file__), "uploads")
+    os.makedirs(uploads_dir, exist_ok=True)
+    file_path = os.path.join(uploads_dir, f"{uuid.uuid4().hex}.{file_ext}")
+    with open(file_path, "wb") as buffer:
+        buffer.write(content)
+    return file_path
 
 # 辅助函数：处理消息中的图片路径
 def process_message_content(message):
-    # 直接返回原始消息内容，不处理base64编码
-    return {
+    # 不处理base64编码；图片消息的 content 仍按前端约定的 {"text", "image_path"} JSON 返回
+    attachments = [{**att, "url": attachment_url(att)} for att in message.get("attachments") or []]
+    content = message["content"]
+    images = [att for att in attachments if att.get("type") == "image"]
+    if images:
+        content = json.dumps({"text": content, "image_path": images[0]["url"]}, ensure_ascii=False)
+    processed = {
         "role": message["role"],
-        "content": message["content"],
+        "content": content,
+        "content_type": message.get("content_type", "text"),
+        "attachments": attachments,
         "timestamp": message["timestamp"].isoformat() if hasattr(message["timestamp"], 'isoformat') else str(message["timestamp"])
     }
+    if "id" in message:
+        processed["id"] = str(message["id"])
+    return processed
 
 # 从数据库获取最新的5条聊天消息
 @app.get("/api/chat/latest")
@@ -156,7 +296,8 @@ async def get_latest_messages(x_user_id: str = Header(...)):
     log_request('获取最新消息')
     try:
         # 从数据库获取最近5条消息
-        messages = DatabaseService.get_chat_history(x_user_id, 5)
+        await _wait_for_pending_messages(x_user_id)
+        messages = await run_db(DatabaseService.get_chat_history, x_user_id, 5)
         # 处理每条消息的图片路径
         processed_messages = [process_message_content(msg) for msg in messages]
         return {"history": processed_messages, "count": len(processed_messages)}
@@ -164,19 +305,46 @@ async def get_latest_messages(x_user_id: str = Header(...)):
         logger.error(f"获取最新消息失败: {str(e)}")
         return {"history": [], "count": 0}
 
-# 获取聊天历史（20条）
+# 聊天历史每页最大条数
+MAX_HISTORY_PAGE_SIZE = 100
+
+# 辅助函数：解析聊天历史游标 "<timestamp>,<id>"
+def _parse_history_cursor(before: str):
+    try:
+        timestamp, message_id = before.rsplit(",", 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标 before，格式应为 <timestamp>,<id>")
+
+# 辅助函数：由一页中最后（最早）一条消息生成下一页游标
+def _format_history_cursor(message):
+    return f"{message['timestamp']},{message['id']}"
+
+# 获取聊天历史（按游标分页，默认每页20条）
 @app.get("/api/chat/history")
-async def get_chat_history(x_user_id: str = Header(...)):
+async def get_chat_history(x_user_id: str = Header(...), limit: int = 20, before: Optional[str] = None):
     log_request('获取聊天历史')
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+    cursor = _parse_history_cursor(before) if before else None
     try:
-        # 从数据库获取聊天历史
-        messages = DatabaseService.get_chat_history(x_user_id, 20)
+        # 多取一条用于判断是否还有更早的消息
+        await _wait_for_pending_messages(x_user_id)
+        messages = await run_db(DatabaseService.get_chat_history, x_user_id, limit + 1, cursor)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
         # 处理每条消息的图片路径
         processed_messages = [process_message_content(msg) for msg in messages]
-        return {"history": processed_messages, "count": len(processed_messages)}
+        # 下一页游标：本页最后（最早）一条消息的 (timestamp, id)
+        next_before = _format_history_cursor(messages[-1]) if has_more else None
+        return {
+            "history": processed_messages,
+            "count": len(processed_messages),
+            "has_more": has_more,
+            "next_before": next_before
+        }
     except Exception as e:
         logger.error(f"获取聊天历史失败: {str(e)}")
-        return {"history": [], "count": 0}
+        return {"history": [], "count": 0, "has_more": False, "next_before": None}
 
 # 用户注册
 @app.post("/api/auth/register")
@@ -196,7 +364,7 @@ async def register(user_data: UserRegister):
     
     try:
         # 调用数据库服务进行注册
-        result, status_code = DatabaseService.register_user(user_data.dict())
+        result, status_code = await run_db(DatabaseService.register_user, user_data.dict())
         
         if status_code == 200:
             return {"success": True, "message": "User registered successfully", "data": {"user_id": result['user_id']}}
@@ -216,7 +384,8 @@ async def login(credentials: UserLogin):
     
     try:
         # 使用数据库服务进行登录验证
-        user, error = DatabaseService.get_user_by_credentials(
+        user, error = await run_db(
+            DatabaseService.get_user_by_credentials,
             credentials.username, 
             credentials.password
         )
@@ -299,18 +468,14 @@ async def upload_send(
         raise HTTPException(status_code=400, detail="描述不能为空")
     
     # 保存文件
-    uploads_dir = os.path.join(os.path.dirname(__file__), "uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
-    file_path = os.path.join(uploads_dir, f"{uuid.uuid4().hex}.{file_ext}")
-    with open(file_path, "wb") as buffer:
-        content = await image.read()
-        buffer.write(content)
+    content = await image.read()
+    file_path = await run_blocking("io", _write_upload, file_ext, content)
     
     # 调用文物识别服务识别图片
     recognition_result = None
     if recognition_service and recognition_service.is_ready():
         try:
-            recognition_result = recognition_service.recognize_and_format(file_path)
+            recognition_result = await run_llm(recognition_service.recognize_and_format, file_path)
             logger.info(f"文物识别结果: {recognition_result}")
         except Exception as e:
             logger.error(f"文物识别失败: {str(e)}")
@@ -327,9 +492,12 @@ async def upload_send(
                 artifact_name = recognition_result.get("artifact_name", "")
                 rec_description = recognition_result.get("description", "")
                 enhanced_description = f"{description}\n\n识别结果：\n文物类型：{artifact_type}\n文物名称：{artifact_name}\n介绍：{rec_description}"
-            
+                matched_artifact = recognition_result.get("matched_artifact")
+                if matched_artifact:
+                    enhanced_description += f"\n文物库匹配：{matched_artifact.get('artifact_name', '')}（{matched_artifact.get('number_period', '')}）"
+
             # 调用大模型进行分析
-            ai_response = multimodal_client.image_base64_query(file_path, enhanced_description)
+            ai_response = await run_llm(multimodal_client.image_base64_query, file_path, enhanced_description)
             
             # 记录大模型响应
             logger.info(f"大模型响应: {ai_response}")
@@ -344,7 +512,7 @@ async def upload_send(
     file_info = {
         "original_name": image.filename,
         "saved_name": os.path.basename(file_path),
-        "file_size": os.path.getsize(file_path),
+        "file_size": len(content),
         "content_type": image.content_type
     }
     
@@ -365,15 +533,14 @@ async def upload_send(
     
     return response_data
 
-# 发送消息（支持上下文对话）
-@app.post("/api/chat/send")
-async def send_message(
-    message: str = Form(...),
-    x_user_id: str = Header(...),
-    image: Optional[UploadFile] = File(None)
-):
-    log_request('发送消息')
-    
+# 辅助函数：构建发送给大模型的对话消息（当前消息 + 历史上下文 + 向量检索增强）
+async def _prepare_chat_turn(message, x_user_id, image):
+    """准备一轮对话所需的数据
+
+    Returns:
+        tuple: (messages_to_send, image_bytes, vector_search_results, error_response)
+        error_response 不为 None 时表示请求无效，应直接返回
+    """
     # 构建当前消息
     current_message = {
         "role": "user",
@@ -388,70 +555,46 @@ async def send_message(
         })
     
     # 处理图片（如果有）
+    image_bytes = None
     if image:
         try:
             # 文件类型检查（参考/api/send接口）
             allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
             file_ext = image.filename.split('.')[-1].lower()
             if file_ext not in allowed_extensions:
-                return JSONResponse(
+                return None, None, [], JSONResponse(
                     status_code=400,
                     content={"success": False, "message": "不支持的文件类型"}
                 )
             
-            # 读取图片内容并转换为base64（参考multimodal_client.image_base64_query）
-            content = await image.read()
-            import base64
-            image_base64 = base64.b64encode(content).decode('utf-8')
+            # 读取图片内容，缩小并重新编码（解码等CPU操作在线程池中执行）
+            image_bytes = await image.read()
+            prepared_image = await run_blocking("io", prepare_image_bytes, image_bytes, image.filename)
             
-            # 添加图片到消息内容（使用base64格式，参考multimodal_client.image_base64_query）
+            # 添加图片到消息内容（data URL 的 MIME 类型与实际编码一致）
             current_message["content"].append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/{file_ext};base64,{image_base64}"}
+                "image_url": {"url": prepared_image.data_url}
             })
         except Exception as e:
             logger.error(f"图片处理失败: {str(e)}")
-            return JSONResponse(
+            return None, None, [], JSONResponse(
                 status_code=500,
                 content={"success": False, "message": "图片处理失败"}
             )
     
-    # 从数据库获取最近5条消息作为上下文
+    # 获取最近的消息作为上下文（优先使用缓存，未命中时从数据库读取）
     try:
-        context_messages = DatabaseService.get_recent_messages(x_user_id, 5)
-        
-        # 处理历史消息中的图片路径
-        processed_messages = []
-        for msg in context_messages:
-            content = msg["content"]
-            
-            # 处理包含图片路径的消息
-            if content.startswith("{") and content.endswith("}"):
-                try:
-                    import ast
-                    content_dict = ast.literal_eval(content)
-                    if "image_path" in content_dict:
-                        # 读取图片并转换为base64
-                        image_path = content_dict["image_path"].lstrip("/")
-                        full_path = os.path.join(os.path.dirname(__file__), image_path)
-                        
-                        if os.path.exists(full_path):
-                            with open(full_path, "rb") as image_file:
-                                image_data = image_file.read()
-                                import base64
-                                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                                file_ext = os.path.splitext(full_path)[1].lstrip(".")
-                                content_dict["image_url"] = f"data:image/{file_ext};base64,{image_base64}"
-                                content = str(content_dict)
-                except Exception as e:
-                    logger.error(f"处理图片消息时出错: {str(e)}")
-            
-            processed_messages.append({
-                "role": msg["role"],
-                "content": content
-            })
+        context_messages = context_cache.get(x_user_id)
+        if context_messages is None:
+            await _wait_for_pending_messages(x_user_id)
+            context_messages = await run_db(DatabaseService.get_recent_messages, x_user_id, CONTEXT_WINDOW)
+            # 没有消息（新用户或读取失败）时不缓存，保存消息后下次访问再加载
+            if context_messages:
+                context_cache.set(x_user_id, context_messages)
         
-        context_messages = processed_messages
+        # 历史消息中的图片转换为 image_url 片段（按文件ID缓存，命中时不读盘、不重新编码）
+        context_messages = await run_blocking("io", context_builder.build_messages, context_messages)
     except Exception as e:
         logger.error(f"获取上下文失败: {str(e)}")
         context_messages = []
@@ -463,7 +606,8 @@ async def send_message(
     if message and message.strip() and vector_db_service and vector_db_service.is_ready():
         try:
             # 使用增强搜索查找相关文物
-            vector_search_results = vector_db_service.search_enhanced(
+            vector_search_results = await run_search(
+                vector_db_service.search_enhanced,
                 query_text=message,
                 top_k=3,
                 image_weight=0.3
@@ -488,46 +632,96 @@ async def send_message(
         except Exception as e:
             logger.error(f"向量搜索失败: {str(e)}")
     
+    return messages_to_send, image_bytes, vector_search_results, None
+
+# 辅助函数：读取数据库中的消息前，等待该用户已入队的消息写入完成
+async def _wait_for_pending_messages(x_user_id):
+    if message_writer.has_pending(x_user_id):
+        await run_blocking("io", message_writer.flush, 5.0)
+
+# 辅助函数：保存一条消息（放入写入队列，不等待数据库提交），并写穿透到上下文缓存
+# （最终未能写入数据库时由 _invalidate_unsaved_context 使该用户的缓存失效）
+def _save_message(x_user_id, role, content, timestamp, content_type=CONTENT_TYPE_TEXT, attachments=None):
+    try:
+        message_writer.submit(x_user_id, role, content, timestamp, content_type, attachments)
+    except (ValueError, RuntimeError) as e:
+        logger.warning(f"保存消息失败 - 用户ID: {x_user_id}, 角色: {role}: {str(e)}")
+        return False
+    context_cache.append(x_user_id, {
+        "role": role,
+        "content_type": content_type,
+        "content": content,
+        "attachments": attachments or []
+    })
+    return True
+
+# 辅助函数：保存一轮对话（用户消息 + AI回复）
+# 回复已经生成，保存失败只记录日志，不影响返回给用户的回复；图片无法保存时仍保存文字与回复，不会只保存半轮对话
+async def _save_chat_turn(x_user_id, message, image, image_bytes, ai_response):
+    try:
+        # 保存用户消息（使用当前时间戳）
+        user_timestamp = datetime.now()
+        attachments = None
+        if image:
+            try:
+                # 保存图片到本地（复用已读取的图片内容）
+                file_ext = image.filename.split('.')[-1].lower()
+                image_filename = os.path.basename(await run_blocking("io", _write_upload, file_ext, image_bytes))
+                # 本轮已预处理过该图片（命中预处理缓存），登记后下一轮直接作为上下文使用
+                context_builder.add_image(image_filename, await run_blocking("io", prepare_image_bytes, image_bytes, image.filename))
+                attachments = [image_attachment(image_filename)]
+            except Exception as e:
+                logger.error(f"保存上传图片失败，只保存文字消息 - 用户ID: {x_user_id}: {str(e)}")
+        
+        if attachments:
+            # 保存用户消息（正文 + 图片附件）
+            _save_message(x_user_id, "user", message or "", user_timestamp, CONTENT_TYPE_IMAGE, attachments)
+        else:
+            # 保存纯文本用户消息
+            _save_message(x_user_id, "user", message or "", user_timestamp)
+        
+        # 保存AI回复：按入队顺序写入，自增 id 保证同一秒内用户消息排在回复之前
+        if ai_response:
+            _save_message(x_user_id, "assistant", ai_response, datetime.now())
+    except Exception as e:
+        logger.error(f"保存对话失败 - 用户ID: {x_user_id}: {str(e)}")
+
+# 辅助函数：格式化相关文物列表
+def _format_related_artifacts(vector_search_results):
+    return [
+        {
+            "artifact_name": r.get("metadata", {}).get("artifact_name", ""),
+            "number_period": r.get("metadata", {}).get("number_period", ""),
+            "score": r.get("score", 0.0)
+        }
+        for r in vector_search_results
+    ] if vector_search_results else []
+
+# 发送消息（支持上下文对话）
+@app.post("/api/chat/send")
+async def send_message(
+    message: str = Form(...),
+    x_user_id: str = Header(...),
+    image: Optional[UploadFile] = File(None)
+):
+    log_request('发送消息')
+    
+    messages_to_send, image_bytes, vector_search_results, error_response = await _prepare_chat_turn(
+        message, x_user_id, image
+    )
+    if error_response is not None:
+        return error_response
+    
     # 调用大模型生成回复
     ai_response = ""
-    if multimodal_client:
+    if async_multimodal_client:
         try:
-            ai_response = multimodal_client._make_request(messages_to_send)
-            
-            # 保存用户消息（使用当前时间戳）
-            user_timestamp = datetime.now()
-            if image:
-                # 保存图片到本地
-                uploads_dir = os.path.join(os.path.dirname(__file__), "uploads")
-                os.makedirs(uploads_dir, exist_ok=True)
-                file_ext = image.filename.split('.')[-1].lower()
-                image_filename = f"{uuid.uuid4().hex}.{file_ext}"
-                image_path = os.path.join(uploads_dir, image_filename)
-                
-                with open(image_path, "wb") as buffer:
-                    content = await image.read()
-                    buffer.write(content)
-                
-                # 保存用户消息（包含图片路径）
-                user_message_content = {
-                    "text": message,
-                    "image_path": f"/uploads/{image_filename}"
-                }
-                DatabaseService.save_message(x_user_id, "user", str(user_message_content), user_timestamp)
-            else:
-                # 保存纯文本用户消息
-                DatabaseService.save_message(x_user_id, "user", message, user_timestamp)
-            
-            # 保存AI回复（延迟1秒保存）
-            if ai_response:
-                import time
-                time.sleep(1)  # 延迟1秒
-                ai_timestamp = datetime.now()
-                DatabaseService.save_message(x_user_id, "assistant", ai_response, ai_timestamp)
-                
+            ai_response = await async_multimodal_client.chat_completion(messages_to_send)
         except Exception as e:
             logger.error(f"大模型处理失败: {str(e)}")
             ai_response = "抱歉，大模型处理出现问题，请稍后再试。"
+        else:
+            await _save_chat_turn(x_user_id, message, image, image_bytes, ai_response)
     else:
         ai_response = "大模型服务不可用，这是模拟响应。"
     
@@ -536,17 +730,60 @@ async def send_message(
         "data": {
             "ai_response": ai_response,
             "timestamp": datetime.now().isoformat(),
-            "related_artifacts": [
-                {
-                    "artifact_name": r.get("metadata", {}).get("artifact_name", ""),
-                    "number_period": r.get("metadata", {}).get("number_period", ""),
-                    "score": r.get("score", 0.0)
-                }
-                for r in vector_search_results
-            ] if vector_search_results else []
+            "related_artifacts": _format_related_artifacts(vector_search_results)
         }
     }
 
+# 发送消息（流式输出，SSE）
+@app.post("/api/chat/send/stream")
+async def send_message_stream(
+    message: str = Form(...),
+    x_user_id: str = Header(...),
+    image: Optional[UploadFile] = File(None)
+):
+    """与 /api/chat/send 参数相同，以 text/event-stream 逐段返回回复
+
+    事件格式：
+        data: {"delta": "..."}                       回复增量
+        data: {"done": true, "related_artifacts": []} 结束事件
+    """
+    log_request('发送消息（流式）')
+    
+    messages_to_send, image_bytes, vector_search_results, error_response = await _prepare_chat_turn(
+        message, x_user_id, image
+    )
+    if error_response is not None:
+        return error_response
+    
+    async def event_stream():
+        chunks = []
+        if async_multimodal_client:
+            try:
+                async for delta in async_multimodal_client.chat_completion_stream(messages_to_send):
+                    chunks.append(delta)
+                    yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+            except Exception as e:
+                logger.error(f"大模型流式处理失败: {str(e)}")
+                error_text = "抱歉，大模型处理出现问题，请稍后再试。"
+                yield f"data: {json.dumps({'delta': error_text}, ensure_ascii=False)}\n\n"
+            else:
+                await _save_chat_turn(x_user_id, message, image, image_bytes, "".join(chunks))
+        else:
+            yield f"data: {json.dumps({'delta': '大模型服务不可用，这是模拟响应。'}, ensure_ascii=False)}\n\n"
+        
+        done_event = {
+            "done": True,
+            "timestamp": datetime.now().isoformat(),
+            "related_artifacts": _format_related_artifacts(vector_search_results)
+        }
+        yield f"data: {json.dumps(done_event, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # 向量数据库搜索接口
 @app.post("/api/search")
 async def search_artifacts(search_query: SearchQuery):
@@ -565,15 +802,21 @@ async def search_artifacts(search_query: SearchQuery):
     
     try:
         if search_query.use_enhanced:
-            results = vector_db_service.search_enhanced(
+            results = await run_search(
+                vector_db_service.search_enhanced,
                 query_text=search_query.query,
                 top_k=search_query.top_k,
-                image_weight=search_query.image_weight
+                image_weight=search_query.image_weight,
+                nprobe=search_query.nprobe,
+                ef_search=search_query.ef_search
             )
         else:
-            results = vector_db_service.search_normal(
+            results = await run_search(
+                vector_db_service.search_normal,
                 query_text=search_query.query,
-                top_k=search_query.top_k
+                top_k=search_query.top_k,
+                nprobe=search_query.nprobe,
+                ef_search=search_query.ef_search
             )
         
         # 格式化返回结果
@@ -602,41 +845,179 @@ async def search_artifacts(search_query: SearchQuery):
         logger.error(f"搜索失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
+def _reject_during_build():
+    """构建任务完成时会整体替换数据库，期间的增量修改会丢失，因此拒绝执行（包括其他 worker 发起的构建）"""
+    if not build_jobs:
+        return
+    job = build_jobs.active_job()
+    if job is not None:
+        raise HTTPException(status_code=409, detail=f"向量数据库正在构建（任务ID: {job.id}），请在构建完成后重试")
+    if build_jobs.build_locked_elsewhere():
+        raise HTTPException(status_code=409, detail="其他服务进程正在构建向量数据库，请在构建完成后重试")
+
 # 构建向量数据库接口
-@app.post("/api/vector-db/build")
+@app.post("/api/vector-db/build", status_code=202)
 async def build_vector_database(force_rebuild: bool = False):
-    """构建向量数据库
+    """提交向量数据库构建任务（在独立进程中执行，构建期间搜索继续使用当前数据库）
     
     Args:
-        force_rebuild: 是否强制重建（删除已存在的数据库）
+        force_rebuild: 是否强制重建（数据库已存在时也重新构建）
     
     Returns:
-        构建结果
+        构建任务信息，通过 GET /api/vector-db/build/{job_id} 查询进度
     """
     log_request('构建向量数据库')
     
     if not vector_db_service:
         raise HTTPException(status_code=503, detail="向量数据库服务不可用")
+    if readiness.status("vector_db") in STARTING_STATUSES:
+        raise HTTPException(status_code=503, detail="向量数据库正在加载，请稍后再试")
     
-    try:
-        success = vector_db_service.build_vector_database(force_rebuild=force_rebuild)
-        
-        if success:
-            return {
-                "success": True,
-                "message": "向量数据库构建成功",
-                "data": {
-                    "document_count": len(vector_db_service.documents) if vector_db_service.documents else 0
-                }
+    if not force_rebuild and vector_db_service.is_ready():
+        return {
+            "success": True,
+            "message": "向量数据库已存在，如需重新构建请设置 force_rebuild=true",
+            "data": {
+                "document_count": vector_db_service.document_count(),
+                "index_type": vector_db_service.index_meta.get("index_type")
             }
-        else:
+        }
+    
+    try:
+        job = build_jobs.submit(force_rebuild=force_rebuild)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {
+        "success": True,
+        "message": "向量数据库构建任务已提交",
+        "data": job.to_dict()
+    }
+
+# 查询构建任务进度接口
+@app.get("/api/vector-db/build/{job_id}")
+async def get_build_job(job_id: str):
+    """查询构建任务的状态与进度（已读取 / 已向量化 / 已加入索引的行数）"""
+    job = build_jobs.get(job_id) if build_jobs else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="构建任务不存在")
+    data = job.to_dict()
+    if job.status == "succeeded":
+        data["document_count"] = vector_db_service.document_count()
+        data["index_type"] = vector_db_service.index_meta.get("index_type")
+    return {"success": True, "data": data}
+
+# 取消构建任务接口
+@app.post("/api/vector-db/build/{job_id}/cancel")
+async def cancel_build_job(job_id: str):
+    """取消构建任务（当前数据库不受影响）"""
+    log_request('取消构建任务')
+    job = build_jobs.cancel(job_id) if build_jobs else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="构建任务不存在")
+    return {
+        "success": True,
+        "message": "构建任务已结束" if job.finished else "已请求取消构建任务",
+        "data": job.to_dict()
+    }
+
+# 同步文物表接口
+@app.post("/api/vector-db/sync")
+async def sync_vector_database():
+    """将Excel文物表的变化同步到向量数据库（只重新向量化新增或变化的行）
+    
+    Returns:
+        各类变更的数量
+    """
+    log_request('同步文物表')
+    
+    if not vector_db_service:
+        raise HTTPException(status_code=503, detail="向量数据库服务不可用")
+    _reject_during_build()
+    
+    try:
+        stats = await run_blocking("build", vector_db_service.sync_catalogue)
+        if stats is None:
             return {
                 "success": False,
-                "message": "向量数据库构建失败，请检查日志"
+                "message": "同步文物表失败，请检查日志"
+            }
+        return {
+            "success": True,
+            "message": "文物表同步完成",
+            "data": {**stats, "document_count": vector_db_service.document_count()}
+        }
+    except Exception as e:
+        logger.error(f"同步文物表失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"同步失败: {str(e)}")
+
+# 增量新增/更新文物接口
+@app.post("/api/vector-db/artifacts")
+async def upsert_artifacts(request: ArtifactUpsertRequest):
+    """新增或更新文物（写入增量日志，无需重建向量数据库）
+    
+    Args:
+        request: 文物数据列表
+    
+    Returns:
+        各条数据对应的文物ID
+    """
+    log_request('增量更新文物')
+    
+    if not vector_db_service or not vector_db_service.index:
+        raise HTTPException(status_code=503, detail="向量数据库服务不可用")
+    _reject_during_build()
+    
+    try:
+        artifact_ids = await run_blocking("build", vector_db_service.upsert_artifacts, request.rows)
+        return {
+            "success": True,
+            "message": f"已更新 {len(artifact_ids)} 个文物",
+            "data": {
+                "artifact_ids": [str(artifact_id) for artifact_id in artifact_ids],
+                "document_count": vector_db_service.document_count()
             }
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"构建向量数据库失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"构建失败: {str(e)}")
+        logger.error(f"增量更新文物失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
+
+# 增量删除文物接口
+@app.post("/api/vector-db/artifacts/delete")
+async def delete_artifacts(request: ArtifactDeleteRequest):
+    """按文物ID删除文物
+    
+    Args:
+        request: 文物ID列表
+    
+    Returns:
+        实际删除的文物数
+    """
+    log_request('删除文物')
+    
+    if not vector_db_service or not vector_db_service.index:
+        raise HTTPException(status_code=503, detail="向量数据库服务不可用")
+    _reject_during_build()
+    
+    try:
+        artifact_ids = [int(artifact_id) for artifact_id in request.ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="文物ID格式错误")
+    
+    try:
+        deleted = await run_blocking("build", vector_db_service.delete_artifacts, artifact_ids)
+        return {
+            "success": True,
+            "message": f"已删除 {deleted} 个文物",
+            "data": {
+                "deleted_count": deleted,
+                "document_count": vector_db_service.document_count()
+            }
+        }
+    except Exception as e:
+        logger.error(f"删除文物失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
 
 # 图片识别接口
 @app.post("/api/recognize")
@@ -662,18 +1043,13 @@ async def recognize_artifact(
     if file_ext not in allowed_extensions:
         raise HTTPException(status_code=400, detail="不支持的文件类型")
     
-    # 保存文件
-    uploads_dir = os.path.join(os.path.dirname(__file__), "uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
-    file_path = os.path.join(uploads_dir, f"{uuid.uuid4().hex}.{file_ext}")
-    
     try:
-        with open(file_path, "wb") as buffer:
-            content = await image.read()
-            buffer.write(content)
+        # 保存文件
+        content = await image.read()
+        file_path = await run_blocking("io", _write_upload, file_ext, content)
         
         # 识别文物
-        recognition_result = recognition_service.recognize_and_format(file_path)
+        recognition_result = await run_llm(recognition_service.recognize_and_format, file_path)
         
         # 如果向量数据库可用，基于识别结果搜索相似文物
         similar_artifacts = []
@@ -682,7 +1058,8 @@ async def recognize_artifact(
                 # 构建搜索查询
                 search_query = f"{recognition_result.get('artifact_type', '')} {recognition_result.get('artifact_name', '')}"
                 if search_query.strip():
-                    similar_artifacts = vector_db_service.search_enhanced(
+                    similar_artifacts = await run_search(
+                        vector_db_service.search_enhanced,
                         query_text=search_query,
                         top_k=5,
                         image_weight=0.3
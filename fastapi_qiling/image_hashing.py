@@ -0,0 +1,290 @@
+# 感知哈希近重复图片检索
+#
+# 对图片计算 64 位 pHash（DCT 低频系数与中位数比较）和 dHash（相邻像素梯度），
+# 重新编码、缩放、轻微裁剪或调色后的同一张照片哈希值只相差少数几位。
+# 以 pHash 建多索引哈希表按汉明距离检索，候选结果再用 dHash 复核，降低误匹配。
+#
+# 索引条目持久化在 SQLite 中，API 服务记录已识别的上传图片，离线构建脚本记录文物库图片，
+# 两者共用同一个文件；内存中的索引按自增ID增量同步其他进程新写入的条目。
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_HASH_INDEX_PATH = os.environ.get("IMAGE_HASH_INDEX_PATH", "./data/image_hashes.db")
+# pHash 汉明距离阈值（64位中不同的位数），以及 dHash 复核阈值
+IMAGE_HASH_MAX_DISTANCE = int(os.environ.get("IMAGE_HASH_MAX_DISTANCE", 8))
+IMAGE_HASH_MAX_DHASH_DISTANCE = int(os.environ.get("IMAGE_HASH_MAX_DHASH_DISTANCE", 14))
+# 同步其他进程写入的条目的最小间隔（秒）
+IMAGE_HASH_SYNC_INTERVAL = float(os.environ.get("IMAGE_HASH_SYNC_INTERVAL", 30))
+
+# 条目来源
+SOURCE_UPLOAD = "upload"
+SOURCE_CATALOGUE = "catalogue"
+
+_PHASH_SIZE = 32
+_PHASH_LOW = 8
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """DCT-II 正交变换矩阵"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def compute_image_hashes(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """计算图片的 (pHash, dHash)，无法解码时返回None"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # JPEG 可直接按缩小的尺寸解码，大图也只需几毫秒
+            image.draft("L", (_PHASH_SIZE * 2, _PHASH_SIZE * 2))
+            gray = image.convert("L")
+            pixels = np.asarray(gray.resize((_PHASH_SIZE, _PHASH_SIZE), Image.LANCZOS), dtype=np.float64)
+            small = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    except Exception as e:
+        logger.warning(f"⚠️ 无法计算图片哈希: {str(e)}")
+        return None
+
+    low = (_DCT @ pixels @ _DCT.T)[:_PHASH_LOW, :_PHASH_LOW]
+    phash = _bits_to_int(low > np.median(low))
+    dhash = _bits_to_int(small[:, 1:] > small[:, :-1])
+    return phash, dhash
+
+
+class MultiIndexHash:
+    """汉明距离多索引哈希
+
+    将 64 位哈希切成 4 段 16 位，每段建一张哈希表。两个哈希的距离不超过 r 时，
+    至少有一段的距离不超过 r // 4（抽屉原理），因此查询时只需在每段中枚举该半径内的取值，
+    再对候选计算完整距离。对均匀分布的哈希也能保持亚毫秒级查询（BK-tree 在 64 位空间中剪枝效果很差）。
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self._tables: List[Dict[int, List[Tuple[int, object]]]] = [{} for _ in range(self.CHUNKS)]
+        self._size = 0
+        # 半径 -> 16位内不超过该半径的所有翻转掩码
+        self._masks: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _chunks(self, value: int) -> List[int]:
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def _flip_masks(self, radius: int) -> List[int]:
+        if radius not in self._masks:
+            self._masks[radius] = [m for m in range(1 << self.CHUNK_BITS) if bin(m).count("1") <= radius]
+        return self._masks[radius]
+
+    def add(self, value: int, key) -> None:
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, []).append((value, key))
+        self._size += 1
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, object]]:
+        """返回距离不超过 max_distance 的 (distance, key)，按距离升序"""
+        masks = self._flip_masks(max_distance // self.CHUNKS)
+        seen = set()
+        results = []
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for mask in masks:
+                for candidate, key in table.get(chunk ^ mask, ()):
+                    if (candidate, key) in seen:
+                        continue
+                    seen.add((candidate, key))
+                    distance = hamming_distance(value, candidate)
+                    if distance <= max_distance:
+                        results.append((distance, key))
+        results.sort(key=lambda item: item[0])
+        return results
+
+
+def _to_signed(value: int) -> int:
+    """SQLite 的 INTEGER 为有符号64位"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    """已识别图片的近重复检索索引（线程安全）"""
+
+    def __init__(self, path: str = IMAGE_HASH_INDEX_PATH,
+                 max_distance: int = IMAGE_HASH_MAX_DISTANCE,
+                 max_dhash_distance: int = IMAGE_HASH_MAX_DHASH_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_dhash_distance = max_dhash_distance
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._tree = MultiIndexHash()
+        # (source, key) -> 条目；索引中存的是 (source, key)，被替换的旧哈希查询时过滤
+        self._entries: Dict[Tuple[str, str], Dict] = {}
+        self._max_id = 0
+        self._synced_at = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                entry_key TEXT NOT NULL,
+                phash INTEGER NOT NULL,
+                dhash INTEGER NOT NULL,
+                recognition TEXT,
+                artifact TEXT,
+                created_at REAL NOT NULL,
+                UNIQUE (source, entry_key)
+            )
+        """)
+        self._conn.commit()
+        with self._lock:
+            self._sync()
+        logger.info(f"✓ 近重复图片索引加载完成，包含 {len(self._entries)} 张图片")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _sync(self) -> None:
+        """载入自上次同步以来新增或替换的条目（需持有锁）"""
+        rows = self._conn.execute(
+            "SELECT id, source, entry_key, phash, dhash, recognition, artifact FROM image_hashes "
+            "WHERE id > ? ORDER BY id",
+            (self._max_id,)
+        ).fetchall()
+        for row_id, source, entry_key, phash, dhash, recognition, artifact in rows:
+            self._add_entry(source, entry_key, _to_unsigned(phash), _to_unsigned(dhash),
+                            json.loads(recognition) if recognition else None,
+                            json.loads(artifact) if artifact else None)
+            self._max_id = max(self._max_id, row_id)
+        self._synced_at = time.monotonic()
+
+    def _add_entry(self, source, entry_key, phash, dhash, recognition, artifact) -> None:
+        key = (source, entry_key)
+        previous = self._entries.get(key)
+        self._entries[key] = {"source": source, "key": entry_key, "phash": phash, "dhash": dhash,
+                              "recognition": recognition, "artifact": artifact}
+        if previous is None or previous["phash"] != phash:
+            self._tree.add(phash, key)
+
+    def add(self, source: str, entry_key: str, hashes: Tuple[int, int],
+            recognition: Optional[Dict] = None, artifact: Optional[Dict] = None) -> None:
+        """记录一张图片（同一来源的同一 key 重复记录时覆盖）
+
+        Args:
+            source: 来源（upload / catalogue）
+            entry_key: 条目标识（上传图片为内容SHA-256，文物库图片为图片地址）
+            hashes: compute_image_hashes 的结果
+            recognition: 识别结果（artifact_type / artifact_name / confidence / description）
+            artifact: 文物库信息（文物名称、编号-年代、图片地址等）
+        """
+        self.add_many([(source, entry_key, hashes, recognition, artifact)])
+
+    def add_many(self, entries: List[Tuple[str, str, Tuple[int, int], Optional[Dict], Optional[Dict]]]) -> None:
+        """批量记录图片（一次事务提交），每项为 add 的参数元组"""
+        now = time.time()
+        rows = [
+            (source, entry_key, _to_signed(hashes[0]), _to_signed(hashes[1]),
+             json.dumps(recognition, ensure_ascii=False) if recognition else None,
+             json.dumps(artifact, ensure_ascii=False) if artifact else None,
+             now)
+            for source, entry_key, hashes, recognition, artifact in entries
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO image_hashes "
+                "(source, entry_key, phash, dhash, recognition, artifact, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._sync()
+
+    def lookup(self, hashes: Tuple[int, int], source: Optional[str] = None,
+               require_recognition: bool = False) -> Optional[Dict]:
+        """查找最相近的图片
+
+        Args:
+            hashes: 查询图片的 (pHash, dHash)
+            source: 只在指定来源中查找
+            require_recognition: 只返回带识别结果的条目
+
+        Returns:
+            dict: 条目（附 distance 字段），未找到时返回None
+        """
+        phash, dhash = hashes
+        with self._lock:
+            if time.monotonic() - self._synced_at > IMAGE_HASH_SYNC_INTERVAL:
+                self._sync()
+            for distance, key in self._tree.search(phash, self.max_distance):
+                entry = self._entries.get(key)
+                # 条目被替换为新哈希后，旧哈希的距离与条目当前哈希不一致，跳过
+                if entry is None or hamming_distance(entry["phash"], phash) != distance:
+                    continue
+                if source is not None and entry["source"] != source:
+                    continue
+                if require_recognition and not entry["recognition"]:
+                    continue
+                if hamming_distance(entry["dhash"], dhash) > self.max_dhash_distance:
+                    continue
+                self.hits += 1
+                return {**entry, "distance": distance}
+            self.misses += 1
+        return None
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+def open_near_duplicate_index(path: Optional[str] = None) -> Optional[NearDuplicateIndex]:
+    """打开近重复图片索引；路径配置为空、未安装 Pillow 或打开失败时返回None"""
+    path = IMAGE_HASH_INDEX_PATH if path is None else path
+    if not path:
+        return None
+    try:
+        import PIL  # noqa: F401
+        return NearDuplicateIndex(path)
+    except Exception as e:
+        logger.warning(f"⚠️ 打开近重复图片索引失败，将不使用近重复检索: {str(e)}")
+        return None
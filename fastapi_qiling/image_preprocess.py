@@ -0,0 +1,203 @@
+# 图片预处理：发送给大模型前缩小并重新编码
+#
+# 手机拍摄的照片通常有数 MB，原样 base64 后请求体更大，上传与模型端解码都很慢。
+# 这里只解码一次：按 EXIF 方向摆正后去掉 EXIF，最长边限制在 IMAGE_MAX_EDGE 以内，
+# 再以指定质量编码为 JPEG / WebP，并给出与实际内容一致的 MIME 类型。
+# 处理结果按上传内容缓存（LRU，按字节数限制容量），同一张图片在历史上下文中重复发送时不再处理。
+import base64
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 最长边像素上限
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", 1568))
+# 输出格式（JPEG / WEBP）与编码质量
+IMAGE_OUTPUT_FORMAT = os.environ.get("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 85))
+# 处理结果缓存容量（字节）
+IMAGE_PREPROCESS_CACHE_BYTES = int(os.environ.get("IMAGE_PREPROCESS_CACHE_BYTES", 64 * 1024 * 1024))
+
+_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+
+class PreparedImage:
+    """预处理后的图片"""
+
+    __slots__ = ("data", "mime_type", "width", "height", "_base64", "_data_url")
+
+    def __init__(self, data: bytes, mime_type: str, width: int = 0, height: int = 0):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self._base64 = None
+        self._data_url = None
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    @property
+    def data_url(self) -> str:
+        if self._data_url is None:
+            self._data_url = f"data:{self.mime_type};base64,{self.base64}"
+        return self._data_url
+
+    @property
+    def size(self) -> int:
+        # 缓存容量按原始字节、base64 文本与 data URL 三份计算
+        return len(self.data) * 11 // 3
+
+
+class PreparedImageCache:
+    """按字节数限制容量的 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[object, PreparedImage]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[PreparedImage]:
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+            return image
+
+    def put(self, key, image: PreparedImage) -> None:
+        if image.size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._items[key] = image
+            self._bytes += image.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted.size
+
+
+_cache = PreparedImageCache(IMAGE_PREPROCESS_CACHE_BYTES)
+
+
+def _guess_mime_type(image_bytes: bytes, filename: Optional[str] = None) -> str:
+    """无法解码时根据文件头或扩展名判断 MIME 类型"""
+    if image_bytes.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if image_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_bytes[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    if filename:
+        mime_type, _ = mimetypes.guess_type(filename)
+        if mime_type and mime_type.startswith("image/"):
+            return mime_type
+    return "image/jpeg"
+
+
+def _process(image_bytes: bytes) -> PreparedImage:
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        source_format = image.format
+        # 原图尺寸合适、不含 EXIF 且是模型支持的静态格式时，可以直接使用原始内容
+        # （按 draft 之前的原始尺寸判断，draft 后的尺寸已不是原始内容的尺寸）
+        keep_original = (source_format in ("JPEG", "PNG", "WEBP")
+                         and max(image.size) <= IMAGE_MAX_EDGE
+                         and "exif" not in image.info
+                         and not getattr(image, "is_animated", False))
+        # JPEG 可直接按缩小的尺寸解码（只缩小到不小于目标尺寸的 1/2^n）
+        image.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        if keep_original and len(image_bytes) <= width * height // 2:
+            return PreparedImage(image_bytes, _MIME_TYPES[source_format], width, height)
+
+        if max(width, height) > IMAGE_MAX_EDGE:
+            image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+
+        output_format = IMAGE_OUTPUT_FORMAT if IMAGE_OUTPUT_FORMAT in ("JPEG", "WEBP") else "JPEG"
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            if output_format == "JPEG":
+                # JPEG 不支持透明，合成到白色背景上
+                rgba = image.convert("RGBA")
+                background = Image.new("RGB", rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+            else:
+                image = image.convert("RGBA")
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        buffer = io.BytesIO()
+        # 不传 exif 参数，输出中不含 EXIF（拍摄地点等信息不会发给模型）
+        image.save(buffer, format=output_format, quality=IMAGE_QUALITY)
+        data = buffer.getvalue()
+
+    # 重新编码后反而更大（如本来就高度压缩的小图）时保留原图
+    if keep_original and len(data) >= len(image_bytes):
+        return PreparedImage(image_bytes, _MIME_TYPES[source_format], width, height)
+    return PreparedImage(data, _MIME_TYPES[output_format], image.width, image.height)
+
+
+def prepare_image_bytes(image_bytes: bytes, filename: Optional[str] = None,
+                        cache_key=None, use_cache: bool = True) -> PreparedImage:
+    """预处理图片内容（结果按内容缓存）
+
+    Args:
+        image_bytes: 原始图片内容
+        filename: 原始文件名，仅用于无法解码时判断 MIME 类型
+        cache_key: 缓存键，默认为内容的 SHA-256
+        use_cache: 是否使用模块级缓存（调用方自行缓存结果时关闭）
+
+    Returns:
+        PreparedImage: 处理后的图片；无法解码时为原始内容
+    """
+    if use_cache:
+        if cache_key is None:
+            cache_key = hashlib.sha256(image_bytes).hexdigest()
+        prepared = _cache.get(cache_key)
+        if prepared is not None:
+            return prepared
+
+    try:
+        prepared = _process(image_bytes)
+        if len(prepared.data) < len(image_bytes):
+            logger.info(f"图片预处理完成: {len(image_bytes) / 1024:.0f}KB -> {len(prepared.data) / 1024:.0f}KB "
+                        f"({prepared.width}x{prepared.height}, {prepared.mime_type})")
+    except Exception as e:
+        logger.warning(f"⚠️ 图片预处理失败，使用原图: {str(e)}")
+        prepared = PreparedImage(image_bytes, _guess_mime_type(image_bytes, filename))
+    if use_cache:
+        _cache.put(cache_key, prepared)
+    return prepared
+
+
+def prepare_image_file(image_path: str) -> PreparedImage:
+    """预处理图片文件（按路径、修改时间与大小缓存，命中时不读取文件）"""
+    stat = os.stat(image_path)
+    cache_key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+    prepared = _cache.get(cache_key)
+    if prepared is not None:
+        return prepared
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    return prepare_image_bytes(image_bytes, image_path, cache_key=cache_key)
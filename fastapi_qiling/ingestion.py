@@ -0,0 +1,176 @@
+# 文物表流式导入：分块读取 Excel / CSV / Parquet，并按列向量化转换为文档
+#
+# 读取时只保留当前分块在内存中：
+#   .xlsx / .xlsm  openpyxl 只读模式逐行解析
+#   .csv           pandas 按 chunksize 分块读取
+#   .parquet       pyarrow 按 record batch 读取（只读取所需的列）
+#   .xls           旧格式不支持流式解析，整表读取后再分块
+import os
+from typing import Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+# 文物数据的必需列（表头）
+REQUIRED_COLUMNS = ['文物名称', '图片地址', '编号-年代', '历史', '工艺']
+# 可选列：显式指定的文物ID
+OPTIONAL_COLUMNS = ['artifact_id']
+
+# 每个分块的行数
+INGEST_CHUNK_SIZE = int(os.environ.get("INGEST_CHUNK_SIZE", 10000))
+
+# 列名 -> (metadata 字段, 组合内容时的标签；None 表示不参与内容)
+_COLUMN_FIELDS = [
+    ('文物名称', "artifact_name", "文物名称"),
+    ('图片地址', "image_url", None),
+    ('编号-年代', "number_period", "编号年代"),
+    ('历史', "history", "历史"),
+    ('工艺', "craft", "工艺"),
+]
+
+
+class CatalogueFormatError(ValueError):
+    """文物表格式错误（不支持的文件类型或缺少必需的列）"""
+
+
+def _check_columns(columns) -> List[str]:
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_columns:
+        raise CatalogueFormatError(f"文件缺少必需的列: {missing_columns}")
+    return REQUIRED_COLUMNS + [col for col in OPTIONAL_COLUMNS if col in columns]
+
+
+def _iter_xlsx(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise CatalogueFormatError("文件为空")
+        header = [str(name).strip() if name is not None else "" for name in header]
+        columns = _check_columns(header)
+        positions = [header.index(col) for col in columns]
+
+        buffer = []
+        for row in rows:
+            buffer.append([row[p] if p < len(row) else None for p in positions])
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=columns, dtype=object)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns, dtype=object)
+    finally:
+        workbook.close()
+
+
+def _iter_csv(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    header = pd.read_csv(path, nrows=0).columns
+    columns = _check_columns(header)
+    for chunk in pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunk_size):
+        yield chunk[columns]
+
+
+def _iter_parquet(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("读取 Parquet 文件需要安装 pyarrow: pip install pyarrow")
+
+    parquet_file = pq.ParquetFile(path)
+    columns = _check_columns(parquet_file.schema_arrow.names)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas()[columns]
+
+
+def _iter_xls(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    df = pd.read_excel(path, converters={'图片地址': str})
+    columns = _check_columns(df.columns)
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size][columns]
+
+
+_READERS = {
+    ".xlsx": _iter_xlsx,
+    ".xlsm": _iter_xlsx,
+    ".csv": _iter_csv,
+    ".parquet": _iter_parquet,
+    ".xls": _iter_xls,
+}
+
+
+def iter_catalogue_chunks(path: str, chunk_size: int = INGEST_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """分块读取文物表，每块为只包含必需列（及可选列）的 DataFrame
+
+    Raises:
+        CatalogueFormatError: 文件类型不支持或缺少必需的列
+    """
+    reader = _READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise CatalogueFormatError(f"不支持的文件类型: {path}，可选: {sorted(_READERS)}")
+    return reader(path, chunk_size)
+
+
+def _text_column(series: pd.Series) -> pd.Series:
+    """缺失值转为空字符串，其余值转为字符串"""
+    return series.where(series.notna(), "").astype(str)
+
+
+def _id_column(series: pd.Series) -> pd.Series:
+    """文物ID列转为字符串：含缺失值的整数列（如 Parquet 的可空整数）读出后为浮点数，
+    先转回整数，避免得到 "123.0" 这样的ID"""
+    if pd.api.types.is_float_dtype(series):
+        try:
+            series = series.astype("Int64")
+        except (TypeError, ValueError):
+            raise CatalogueFormatError("artifact_id 列包含非整数的值")
+        series = series.astype(object)
+    return _text_column(series)
+
+
+def frame_to_documents(df: pd.DataFrame, start_index: int = 0) -> List[Dict]:
+    """将一个分块转换为文档列表（按列向量化拼接内容，不逐行构造 Series）
+
+    Args:
+        df: 文物表分块
+        start_index: 分块第一行在整个表中的行号
+
+    Returns:
+        list: 有效文档列表（内容为空的行被跳过），metadata.index 为该行在表中的行号
+    """
+    texts = {field: _text_column(df[col]).to_numpy() for col, field, _ in _COLUMN_FIELDS}
+
+    # 每个非空字段拼为 "\n标签：值"，整体去掉开头的换行，与逐行拼接的结果一致
+    content = pd.Series("", index=df.index, dtype=object)
+    non_empty = np.zeros(len(df), dtype=bool)
+    for _, field, label in _COLUMN_FIELDS:
+        if label is None:
+            continue
+        values = pd.Series(texts[field], index=df.index, dtype=object)
+        has_value = values != ""
+        content = content + ("\n" + label + "：" + values).where(has_value, "")
+        non_empty |= has_value.to_numpy()
+    content = content.str[1:].to_numpy()
+
+    keep = np.flatnonzero(non_empty)
+    artifact_ids = _id_column(df["artifact_id"]).to_numpy() if "artifact_id" in df.columns else None
+
+    documents = []
+    for i in keep:
+        metadata = {field: texts[field][i] for _, field, _ in _COLUMN_FIELDS}
+        metadata["index"] = start_index + int(i)
+        if artifact_ids is not None and artifact_ids[i]:
+            metadata["artifact_id"] = artifact_ids[i]
+        documents.append({"content": content[i], "metadata": metadata})
+    return documents
+
+
+def iter_catalogue_documents(path: str, chunk_size: int = INGEST_CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """分块读取文物表并转换为文档，每次产出一个分块的文档列表"""
+    start_index = 0
+    for chunk in iter_catalogue_chunks(path, chunk_size):
+        documents = frame_to_documents(chunk, start_index)
+        start_index += len(chunk)
+        if documents:
+            yield documents
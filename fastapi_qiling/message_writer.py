@@ -0,0 +1,340 @@
+# 消息异步批量写入（write-behind）
+#
+# 对话接口保存消息时只放入内存队列并立即返回，由后台线程合并多个请求的消息，
+# 以一条多行 INSERT（一次提交）写入数据库：队列积累到 MESSAGE_BATCH_SIZE 条或最早的消息
+# 等待超过 MESSAGE_FLUSH_INTERVAL 秒时写入。对话延迟中不再包含数据库提交的时间。
+#
+# 顺序：每条消息入队时分配单调递增的序号，后台线程按序号顺序插入，自增 id 与入队顺序一致，
+# 同一秒内的消息按 id 排序即可，不需要人为错开时间戳。
+# 持久性：写入失败时指数退避重试，仍失败则逐行写入以隔离出错的行，无法写入的行追加到
+# 本地 JSONL 文件（spool），下次启动时优先补写；服务关闭时写完队列中的所有消息后再退出。
+# 多个 worker 共用同一个落盘文件：启动时先把它改名为本进程专用的文件名（认领）再补写，
+# 只有改名成功的进程补写，避免同一条消息被插入多次。
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_BATCH_SIZE = int(os.environ.get("MESSAGE_BATCH_SIZE", 200))
+MESSAGE_FLUSH_INTERVAL = float(os.environ.get("MESSAGE_FLUSH_INTERVAL", 0.2))
+MESSAGE_WRITE_RETRIES = int(os.environ.get("MESSAGE_WRITE_RETRIES", 3))
+MESSAGE_SPOOL_PATH = os.environ.get("MESSAGE_SPOOL_PATH", "./data/message_spool.jsonl")
+
+
+class MessageWriter:
+    """消息的后台批量写入器（线程安全）"""
+
+    def __init__(self, save_batch: Callable[[List[Dict]], int],
+                 batch_size: int = MESSAGE_BATCH_SIZE,
+                 flush_interval: float = MESSAGE_FLUSH_INTERVAL,
+                 max_retries: int = MESSAGE_WRITE_RETRIES,
+                 spool_path: Optional[str] = MESSAGE_SPOOL_PATH,
+                 on_failure: Optional[Callable[[List[Dict]], None]] = None):
+        """
+        Args:
+            save_batch: 批量写入函数，接收消息字典列表，失败时抛出异常
+            batch_size: 每批最多写入的消息数
+            flush_interval: 消息在队列中最长等待时间（秒）
+            max_retries: 整批写入失败后的重试次数
+            spool_path: 无法写入的消息的落盘文件，为空时只记录日志
+            on_failure: 消息最终未能写入数据库（落盘或丢弃）时的回调，接收这些消息，
+                用于使写穿透的缓存失效
+        """
+        self.save_batch = save_batch
+        self.on_failure = on_failure
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.spool_path = spool_path
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._next_seq = 1
+        # 序号不超过该值的消息均已处理完毕（写入数据库或落盘）
+        self._done_seq = 0
+        # user_id -> 队列中尚未写入的消息数
+        self._pending_users: Dict[str, int] = {}
+        self._flush_waiters = 0
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.written = 0
+        self.batches = 0
+        self.spooled = 0
+        self.last_batch_ms = 0.0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, user_id, role: str, content: str, timestamp: Optional[datetime] = None,
+               content_type: str = "text", attachments: Optional[List[Dict]] = None) -> int:
+        """消息入队，返回序号
+
+        Raises:
+            ValueError: user_id 不是有效的整数ID
+            RuntimeError: 写入器已关闭
+        """
+        message = {
+            "user_id": int(user_id),
+            "role": role,
+            "content_type": content_type,
+            "content": content,
+            "attachments": attachments or None,
+            "timestamp": timestamp or datetime.now(),
+        }
+        user_key = str(message["user_id"])
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("消息写入器已关闭")
+            message["seq"] = self._next_seq
+            self._next_seq += 1
+            message["enqueued_at"] = time.monotonic()
+            self._queue.append(message)
+            self._pending_users[user_key] = self._pending_users.get(user_key, 0) + 1
+            self._cond.notify_all()
+        return message["seq"]
+
+    def has_pending(self, user_id) -> bool:
+        """用户是否有尚未写入数据库的消息"""
+        with self._cond:
+            return self._pending_users.get(str(user_id), 0) > 0
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待调用前入队的所有消息处理完毕，超时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._next_seq - 1
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._done_seq < target:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flush_waiters -= 1
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """停止接收新消息，写完队列中的消息后退出后台线程"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error(f"❌ 关闭时仍有 {len(self._queue)} 条消息未写入")
+            self._thread = None
+        logger.info(f"✓ 消息写入器已关闭，共写入 {self.written} 条消息")
+
+    def stats(self) -> Dict:
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "queued": queued,
+            "written": self.written,
+            "batches": self.batches,
+            "avg_batch_size": self.written / self.batches if self.batches else 0.0,
+            "spooled": self.spooled,
+            "last_batch_ms": self.last_batch_ms
+        }
+
+    def _next_batch(self) -> Optional[List[Dict]]:
+        """等待并取出下一批消息；关闭且队列为空时返回None"""
+        with self._cond:
+            while True:
+                if self._queue:
+                    if (len(self._queue) >= self.batch_size or self._closing or self._flush_waiters
+                            or time.monotonic() - self._queue[0]["enqueued_at"] >= self.flush_interval):
+                        count = min(self.batch_size, len(self._queue))
+                        return [self._queue.popleft() for _ in range(count)]
+                    self._cond.wait(self._queue[0]["enqueued_at"] + self.flush_interval - time.monotonic())
+                elif self._closing:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def _run(self) -> None:
+        # 后台线程退出后不再有消息写入，读取历史的请求也会一直等待，因此任何异常都只记录日志
+        try:
+            self._replay_spool()
+        except Exception as e:
+            logger.error(f"❌ 补写暂存消息时出错: {str(e)}")
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start_time = time.monotonic()
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"❌ 写入 {len(batch)} 条消息时出错，这些消息已丢失: {str(e)}")
+            with self._cond:
+                self.last_batch_ms = (time.monotonic() - start_time) * 1000
+                self._done_seq = batch[-1]["seq"]
+                for message in batch:
+                    user_key = str(message["user_id"])
+                    self._pending_users[user_key] -= 1
+                    if self._pending_users[user_key] <= 0:
+                        del self._pending_users[user_key]
+                self._cond.notify_all()
+
+    def _write(self, batch: List[Dict]) -> None:
+        """写入一批消息：整批重试 -> 逐行写入 -> 落盘"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.save_batch(batch)
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ 批量写入 {len(batch)} 条消息失败（第 {attempt + 1} 次）: {str(e)}")
+                if attempt < self.max_retries:
+                    time.sleep(min(5.0, 0.2 * (2 ** attempt)))
+
+        # 逐行写入，避免个别出错的消息导致整批丢失
+        failed = []
+        for message in batch:
+            try:
+                self.save_batch([message])
+                self.written += 1
+            except Exception as e:
+                logger.error(f"❌ 写入消息失败 - 用户ID: {message['user_id']}, 角色: {message['role']}: {str(e)}")
+                failed.append(message)
+        if failed:
+            try:
+                self._spool(failed)
+            except OSError as e:
+                logger.error(f"❌ {len(failed)} 条消息写入落盘文件失败，已丢弃: {str(e)}")
+            if self.on_failure is not None:
+                try:
+                    self.on_failure(failed)
+                except Exception as e:
+                    logger.error(f"❌ 处理写入失败的消息时出错: {str(e)}")
+
+    def _spool(self, messages: List[Dict]) -> None:
+        if not self.spool_path:
+            logger.error(f"❌ {len(messages)} 条消息未能写入数据库且未配置落盘文件，已丢弃")
+            return
+        directory = os.path.dirname(self.spool_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.spool_path, "a", encoding="utf-8") as f:
+            for message in messages:
+                record = {key: value for key, value in message.items() if key not in ("seq", "enqueued_at")}
+                record["timestamp"] = message["timestamp"].isoformat()
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.spooled += len(messages)
+        logger.error(f"❌ {len(messages)} 条消息暂存到 {self.spool_path}，下次启动时重新写入")
+
+    def _claim_spool(self) -> List[str]:
+        """认领待补写的落盘文件（改名为本进程专用的文件名，改名是原子的，只有一个进程能成功）
+
+        也认领补写过程中退出的进程遗留的文件。返回认领到的文件路径
+        """
+        candidates = [self.spool_path]
+        for path in glob.glob(glob.escape(self.spool_path) + ".replay-*"):
+            try:
+                pid = int(path.rsplit(".replay-", 1)[1].split("-")[0])
+            except ValueError:
+                continue
+            if pid == os.getpid() or not _process_alive(pid):
+                candidates.append(path)
+
+        claimed = []
+        for path in candidates:
+            target = f"{self.spool_path}.replay-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                # 已被其他进程认领
+                continue
+            claimed.append(target)
+        return claimed
+
+    def _replay_spool(self) -> None:
+        """启动时补写上次未能写入的消息
+
+        按 batch_size 分批写入，无法解析的行跳过；某一批写入失败时，该批及之后的消息放回落盘文件，
+        等待下次启动
+        """
+        if not self.spool_path:
+            return
+        claimed = self._claim_spool()
+        if not claimed:
+            return
+        lines, messages = [], []
+        for path in claimed:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    message = _parse_spool_record(line)
+                    if message is None:
+                        logger.warning(f"⚠️ 跳过格式错误的暂存消息: {line[:200]}")
+                        continue
+                    lines.append(line)
+                    messages.append(message)
+
+        replayed = 0
+        for start in range(0, len(messages), self.batch_size):
+            batch = messages[start:start + self.batch_size]
+            try:
+                self.save_batch(batch)
+            except Exception as e:
+                logger.error(f"❌ 补写暂存消息失败，剩余 {len(messages) - start} 条下次启动时重试: {str(e)}")
+                self._return_to_spool(lines[start:])
+                break
+            replayed += len(batch)
+        self.written += replayed
+        if replayed:
+            logger.info(f"✓ 已补写 {replayed} 条暂存消息")
+        for path in claimed:
+            os.remove(path)
+
+    def _return_to_spool(self, lines: List[str]) -> None:
+        """把未能补写的消息追加回落盘文件"""
+        with open(self.spool_path, "a", encoding="utf-8") as spool:
+            for line in lines:
+                spool.write(line + "\n")
+            spool.flush()
+            os.fsync(spool.fileno())
+
+
+def _parse_spool_record(line: str) -> Optional[Dict]:
+    """解析落盘文件中的一行消息，格式错误（不完整的 JSON、缺少字段、时间格式错误）时返回None"""
+    try:
+        record = json.loads(line)
+        record["user_id"] = int(record["user_id"])
+        record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+        if not isinstance(record["role"], str) or not isinstance(record["content"], str):
+            return None
+    except (ValueError, KeyError, TypeError):
+        return None
+    return record
+
+
+def _process_alive(pid: int) -> bool:
+    """进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # 进程存在但无权限发送信号，或平台不支持（保守地视为仍在运行）
+        return True
+    return True
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""消息表结构化迁移：依次执行 src/database/migrations 下的消息表迁移脚本
+（content_type / attachments 列、(userid, timestamp, id) 联合索引），
+并将以 str(dict) 或 JSON 字符串保存在 content 中的图片消息转换为新格式
+
+可重复执行：已执行过的结构修改会跳过，只转换尚未转换的旧消息。
+"""
+
+import ast
+import json
+import os
+
+from database_handler import get_lizi_connection
+from context_builder import image_attachment
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "src", "database", "migrations"
+)
+
+# (迁移脚本, 判断是否已执行的查询, 说明)，按顺序执行
+MIGRATIONS = [
+    (
+        "add_message_content_type_and_attachments.sql",
+        """
+        SELECT COLUMN_NAME
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'messages' AND COLUMN_NAME = 'content_type'
+        """,
+        "content_type / attachments 字段",
+    ),
+    (
+        "add_messages_keyset_index.sql",
+        """
+        SELECT INDEX_NAME
+        FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'messages' AND INDEX_NAME = 'idx_userid_timestamp_id'
+        """,
+        "(userid, timestamp, id) 联合索引",
+    ),
+]
+BATCH_SIZE = 1000
+
+
+def _load_migration_sql(filename):
+    """读取迁移脚本中的 SQL 语句（去掉注释行）"""
+    with open(os.path.join(MIGRATIONS_DIR, filename), "r", encoding="utf-8") as f:
+        lines = [line for line in f if not line.strip().startswith("--")]
+    return [stmt.strip() for stmt in "".join(lines).split(";") if stmt.strip()]
+
+
+def _parse_legacy_content(content):
+    """解析旧格式的图片消息，返回 (text, file_id)，不是图片消息时返回None"""
+    stripped = content.strip()
+    if not (stripped.startswith("{") and stripped.endswith("}")):
+        return None
+    try:
+        data = json.loads(stripped)
+    except ValueError:
+        try:
+            data = ast.literal_eval(stripped)
+        except (ValueError, SyntaxError):
+            return None
+    if not isinstance(data, dict) or not data.get("image_path"):
+        return None
+    return str(data.get("text") or ""), os.path.basename(str(data["image_path"]))
+
+
+def migrate_message_schema():
+    """执行迁移"""
+    try:
+        db = get_lizi_connection()
+
+        if db.connect():
+            print("✅ 成功连接到数据库")
+
+            for filename, check_sql, description in MIGRATIONS:
+                if db.execute_query(check_sql):
+                    print(f"ℹ️ {description}已经存在，跳过 {filename}")
+                    continue
+                print(f"正在执行 {filename}...")
+                for stmt in _load_migration_sql(filename):
+                    db.execute_update(stmt)
+                if not db.execute_query(check_sql):
+                    print(f"❌ 执行 {filename} 失败")
+                    db.close()
+                    return
+                print(f"✅ 成功添加{description}")
+
+            # 分批转换旧格式的图片消息
+            print("正在转换旧格式的图片消息...")
+            last_id = 0
+            converted = 0
+            while True:
+                rows = db.execute_query(
+                    """
+                    SELECT id, content FROM messages
+                    WHERE id > %s AND content_type = 'text' AND content LIKE '{%%'
+                    ORDER BY id LIMIT %s
+                    """,
+                    (last_id, BATCH_SIZE)
+                )
+                if not rows:
+                    break
+                for row in rows:
+                    last_id = row["id"]
+                    parsed = _parse_legacy_content(row["content"])
+                    if parsed is None:
+                        continue
+                    text, file_id = parsed
+                    db.execute_update(
+                        "UPDATE messages SET content_type = 'image', content = %s, attachments = %s WHERE id = %s",
+                        (text, json.dumps([image_attachment(file_id)], ensure_ascii=False), row["id"])
+                    )
+                    converted += 1
+            print(f"✅ 已转换 {converted} 条图片消息")
+
+            db.close()
+
+    except Exception as e:
+        print(f"❌ 错误: {e}")
+        import traceback
+        traceback.print_exc()
+
+
+if __name__ == "__main__":
+    migrate_message_schema()
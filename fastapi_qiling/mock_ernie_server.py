@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""本地模拟 ERNIE 服务（OpenAI 兼容的 /chat/completions 接口）
+
+用于在不访问真实大模型的情况下测试客户端、流式输出和压测：
+    python mock_ernie_server.py --port 8001 --latency 2 --token-delay 0.05
+    ERNIE_BASE_URL=http://127.0.0.1:8001 uvicorn fastapi_app:app
+
+支持：
+    - 非流式响应（stream=false）
+    - SSE 流式响应（stream=true，以 data: [DONE] 结束）
+    - 按比例返回 429，用于验证限流与重试逻辑
+    - GET /images/{name} 返回一张固定的小图片，可作为文物表中的图片地址测试批量识别
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+app = FastAPI(title="Mock ERNIE API")
+
+# 运行参数（由命令行覆盖）
+settings = {
+    "latency": 0.5,          # 首个token之前的延迟（秒）
+    "token_delay": 0.05,     # 流式输出时每个分片之间的延迟（秒）
+    "rate_limit_ratio": 0.0  # 返回429的概率
+}
+
+# 识别类请求的固定回复（与 ArtifactRecognitionService 的解析格式一致）
+RECOGNITION_REPLY = """文物类型：瓷器
+具体名称：青花缠枝莲纹瓶
+置信度：0.88
+介绍：这是一件模拟识别结果，用于本地测试，描述了明清时期青花瓷器的典型纹饰与工艺特点。"""
+
+# 1x1 像素的 PNG 图片
+SAMPLE_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+
+def _has_image(messages):
+    """判断请求中是否包含图片"""
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "image_url":
+                    return True
+    return False
+
+
+def _last_user_text(messages):
+    """提取最后一条用户消息中的文本"""
+    for msg in reversed(messages):
+        if msg.get("role") != "user":
+            continue
+        content = msg.get("content")
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "text":
+                    return part.get("text", "")
+    return ""
+
+
+def _build_reply(messages):
+    if _has_image(messages):
+        return RECOGNITION_REPLY
+    text = _last_user_text(messages)
+    return f"这是模拟回复。您的问题是：{text[:50]}"
+
+
+@app.get("/images/{name}")
+async def sample_image(name: str):
+    await asyncio.sleep(settings["latency"] / 10)
+    return Response(content=SAMPLE_PNG, media_type="image/png")
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    messages = payload.get("messages", [])
+    model = payload.get("model", "mock")
+
+    if random.random() < settings["rate_limit_ratio"]:
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "rate limit exceeded", "type": "rate_limit"}},
+            headers={"Retry-After": "1"}
+        )
+
+    reply = _build_reply(messages)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+
+    if not payload.get("stream"):
+        await asyncio.sleep(settings["latency"] + settings["token_delay"] * len(reply) / 4)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop"
+            }]
+        }
+
+    async def event_stream():
+        await asyncio.sleep(settings["latency"])
+        for i in range(0, len(reply), 4):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": reply[i:i + 4]}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(settings["token_delay"])
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地模拟 ERNIE 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="首个token前的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=settings["token_delay"], help="流式分片间隔（秒）")
+    parser.add_argument("--rate-limit-ratio", type=float, default=settings["rate_limit_ratio"], help="返回429的概率")
+    args = parser.parse_args()
+
+    settings["latency"] = args.latency
+    settings["token_delay"] = args.token_delay
+    settings["rate_limit_ratio"] = args.rate_limit_ratio
+
+    uvicorn.run(app, host=args.host, port=args.port)
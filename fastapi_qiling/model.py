@@ -6,11 +6,19 @@ import numpy as np
 import faiss
 import jieba
 import requests
-import base64
 import time
-import tempfile
+import logging
+import openai
 from paddlenlp.embeddings import TokenEmbedding
 from openai import OpenAI
+from batch_recognition import RateLimitedError, TransientError, RecognitionCheckpoint, run_batch_recognition
+from artifact_recognition_service import RECOGNITION_MODEL, RECOGNITION_PROMPT, is_recognized, parse_recognition_text
+from recognition_cache import image_digest, open_recognition_cache
+from image_preprocess import prepare_image_bytes
+from image_hashing import SOURCE_CATALOGUE, compute_image_hashes, open_near_duplicate_index
+
+# 批量识别模块通过 logging 输出进度
+logging.basicConfig(level=logging.INFO, format="%(message)s")
 
 print("库导入成功！")
 
@@ -20,11 +28,19 @@ VECTOR_DB_PATH = "./data/vector_db"
 VECTOR_INDEX_FILE = os.path.join(VECTOR_DB_PATH, "faiss.index")
 DOCS_INFO_FILE = os.path.join(VECTOR_DB_PATH, "documents.json")
 EXCEL_FILE_PATH = "./故宫博物院数字文物库.xlsx"
+# 图片识别检查点：构建中断后重新运行时复用已完成的识别结果（重建时不删除）
+# 放在向量数据库目录之外：后台构建完成时会整体替换该目录
+RECOGNITION_CHECKPOINT_FILE = "./data/recognition_checkpoint.jsonl"
 
 # 创建必要的目录
 for dir_path in [MUSEUM_DOCS_PATH, VECTOR_DB_PATH]:
     os.makedirs(dir_path, exist_ok=True)
 
+# 旧版本把检查点放在向量数据库目录中，迁移到新位置
+_legacy_checkpoint_file = os.path.join(VECTOR_DB_PATH, "recognition_checkpoint.jsonl")
+if os.path.exists(_legacy_checkpoint_file) and not os.path.exists(RECOGNITION_CHECKPOINT_FILE):
+    os.replace(_legacy_checkpoint_file, RECOGNITION_CHECKPOINT_FILE)
+
 print("路径配置完成！")
 print(f"Excel文件路径: {EXCEL_FILE_PATH}")
 print(f"向量索引文件: {VECTOR_INDEX_FILE}")
@@ -67,7 +83,7 @@ def init_ernie_client(api_key=None):
     try:
         client = OpenAI(
             api_key=api_key,
-            base_url="https://aistudio.baidu.com/llm/lmapi/v3",
+            base_url=os.environ.get("ERNIE_BASE_URL", "https://aistudio.baidu.com/llm/lmapi/v3"),
         )
         print("✓ ERNIE客户端初始化成功")
         return client
@@ -78,6 +94,38 @@ def init_ernie_client(api_key=None):
 # 初始化客户端
 ernie_client = init_ernie_client()
 
+# 下载图片的连接池（并发识别时复用连接）
+http_session = requests.Session()
+http_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+http_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# 识别结果缓存（与API服务共用，按图片内容命中，重建时已识别过的图片不再调用模型）
+recognition_cache = open_recognition_cache()
+# 近重复图片索引：记录文物库图片的感知哈希，API 服务据此匹配用户上传的同一文物照片
+image_index = open_near_duplicate_index()
+
+def request_recognition(client, image_data_url):
+    """调用ERNIE模型识别图片（data URL），返回模型回复的文本（出错时抛出异常）"""
+    response = client.chat.completions.create(
+        model=RECOGNITION_MODEL,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": RECOGNITION_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_data_url
+                        }
+                    }
+                ]
+            }
+        ],
+        temperature=0.1
+    )
+    return response.choices[0].message.content
+
 # 图片识别函数
 def classify_artifact_image(client, image_url, kg_data=None):
     """使用ERNIE模型识别图片中的文物
@@ -98,98 +146,77 @@ def classify_artifact_image(client, image_url, kg_data=None):
     
     try:
         # 下载图片
-        response = requests.get(image_url, timeout=10)
+        response = http_session.get(image_url, timeout=10)
         if response.status_code != 200:
             return "未知文物", "未知", 0.0, f"无法识别：下载图片失败（状态码：{response.status_code}）"
         
-        # 将图片保存到临时文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
-            tmp_file.write(response.content)
-            tmp_image_path = tmp_file.name
-        
-        try:
-            # 读取图片并转换为base64
-            with open(tmp_image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            # 构建提示词
-            prompt = """你是一位专业的中国古代文物识别专家。请仔细分析这张图片中的文物，并提供以下信息：
-
-1. 文物类型（如：青铜器、陶俑、壁画、瓷器、玉器等）
-2. 具体文物名称（如：司母戊鼎、兵马俑、清明上河图等，如无法确定具体名称则说"该类文物"）
-3. 识别置信度（0.0-1.0之间的数值）
-4. 简要介绍（50-100字，包括历史背景、艺术特色或文化价值）
-
-请按以下格式回答：
-文物类型：青铜器
-具体名称：司母戊鼎
-置信度：0.95
-介绍：这是商代晚期的青铜器，具有重要的历史价值..."""
-            
-            # 调用模型服务
-            start_time = time.time()
-            if client is not None:
-                response = client.chat.completions.create(
-                    model="ernie-4.5-vl-28b-a3b-thinking",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/png;base64,{base64_image}"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    temperature=0.1
-                )
-                result_text = response.choices[0].message.content
-            else:
-                return "未知文物", "未知", 0.0, "无法识别：模型服务不可用"
-            response_time = time.time() - start_time
-            
-            # 提取信息
-            artifact_type = "未知文物"
-            artifact_name = "未知"
-            confidence = 0.0
-            description = "无法解析识别结果"
-            
-            lines = result_text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.startswith('文物类型：') or line.startswith('文物类型:'):
-                    artifact_type = line.split('：', 1)[-1].split(':', 1)[-1].strip()
-                elif line.startswith('具体名称：') or line.startswith('具体名称:'):
-                    artifact_name = line.split('：', 1)[-1].split(':', 1)[-1].strip()
-                elif line.startswith('置信度：') or line.startswith('置信度:'):
-                    try:
-                        conf_str = line.split('：', 1)[-1].split(':', 1)[-1].strip()
-                        confidence = float(conf_str)
-                    except:
-                        confidence = 0.0
-                elif line.startswith('介绍：') or line.startswith('介绍:'):
-                    description = line.split('：', 1)[-1].split(':', 1)[-1].strip()
-            
-            # 如果没有找到介绍，使用整个响应作为描述
-            if description == "无法解析识别结果" and result_text:
-                description = result_text[:200]  # 限制长度
-            
-            return artifact_type, artifact_name, confidence, description
-            
-        finally:
-            # 清理临时文件
-            if os.path.exists(tmp_image_path):
-                os.remove(tmp_image_path)
+        result_text = request_recognition(client, prepare_image_bytes(response.content).data_url)
+        return parse_recognition_text(result_text)
                 
     except requests.exceptions.RequestException as e:
         return "未知文物", "未知", 0.0, f"无法识别：网络请求失败 - {str(e)}"
     except Exception as e:
         return "未知文物", "未知", 0.0, f"无法识别：识别过程出错 - {str(e)}"
 
+def _retry_after(headers):
+    """解析 Retry-After 响应头（秒），无法解析时返回None"""
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def recognize_image_for_build(client, image_url):
+    """批量构建时识别单张图片
+    
+    限流（429）与网络/服务端临时错误抛出 RateLimitedError / TransientError 交由批量识别重试；
+    图片不存在等永久性失败返回“无法识别”的结果，写入检查点后不再重复尝试。
+    
+    Returns:
+        dict: 识别结果（artifact_type / recognized_name / confidence / description），
+            图片下载成功时附带感知哈希 image_hash（[pHash, dHash]）
+    """
+    try:
+        response = http_session.get(image_url, timeout=10)
+    except requests.exceptions.RequestException as e:
+        raise TransientError(f"下载图片失败 - {str(e)}")
+    if response.status_code == 429:
+        raise RateLimitedError("下载图片被限流", _retry_after(response.headers))
+    if response.status_code >= 500:
+        raise TransientError(f"下载图片失败（状态码：{response.status_code}）")
+    
+    hashes = None
+    if response.status_code != 200:
+        artifact_type, recognized_name, confidence, description = \
+            "未知文物", "未知", 0.0, f"无法识别：下载图片失败（状态码：{response.status_code}）"
+    else:
+        hashes = compute_image_hashes(response.content) if image_index else None
+        digest = image_digest(response.content)
+        cached = recognition_cache.get(digest, RECOGNITION_MODEL) if recognition_cache else None
+        if cached is not None:
+            artifact_type, recognized_name, confidence, description = cached
+        else:
+            image_data_url = prepare_image_bytes(response.content, cache_key=digest).data_url
+            try:
+                result_text = request_recognition(client, image_data_url)
+            except openai.RateLimitError as e:
+                raise RateLimitedError(str(e), _retry_after(e.response.headers))
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                raise TransientError(f"模型服务请求失败 - {str(e)}")
+            artifact_type, recognized_name, confidence, description = parse_recognition_text(result_text)
+            if recognition_cache and is_recognized((artifact_type, recognized_name, confidence, description)):
+                recognition_cache.put(digest, RECOGNITION_MODEL,
+                                      (artifact_type, recognized_name, confidence, description))
+    
+    result = {
+        "artifact_type": artifact_type,
+        "recognized_name": recognized_name,
+        "confidence": float(confidence),
+        "description": description
+    }
+    if hashes is not None:
+        result["image_hash"] = list(hashes)
+    return result
+
 print("图片识别功能已加载")
 
 # 加载词嵌入模型
@@ -281,8 +308,24 @@ def build_vector_database(embedding_model):
         else:
             print("⚠️ ERNIE客户端初始化失败，将跳过图片识别")
         
+        # 并发识别所有图片（相同地址只识别一次，已完成的结果从检查点恢复）
+        recognition_results, recognition_failures = {}, {}
+        if ernie_client:
+            image_urls = [str(url) for url in df['图片地址'] if pd.notna(url) and str(url).strip()]
+            print(f"\n开始识别 {len(set(image_urls))} 张图片...")
+            # 由批量识别统一处理限流与重试，关闭客户端自带的重试
+            batch_client = ernie_client.with_options(max_retries=0)
+            recognition_results, recognition_failures = run_batch_recognition(
+                ((url, url) for url in image_urls),
+                lambda url: recognize_image_for_build(batch_client, url),
+                checkpoint=RecognitionCheckpoint(RECOGNITION_CHECKPOINT_FILE)
+            )
+            if recognition_failures:
+                print(f"⚠️ {len(recognition_failures)} 张图片识别失败，重新运行构建时将重试")
+        
         # 处理每一行数据
-        print("\n开始处理数据并识别图片...")
+        print("\n开始处理数据...")
+        image_entries = []
         for idx, row in df.iterrows():
             # 获取各个字段
             artifact_name = str(row['文物名称']) if pd.notna(row['文物名称']) else ""
@@ -291,29 +334,21 @@ def build_vector_database(embedding_model):
             history = str(row['历史']) if pd.notna(row['历史']) else ""
             craft = str(row['工艺']) if pd.notna(row['工艺']) else ""
             
-            # 调用图片识别模型
+            # 取出图片识别结果
             recognition_result = None
+            image_hash = None
             if ernie_client and image_url and image_url.strip():
-                if (idx + 1) % 100 == 0:
-                    print(f"  正在识别第 {idx + 1}/{len(df)} 条数据的图片...")
-                
-                try:
-                    artifact_type, recognized_name, confidence, description = classify_artifact_image(
-                        ernie_client, image_url
-                    )
-                    recognition_result = {
-                        "artifact_type": artifact_type,
-                        "recognized_name": recognized_name,
-                        "confidence": float(confidence),
-                        "description": description
-                    }
-                except Exception as e:
-                    print(f"  ⚠️ 第 {idx + 1} 条数据图片识别失败: {str(e)}")
+                recognition_result = recognition_results.get(image_url)
+                if recognition_result is not None:
+                    # 感知哈希写入近重复索引，不保存到文档中
+                    recognition_result = dict(recognition_result)
+                    image_hash = recognition_result.pop("image_hash", None)
+                if recognition_result is None:
                     recognition_result = {
                         "artifact_type": "未知文物",
                         "recognized_name": "未知",
                         "confidence": 0.0,
-                        "description": f"识别失败: {str(e)}"
+                        "description": f"识别失败: {recognition_failures.get(image_url, '未知错误')}"
                     }
             else:
                 # 如果没有客户端或图片地址，设置默认值
@@ -363,9 +398,29 @@ def build_vector_database(embedding_model):
                 }
             }
             documents.append(doc)
+            
+            if image_hash is not None:
+                # 未解析出识别结果时只登记文物信息，近重复查找不复用“未知”的结果
+                recognition = {
+                    "artifact_type": recognition_result["artifact_type"],
+                    "artifact_name": recognition_result["recognized_name"],
+                    "confidence": recognition_result["confidence"],
+                    "description": recognition_result["description"]
+                }
+                if not is_recognized((recognition["artifact_type"], recognition["artifact_name"],
+                                      recognition["confidence"], recognition["description"])):
+                    recognition = None
+                image_entries.append((SOURCE_CATALOGUE, image_url, tuple(image_hash), recognition, {
+                    "artifact_name": artifact_name,
+                    "number_period": number_period
+                }))
         
         print(f"✓ 处理完成，共 {len(documents)} 条有效文物数据")
         
+        if image_index and image_entries:
+            image_index.add_many(image_entries)
+            print(f"✓ 已将 {len(image_entries)} 张文物图片写入近重复图片索引")
+        
     except Exception as e:
         print(f"❌ 读取Excel文件时出错: {str(e)}")
         import traceback
@@ -761,9 +816,9 @@ def classify_artifact_image_from_file(client, image_path):
         return "未知文物", "未知", 0.0, "无法识别：图片文件不存在"
     
     try:
-        # 读取图片并转换为base64
+        # 读取图片，缩小并重新编码后转为 data URL
         with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            image_data_url = prepare_image_bytes(image_file.read()).data_url
         
         # 构建提示词
         prompt = """你是一位专业的中国古代文物识别专家。请仔细分析这张图片中的文物，并提供以下信息：
@@ -791,7 +846,7 @@ def classify_artifact_image_from_file(client, image_path):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
+                                "url": image_data_url
                             }
                         }
                     ]
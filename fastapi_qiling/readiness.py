@@ -0,0 +1,95 @@
+# 服务启动状态：记录各组件的就绪情况
+#
+# 进程启动时只做轻量的初始化，服务可以立即接受连接（存活）；词嵌入模型、FAISS 索引等
+# 重量级组件在后台预热，完成前相关功能降级（如对话不附带文物检索结果）。
+# /api/health 返回各组件的状态与就绪耗时（保留原有的 "status": "healthy" 字段，表示进程存活），
+# 整体状态见 state 字段；/api/health/ready 在仍有组件加载中时返回 503，
+# 供负载均衡或编排系统判断何时把流量切到新启动的进程。
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+STATUS_PENDING = "pending"
+STATUS_LOADING = "loading"
+STATUS_READY = "ready"
+# 组件暂不可用但不会通过等待恢复（如向量数据库不存在、正在后台构建），不阻塞就绪
+STATUS_UNAVAILABLE = "unavailable"
+STATUS_FAILED = "failed"
+# 仍在初始化中的状态，就绪探针在这些状态下返回未就绪
+STARTING_STATUSES = (STATUS_PENDING, STATUS_LOADING)
+
+# 近似的进程启动时间（本模块首次导入时）
+PROCESS_STARTED_AT = time.monotonic()
+
+
+class ReadinessRegistry:
+    """各组件的启动状态（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components: Dict[str, Dict] = {}
+        # 组件名 -> 检查组件当前是否可用的函数（如后台构建完成后变为可用）
+        self._checks: Dict[str, Callable[[], bool]] = {}
+
+    def register(self, name: str, status: str = STATUS_PENDING, detail: Optional[str] = None,
+                 check: Optional[Callable[[], bool]] = None) -> None:
+        with self._lock:
+            self._components[name] = {"status": STATUS_PENDING, "detail": None,
+                                      "load_seconds": None, "ready_after_seconds": None}
+            if check is not None:
+                self._checks[name] = check
+        if status != STATUS_PENDING:
+            self.set(name, status, detail)
+
+    def set(self, name: str, status: str, detail: Optional[str] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            component = self._components.setdefault(name, {"status": STATUS_PENDING, "detail": None,
+                                                           "load_seconds": None, "ready_after_seconds": None})
+            if status == STATUS_LOADING:
+                component["_loading_since"] = now
+            elif "_loading_since" in component:
+                component["load_seconds"] = round(now - component.pop("_loading_since"), 3)
+            if status == STATUS_READY:
+                component["ready_after_seconds"] = round(now - PROCESS_STARTED_AT, 3)
+            component["status"] = status
+            component["detail"] = detail
+
+    def status(self, name: str) -> Optional[str]:
+        self._refresh()
+        with self._lock:
+            component = self._components.get(name)
+            return component["status"] if component else None
+
+    def is_ready(self) -> bool:
+        """没有组件处于初始化中"""
+        self._refresh()
+        with self._lock:
+            return all(c["status"] not in STARTING_STATUSES for c in self._components.values())
+
+    def snapshot(self) -> Dict:
+        self._refresh()
+        with self._lock:
+            components = {name: {k: v for k, v in c.items() if not k.startswith("_")}
+                          for name, c in self._components.items()}
+        starting = any(c["status"] in STARTING_STATUSES for c in components.values())
+        degraded = any(c["status"] in (STATUS_UNAVAILABLE, STATUS_FAILED) for c in components.values())
+        return {
+            "state": "starting" if starting else ("degraded" if degraded else "healthy"),
+            "ready": not starting,
+            "uptime_seconds": round(time.monotonic() - PROCESS_STARTED_AT, 3),
+            "components": components
+        }
+
+    def _refresh(self) -> None:
+        """暂不可用或加载失败的组件恢复可用后（如后台构建完成）更新为就绪"""
+        with self._lock:
+            pending = [(name, check) for name, check in self._checks.items()
+                       if self._components[name]["status"] in (STATUS_UNAVAILABLE, STATUS_FAILED)]
+        for name, check in pending:
+            try:
+                available = check()
+            except Exception:
+                available = False
+            if available:
+                self.set(name, STATUS_READY)
@@ -0,0 +1,140 @@
+# 图片识别结果缓存：按图片内容的 SHA-256 缓存解析后的识别结果
+#
+# 存储在 SQLite 文件中（WAL 模式），API 服务与离线构建脚本可同时读写同一个缓存；
+# 条目超过有效期（TTL）后视为未命中，总数超过上限时按最近访问时间淘汰（LRU）。
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RECOGNITION_CACHE_PATH = os.environ.get("RECOGNITION_CACHE_PATH", "./data/recognition_cache.db")
+RECOGNITION_CACHE_TTL = float(os.environ.get("RECOGNITION_CACHE_TTL", 30 * 24 * 3600))
+RECOGNITION_CACHE_MAX_ENTRIES = int(os.environ.get("RECOGNITION_CACHE_MAX_ENTRIES", 100000))
+
+# 识别结果：(artifact_type, artifact_name, confidence, description)
+RecognitionResult = Tuple[str, str, float, str]
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """图片内容的 SHA-256（十六进制）"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class RecognitionCache:
+    """识别结果的持久化缓存（线程安全）"""
+
+    def __init__(self, path: str = RECOGNITION_CACHE_PATH, ttl: float = RECOGNITION_CACHE_TTL,
+                 max_entries: int = RECOGNITION_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            path: SQLite 文件路径
+            ttl: 有效期（秒），<=0 表示永不过期
+            max_entries: 最大条目数，超过时淘汰最久未访问的条目
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS recognition_cache (
+                digest TEXT NOT NULL,
+                model TEXT NOT NULL,
+                artifact_type TEXT NOT NULL,
+                artifact_name TEXT NOT NULL,
+                confidence REAL NOT NULL,
+                description TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (digest, model)
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_recognition_cache_accessed ON recognition_cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, digest: str, model: str) -> Optional[RecognitionResult]:
+        """查询缓存，未命中或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT artifact_type, artifact_name, confidence, description, created_at "
+                "FROM recognition_cache WHERE digest = ? AND model = ?",
+                (digest, model)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self.ttl > 0 and now - row[4] > self.ttl:
+                self._conn.execute("DELETE FROM recognition_cache WHERE digest = ? AND model = ?", (digest, model))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE recognition_cache SET accessed_at = ? WHERE digest = ? AND model = ?",
+                (now, digest, model)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return row[0], row[1], float(row[2]), row[3]
+
+    def put(self, digest: str, model: str, result: RecognitionResult) -> None:
+        """写入识别结果，并在超出容量时淘汰最久未访问的条目"""
+        artifact_type, artifact_name, confidence, description = result
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recognition_cache "
+                "(digest, model, artifact_type, artifact_name, confidence, description, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, model, artifact_type, artifact_name, float(confidence), description, now, now)
+            )
+            if self.max_entries > 0:
+                self._conn.execute(
+                    "DELETE FROM recognition_cache WHERE rowid IN ("
+                    "SELECT rowid FROM recognition_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """命中统计与当前条目数"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM recognition_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_recognition_cache(path: Optional[str] = None) -> Optional[RecognitionCache]:
+    """打开识别缓存；路径配置为空或打开失败时返回None（不使用缓存）"""
+    path = RECOGNITION_CACHE_PATH if path is None else path
+    if not path:
+        return None
+    try:
+        return RecognitionCache(path)
+    except Exception as e:
+        logger.warning(f"⚠️ 打开识别缓存失败，将不使用缓存: {str(e)}")
+        return None
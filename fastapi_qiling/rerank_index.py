@@ -0,0 +1,127 @@
+# 增强搜索重排序用的预分词索引
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import jieba
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _recognition_text(doc: Dict) -> str:
+    """提取文档中图片识别结果的文本（与增强搜索的匹配口径一致）"""
+    recognition_result = doc.get("metadata", {}).get("recognition_result") or {}
+    if not recognition_result:
+        return ""
+    artifact_type = recognition_result.get("artifact_type", "")
+    recognized_name = recognition_result.get("recognized_name", "")
+    description = recognition_result.get("description", "")
+    return f"{artifact_type} {recognized_name} {description}".lower()
+
+
+class RerankTermIndex:
+    """图片识别描述的词集合索引
+
+    在构建/加载时对每个文档的识别描述分词一次，保存为排好序的整数词ID数组（CSR格式），
+    查询时只需对查询分词，再用向量化的集合求交计算重叠度，开销与描述长度无关。
+    """
+
+    def __init__(self, vocab: Dict[str, int], term_ids: np.ndarray,
+                 offsets: np.ndarray, confidence: np.ndarray):
+        """
+        Args:
+            vocab: 词 -> 词ID
+            term_ids: 所有文档去重排序后的词ID拼接而成的一维数组
+            offsets: 长度为 N+1 的偏移数组，第 i 个文档的词ID为 term_ids[offsets[i]:offsets[i+1]]
+            confidence: 每个文档的识别置信度（无识别结果为0）
+        """
+        self.vocab = vocab
+        self.term_ids = term_ids
+        self.offsets = offsets
+        self.confidence = confidence
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @classmethod
+    def build(cls, documents) -> "RerankTermIndex":
+        """对文档的识别描述分词，构建词ID索引"""
+        vocab: Dict[str, int] = {}
+        segments: List[np.ndarray] = []
+        confidence = np.zeros(len(documents), dtype=np.float32)
+
+        for i, doc in enumerate(documents):
+            text = _recognition_text(doc)
+            if not text:
+                segments.append(np.empty(0, dtype=np.int32))
+                continue
+            ids = {vocab.setdefault(word, len(vocab)) for word in jieba.cut(text)}
+            segments.append(np.array(sorted(ids), dtype=np.int32))
+            recognition_result = doc["metadata"]["recognition_result"]
+            confidence[i] = float(recognition_result.get("confidence", 0.0) or 0.0)
+
+        lengths = np.fromiter((len(seg) for seg in segments), dtype=np.int64, count=len(segments))
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        term_ids = np.concatenate(segments) if segments else np.empty(0, dtype=np.int32)
+        return cls(vocab, term_ids, offsets, confidence)
+
+    def save(self, terms_file: str, vocab_file: str) -> None:
+        """保存索引（数组为npz，词表为JSON列表）"""
+        np.savez(terms_file, term_ids=self.term_ids, offsets=self.offsets, confidence=self.confidence)
+        words = [None] * len(self.vocab)
+        for word, idx in self.vocab.items():
+            words[idx] = word
+        with open(vocab_file, 'w', encoding='utf-8') as f:
+            json.dump(words, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, terms_file: str, vocab_file: str) -> Optional["RerankTermIndex"]:
+        """加载索引，文件不存在时返回None"""
+        if not (os.path.exists(terms_file) and os.path.exists(vocab_file)):
+            return None
+        with np.load(terms_file) as data:
+            term_ids = data["term_ids"]
+            offsets = data["offsets"]
+            confidence = data["confidence"]
+        with open(vocab_file, 'r', encoding='utf-8') as f:
+            words = json.load(f)
+        return cls({word: idx for idx, word in enumerate(words)}, term_ids, offsets, confidence)
+
+    def score(self, query_text: str, rows: np.ndarray) -> np.ndarray:
+        """计算查询与候选文档识别描述的匹配分数
+
+        分数 = 重叠词数 / 查询词数 × (0.5 + 0.5 × 置信度)
+
+        Args:
+            query_text: 查询文本
+            rows: 候选文档的行号数组
+
+        Returns:
+            numpy.ndarray: 与 rows 等长的分数数组
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = np.zeros(len(rows), dtype=np.float32)
+        query_words = set(jieba.cut(query_text.lower()))
+        if not query_words or len(rows) == 0:
+            return scores
+
+        query_ids = np.array(sorted(self.vocab[w] for w in query_words if w in self.vocab), dtype=np.int32)
+        if len(query_ids) == 0:
+            return scores
+
+        # 展开所有候选文档的词ID段，一次性判断是否命中查询词，再按段计数
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return scores
+        segment_labels = np.repeat(np.arange(len(rows)), lengths)
+        positions = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+        hits = np.isin(self.term_ids[positions], query_ids, assume_unique=False)
+        overlap = np.bincount(segment_labels, weights=hits, minlength=len(rows))
+
+        scores = overlap / len(query_words) * (0.5 + self.confidence[rows] * 0.5)
+        return scores.astype(np.float32)
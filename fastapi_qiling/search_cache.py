@@ -0,0 +1,112 @@
+# 向量搜索结果缓存：热门查询直接返回上次的结果
+#
+# 同一个查询（如“青花瓷”“乾隆”）每次都要分词、向量化、FAISS 检索并重排序。
+# 本缓存以 (规范化后的查询文本, 搜索参数) 为键保存结果，并记录结果对应的数据库版本号：
+# 数据库发生任何变化（增量更新、压缩、重新构建或其他进程修改后重新加载）时版本号改变，
+# 旧版本的结果全部失效。缓存按条目数限制容量（LRU），并设置有效期（TTL）。
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+# 最多缓存的查询数（0 表示不缓存）、有效期（秒，<=0 表示只在数据库变化时失效）
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", 2048))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 600))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query_text: str) -> str:
+    """规范化查询文本：全角字符转半角（NFKC），合并连续空白并去掉首尾空白"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", query_text or "")).strip()
+
+
+class SearchResultCache:
+    """搜索结果的 LRU + TTL 缓存，按数据库版本号失效（线程安全）
+
+    返回的结果列表与其他请求共享其中的字典，调用方不应修改。
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_MAX_ENTRIES, ttl: float = SEARCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # 当前缓存的结果对应的数据库版本
+        self._generation: Optional[str] = None
+        # 键 -> (结果, 写入时间)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: Hashable, generation: Optional[str]) -> Optional[List[Dict]]:
+        """返回缓存的结果，未缓存、已过期或数据库版本已变化时返回None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key) if generation == self._generation else None
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0])
+
+    def put(self, key: Hashable, generation: Optional[str], results: List[Dict]) -> None:
+        """缓存在数据库版本 generation 上得到的结果"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_generation(generation)
+            if generation != self._generation:
+                # 搜索期间数据库已更新，结果已过时
+                return
+            self._entries[key] = (list(results), time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+
+    def _check_generation(self, generation: Optional[str]) -> None:
+        """数据库版本变化时清空缓存（需持有锁）
+
+        只会前进到更新的版本：版本号以纳秒时间戳开头，搜索期间数据库被替换时，
+        晚到的旧版本结果不会把缓存退回旧版本。
+        """
+        if generation == self._generation:
+            return
+        if generation is not None and self._generation is not None and generation < self._generation:
+            return
+        if self._entries:
+            self._entries.clear()
+            self.invalidations += 1
+        self._generation = generation
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0
+        }
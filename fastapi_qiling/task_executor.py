@@ -0,0 +1,97 @@
+# 阻塞任务执行器：将同步的大模型、数据库、向量检索调用移出事件循环
+import os
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# 各类任务线程池的默认大小，可通过环境变量覆盖
+# LLM 调用以网络等待为主，可以开得较大；数据库线程数不应超过连接池上限；
+# 向量检索是 CPU 密集型（FAISS 内部会释放 GIL），保持与核数相当即可
+DEFAULT_POOL_SIZES = {
+    "llm": 16,
+    "db": 5,
+    "search": max(2, min(8, os.cpu_count() or 2)),
+    "io": 4,
+    "build": 1,
+}
+
+POOL_SIZE_ENV = {
+    "llm": "LLM_THREAD_POOL_SIZE",
+    "db": "DB_THREAD_POOL_SIZE",
+    "search": "SEARCH_THREAD_POOL_SIZE",
+    "io": "IO_THREAD_POOL_SIZE",
+    "build": "BUILD_THREAD_POOL_SIZE",
+}
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def _pool_size(kind: str) -> int:
+    """读取线程池大小配置"""
+    default = DEFAULT_POOL_SIZES[kind]
+    try:
+        size = int(os.getenv(POOL_SIZE_ENV[kind], default))
+    except ValueError:
+        logger.warning(f"⚠️ 环境变量 {POOL_SIZE_ENV[kind]} 不是有效整数，使用默认值 {default}")
+        size = default
+    return max(1, size)
+
+
+def get_executor(kind: str) -> ThreadPoolExecutor:
+    """获取（必要时创建）指定类型的线程池
+
+    Args:
+        kind: 任务类型（llm / db / search / io / build）
+
+    Returns:
+        ThreadPoolExecutor: 对应的有界线程池
+    """
+    if kind not in DEFAULT_POOL_SIZES:
+        raise ValueError(f"未知的任务类型: {kind}")
+
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                size = _pool_size(kind)
+                executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"qiling-{kind}")
+                _executors[kind] = executor
+                logger.info(f"✓ 已创建 {kind} 线程池，大小: {size}")
+    return executor
+
+
+async def run_blocking(kind: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在指定线程池中执行阻塞函数，并在事件循环中等待结果"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(kind), functools.partial(func, *args, **kwargs))
+
+
+async def run_llm(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在大模型线程池中执行"""
+    return await run_blocking("llm", func, *args, **kwargs)
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在数据库线程池中执行"""
+    return await run_blocking("db", func, *args, **kwargs)
+
+
+async def run_search(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在向量检索线程池中执行"""
+    return await run_blocking("search", func, *args, **kwargs)
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """关闭所有线程池（应用退出时调用）"""
+    with _executors_lock:
+        for kind, executor in _executors.items():
+            executor.shutdown(wait=wait)
+            logger.info(f"已关闭 {kind} 线程池")
+        _executors.clear()
@@ -0,0 +1,116 @@
+# 测试公共夹具：服务模块位于上级目录，以脚本方式互相导入；模拟 ERNIE 服务在后台线程中运行
+import os
+import socket
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_ernie_server  # noqa: E402
+
+CATALOGUE_COLUMNS = ["文物名称", "图片地址", "编号-年代", "历史", "工艺"]
+EMBEDDING_DIMENSION = 16
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def mock_ernie_url():
+    """启动本地模拟 ERNIE 服务（无延迟），返回其地址"""
+    import uvicorn
+
+    mock_ernie_server.settings.update(latency=0.0, token_delay=0.0, rate_limit_ratio=0.0)
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(mock_ernie_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("模拟 ERNIE 服务启动超时")
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join(5)
+
+
+@pytest.fixture
+def ernie_env(mock_ernie_url, monkeypatch):
+    """让客户端访问模拟服务"""
+    monkeypatch.setenv("AI_STUDIO_API_KEY", "test-key")
+    monkeypatch.setenv("ERNIE_BASE_URL", mock_ernie_url)
+    return mock_ernie_url
+
+
+def catalogue_row(name, number, history="", craft=""):
+    """一行文物表数据（Excel 列名）"""
+    return {"文物名称": name, "图片地址": f"https://example.com/{number}.jpg", "编号-年代": number,
+            "历史": history, "工艺": craft}
+
+
+def write_catalogue(path, rows):
+    pd.DataFrame(rows, columns=CATALOGUE_COLUMNS).to_csv(path, index=False)
+
+
+def write_embedding_table(prefix, texts):
+    """为 texts 分词后的所有词生成确定性的随机词向量（同一个词在不同表中的向量相同），写入词向量表"""
+    from vector_db_service import _cut_texts
+    from vocab_table import write_vocab_table
+
+    tokens = sorted({word for words in _cut_texts(list(texts)) for word in words} | {"[UNK]"})
+    matrix = np.vstack([np.random.default_rng(zlib.crc32(token.encode("utf-8"))).normal(size=EMBEDDING_DIMENSION)
+                        for token in tokens])
+    write_vocab_table(str(prefix), tokens, matrix, "[UNK]")
+
+
+@pytest.fixture
+def vector_db_factory(tmp_path):
+    """构建小型向量数据库：文物表写为 CSV，词向量表覆盖 rows 与 extra_rows 中的全部词"""
+    from vector_db_service import VectorDatabaseService, row_to_document
+    from vocab_table import VocabEmbeddingTable
+
+    def make(rows, extra_rows=(), index_type="flat", index_params=None, name="vector_db"):
+        catalogue = tmp_path / f"{name}.csv"
+        write_catalogue(catalogue, rows)
+        prefix = tmp_path / f"{name}_vocab"
+        write_embedding_table(prefix, [row_to_document(row)["content"] for row in [*rows, *extra_rows]])
+        service = VectorDatabaseService(str(catalogue), str(tmp_path / name), index_type, index_params,
+                                        embedding_model=VocabEmbeddingTable(str(prefix)))
+        assert service.build_vector_database()
+        return service
+
+    return make
+
+
+def reopen(service, **kwargs):
+    """以新的服务对象重新加载同一个向量数据库（模拟另一个 worker 或重启）"""
+    from vector_db_service import VectorDatabaseService
+
+    return VectorDatabaseService(service.excel_file_path, service.vector_db_path, service.index_type,
+                                 service.index_params, embedding_model=service.embedding_model, **kwargs)
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """导入 fastapi_app（模块导入时创建的日志、缓存与向量数据库目录均位于临时目录中）
+
+    不进入应用的 lifespan，因此不会在后台预热向量数据库。
+    """
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        import fastapi_app
+
+        yield fastapi_app
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,151 @@
+# 批量识别测试：令牌桶、退避、重试与检查点续传；时钟与等待函数替换为可控的假时钟
+import json
+
+import pytest
+
+import batch_recognition
+from batch_recognition import (RateLimitedError, RecognitionCheckpoint, TokenBucket, TransientError,
+                               backoff_delay, run_batch_recognition)
+
+
+class _FakeClock:
+    """sleep 只推进时间并记录等待时长"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return _FakeClock()
+
+
+@pytest.fixture
+def max_jitter(monkeypatch):
+    # 全抖动取上限，退避时间确定为 min(cap, base * 2^attempt)
+    monkeypatch.setattr(batch_recognition.random, "uniform", lambda low, high: high)
+
+
+def _run(tasks, recognize, clock, **kwargs):
+    kwargs.setdefault("rate", 0)
+    return run_batch_recognition(tasks, recognize, workers=1, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_token_bucket_allows_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+    clock.now += 0.2
+    bucket.acquire()
+    assert clock.sleeps[1:] == [pytest.approx(0.3)]
+
+
+def test_pause_blocks_until_deadline_and_drops_saved_tokens(clock):
+    bucket = TokenBucket(rate=1, capacity=4, clock=clock, sleep=clock.sleep)
+
+    bucket.pause(3)
+    bucket.pause(1)
+    bucket.acquire()
+
+    # 暂停结束后桶是空的，需要再等一个令牌
+    assert clock.sleeps == [pytest.approx(3), pytest.approx(1)]
+
+    unlimited = TokenBucket(rate=0, clock=clock, sleep=clock.sleep)
+    unlimited.pause(2)
+    unlimited.acquire()
+    unlimited.acquire()
+    assert clock.sleeps[2:] == [pytest.approx(2)]
+
+
+def test_backoff_grows_exponentially_up_to_cap(max_jitter):
+    assert [backoff_delay(attempt, base=0.5, cap=5) for attempt in range(6)] == [0.5, 1, 2, 4, 5, 5]
+
+
+def test_backoff_jitter_stays_within_bounds():
+    delays = [backoff_delay(3, base=1, cap=6) for _ in range(200)]
+    assert all(0 <= delay <= 6 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_rate_limit_and_transient_errors_are_retried(clock, max_jitter):
+    errors = [RateLimitedError(retry_after=5), TransientError("连接超时")]
+    calls = []
+
+    def recognize(payload):
+        calls.append(payload)
+        if errors:
+            raise errors.pop(0)
+        return {"artifact_type": payload}
+
+    results, failures = _run([("a.jpg", "瓷器")], recognize, clock)
+
+    assert results == {"a.jpg": {"artifact_type": "瓷器"}} and failures == {}
+    assert len(calls) == 3
+    # 429 按 Retry-After 暂停令牌桶，临时错误按第 1 次重试的退避时间等待
+    assert clock.sleeps == [5, 2]
+
+
+def test_failures_are_reported_and_not_checkpointed(clock, max_jitter, tmp_path):
+    checkpoint = RecognitionCheckpoint(str(tmp_path / "recognition.jsonl"))
+    calls = []
+
+    def recognize(payload):
+        calls.append(payload)
+        if payload == "timeout":
+            raise TransientError("连接超时")
+        if payload == "bad":
+            raise ValueError("图片无法解码")
+        return {"artifact_type": payload}
+
+    results, failures = _run([("a", "timeout"), ("b", "bad"), ("c", "瓷器")], recognize, clock,
+                             checkpoint=checkpoint, max_retries=2)
+
+    assert results == {"c": {"artifact_type": "瓷器"}}
+    assert set(failures) == {"a", "b"}
+    # 临时错误重试 max_retries 次，其他异常不重试
+    assert calls.count("timeout") == 3 and calls.count("bad") == 1
+    assert checkpoint.load() == {"c": {"artifact_type": "瓷器"}}
+
+
+def test_resume_skips_checkpointed_keys(clock, tmp_path):
+    path = tmp_path / "recognition.jsonl"
+    checkpoint = RecognitionCheckpoint(str(path))
+    tasks = [("a", "铜器"), ("b", "玉器"), ("c", "瓷器"), ("a", "铜器")]
+    calls, fail_once = [], {"玉器"}
+
+    def recognize(payload):
+        calls.append(payload)
+        if payload in fail_once:
+            fail_once.discard(payload)
+            raise ValueError("服务端返回无法解析的结果")
+        return {"artifact_type": payload}
+
+    _, failures = _run(tasks, recognize, clock, checkpoint=checkpoint)
+    assert calls == ["铜器", "玉器", "瓷器"] and set(failures) == {"b"}
+    # 中断时写了一半的最后一行（截断在多字节字符中间）在恢复时被忽略
+    with open(path, "ab") as f:
+        f.write(json.dumps({"key": "b", "result": {"artifact_type": "玉器"}}, ensure_ascii=False).encode("utf-8")[:-5])
+
+    calls.clear()
+    results, failures = _run(tasks, recognize, clock, checkpoint=RecognitionCheckpoint(str(path)))
+
+    assert calls == ["玉器"] and failures == {}
+    assert results == {key: {"artifact_type": payload} for key, payload in tasks}
+
+    calls.clear()
+    assert _run(tasks, recognize, clock, checkpoint=RecognitionCheckpoint(str(path)))[0] == results
+    assert calls == []
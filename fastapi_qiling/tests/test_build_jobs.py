@@ -0,0 +1,78 @@
+# 后台构建任务测试：在子进程中构建小型向量数据库，检查进度、构建期间拒绝写入、取消与原子切换
+import glob
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from build_jobs import STATUS_CANCELLED, STATUS_SUCCEEDED, BuildJobManager
+from conftest import catalogue_row, reopen, write_catalogue
+
+ROWS = [
+    catalogue_row("青花缠枝莲纹瓶", "故00001-明", "明代宣德年间景德镇御窑烧造", "青花"),
+    catalogue_row("金瓯永固杯", "故00003-清", "乾隆皇帝元旦开笔时使用", "錾刻镶嵌"),
+]
+NEW_ROW = catalogue_row("兰亭序摹本", "故00005-唐", "唐代冯承素摹写的王羲之书法", "纸本墨迹")
+
+
+@pytest.fixture
+def service(vector_db_factory, tmp_path, monkeypatch):
+    service = vector_db_factory(ROWS, extra_rows=[NEW_ROW])
+    # 构建子进程加载同一个词向量表
+    monkeypatch.setenv("VOCAB_TABLE_PATH", str(tmp_path / "vector_db_vocab"))
+    return service
+
+
+def _wait(job, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        assert time.monotonic() < deadline, "构建任务超时"
+        time.sleep(0.1)
+
+
+def _leftover_builds(service):
+    return glob.glob(glob.escape(service.vector_db_path) + ".build-*")
+
+
+def test_build_reports_progress_rejects_writes_and_swaps(service, app_module, monkeypatch):
+    write_catalogue(service.excel_file_path, [*ROWS, NEW_ROW])
+    manager = BuildJobManager(service)
+    monkeypatch.setattr(app_module, "build_jobs", manager)
+
+    job = manager.submit(force_rebuild=True)
+    try:
+        with pytest.raises(RuntimeError):
+            manager.submit()
+        with pytest.raises(HTTPException) as rejected:
+            app_module._reject_during_build()
+        assert rejected.value.status_code == 409
+        # 共用数据库目录的其他 worker 也能发现正在构建
+        assert BuildJobManager(reopen(service, load=False)).build_locked_elsewhere()
+    finally:
+        _wait(job)
+
+    assert job.status == STATUS_SUCCEEDED, job.error
+    assert (job.rows_read, job.rows_embedded, job.rows_indexed) == (3, 3, 3)
+    assert service.document_count() == 3
+    assert service.search_normal("兰亭序摹本 唐代冯承素摹写的王羲之书法", top_k=1)[0]["metadata"]["artifact_name"] == "兰亭序摹本"
+    assert not _leftover_builds(service)
+    assert not manager.build_locked_elsewhere()
+    app_module._reject_during_build()
+
+
+def test_cancel_leaves_serving_store_intact(service):
+    write_catalogue(service.excel_file_path, [NEW_ROW])
+    generation = service._generation
+    manager = BuildJobManager(service)
+
+    job = manager.submit(force_rebuild=True)
+    manager.cancel(job.id)
+    _wait(job)
+
+    assert job.status == STATUS_CANCELLED
+    assert service._generation == generation
+    assert service.document_count() == len(ROWS)
+    assert reopen(service).document_count() == len(ROWS)
+    assert not _leftover_builds(service)
+    # 取消后构建锁已释放，可以再次提交
+    _wait(manager.submit(force_rebuild=True))
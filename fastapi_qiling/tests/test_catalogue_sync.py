@@ -0,0 +1,47 @@
+# 文物表同步测试：按内容哈希只写入新增与变化的文物，删除表中不存在的文物
+from conftest import catalogue_row, write_catalogue
+from vector_db_service import artifact_id_for, row_to_document
+
+UNCHANGED = catalogue_row("青花缠枝莲纹瓶", "故00001-明", "明代宣德年间景德镇御窑烧造", "青花")
+CHANGED = catalogue_row("金瓯永固杯", "故00003-清", "乾隆皇帝元旦开笔时使用", "錾刻镶嵌")
+CHANGED_NEW = catalogue_row("金瓯永固杯", "故00003-清", "乾隆四年造办处制作的酒杯", "錾刻镶嵌")
+REMOVED = catalogue_row("清明上河图", "故00004-北宋", "北宋张择端绘制的风俗画", "绢本设色")
+ADDED = catalogue_row("兰亭序摹本", "故00005-唐", "唐代冯承素摹写的王羲之书法", "纸本墨迹")
+
+
+def _id(row):
+    return artifact_id_for(row_to_document(row)["metadata"])
+
+
+def test_sync_upserts_changed_and_new_rows_and_deletes_removed(vector_db_factory, monkeypatch):
+    service = vector_db_factory([UNCHANGED, CHANGED, REMOVED], extra_rows=[CHANGED_NEW, ADDED])
+    write_catalogue(service.excel_file_path, [UNCHANGED, CHANGED_NEW, ADDED])
+    upserts, deletes = [], []
+    upsert_documents, delete_artifacts = service._upsert_documents, service.delete_artifacts
+    monkeypatch.setattr(service, "_upsert_documents",
+                        lambda ids, docs: upserts.append(list(ids)) or upsert_documents(ids, docs))
+    monkeypatch.setattr(service, "delete_artifacts",
+                        lambda ids: deletes.append(list(ids)) or delete_artifacts(ids))
+
+    stats = service.sync_catalogue()
+
+    assert stats == {"added": 1, "updated": 1, "deleted": 1, "unchanged": 1}
+    assert upserts == [[_id(CHANGED_NEW), _id(ADDED)]]
+    assert deletes == [[_id(REMOVED)]]
+    assert sorted(service._live_hashes()) == sorted([_id(UNCHANGED), _id(CHANGED), _id(ADDED)])
+    assert "乾隆四年" in service.search_normal(row_to_document(CHANGED_NEW)["content"], top_k=1)[0]["content"]
+
+    # 再次同步时没有任何变化
+    upserts.clear()
+    deletes.clear()
+    assert service.sync_catalogue() == {"added": 0, "updated": 0, "deleted": 0, "unchanged": 3}
+    assert upserts == [] and deletes == []
+
+
+def test_sync_reverts_incremental_edits_to_catalogue_content(vector_db_factory):
+    service = vector_db_factory([UNCHANGED, CHANGED], extra_rows=[CHANGED_NEW])
+    # 通过增量接口修改过的文物与文物表不一致，同步时按文物表重新写入
+    service.upsert_artifacts([CHANGED_NEW])
+
+    assert service.sync_catalogue() == {"added": 0, "updated": 1, "deleted": 0, "unchanged": 1}
+    assert "乾隆皇帝" in service.search_normal(row_to_document(CHANGED)["content"], top_k=1)[0]["content"]
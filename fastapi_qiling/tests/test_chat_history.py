@@ -0,0 +1,85 @@
+# 聊天历史分页测试：游标解析 / 生成，以及同一时间戳的多条消息按 (timestamp, id) 翻页
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import dbservice
+
+USER_ID = "42"
+START = datetime(2024, 5, 1, 9, 30)
+
+
+class _SqliteConnection:
+    """用 sqlite 执行 dbservice 中的 SQL；时间以 ISO 文本保存，按文本比较与按时间比较一致"""
+
+    def __init__(self, rows):
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, userid TEXT, role TEXT, "
+                          "content_type TEXT, content TEXT, attachments TEXT, timestamp TEXT)")
+        self.conn.executemany("INSERT INTO messages VALUES (?, ?, ?, 'text', ?, NULL, ?)", rows)
+
+    def execute_query(self, sql, params=()):
+        params = [value.isoformat() if isinstance(value, datetime) else value for value in params]
+        rows = self.conn.execute(sql.replace("%s", "?"), params).fetchall()
+        return [{**row, "timestamp": datetime.fromisoformat(row["timestamp"])} for row in map(dict, rows)]
+
+    def close(self):
+        pass
+
+
+class _IdleWriter:
+    def has_pending(self, user_id):
+        return False
+
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    # 11 条消息：每两条共用一个时间戳，id 与时间顺序交错；另有其他用户的消息
+    rows = [(message_id, USER_ID, "user", f"消息{message_id}",
+             (START + timedelta(minutes=(message_id - 1) // 2)).isoformat())
+            for message_id in (2, 1, 4, 3, 6, 5, 8, 7, 10, 9, 11)]
+    rows.append((12, "other", "user", "其他用户", START.isoformat()))
+    connection = _SqliteConnection(rows)
+    monkeypatch.setattr(dbservice, "get_lizi_connection", lambda: connection)
+    monkeypatch.setattr(app_module, "message_writer", _IdleWriter())
+    return TestClient(app_module.app)
+
+
+def test_cursor_round_trip(app_module):
+    message = {"id": 17, "timestamp": datetime(2024, 5, 1, 9, 30, 15, 250000).isoformat()}
+
+    cursor = app_module._format_history_cursor(message)
+
+    assert app_module._parse_history_cursor(cursor) == (datetime(2024, 5, 1, 9, 30, 15, 250000), 17)
+    # 不是 isoformat 的时间文本（str(datetime)）也能解析
+    assert app_module._parse_history_cursor("2024-05-01 09:30:00,3") == (START, 3)
+
+
+@pytest.mark.parametrize("before", ["abc", "2024-05-01T09:30:00", "2024-05-01T09:30:00,x", "昨天,3", ",3"])
+def test_malformed_cursor_is_rejected(app_module, client, before):
+    with pytest.raises(HTTPException) as rejected:
+        app_module._parse_history_cursor(before)
+    assert rejected.value.status_code == 400
+
+    response = client.get("/api/chat/history", params={"before": before}, headers={"x-user-id": USER_ID})
+
+    assert response.status_code == 400
+
+
+def test_pages_walk_ties_at_the_same_timestamp_without_gaps(client):
+    pages, before = [], None
+    while True:
+        params = {"limit": 3, **({"before": before} if before else {})}
+        body = client.get("/api/chat/history", params=params, headers={"x-user-id": USER_ID}).json()
+        pages.append([int(message["id"]) for message in body["history"]])
+        before = body["next_before"]
+        if not body["has_more"]:
+            break
+
+    # 同一时间戳内按 id 降序，跨页既不重复也不遗漏
+    assert pages == [[11, 10, 9], [8, 7, 6], [5, 4, 3], [2, 1]]
+    assert before is None
@@ -0,0 +1,179 @@
+# 数据库连接池测试：用假的 PooledDB 检查获取超时、出错时归还名额、闲置连接 ping 与连接池指标
+import threading
+import time
+
+import pymysql
+import pytest
+
+import database_handler
+from database_handler import DB_PING_IDLE_SECONDS, DatabaseHandler, PoolMetrics
+
+
+class _SteadyConnection:
+    """对应 PooledDB 中的底层连接：归还后留在池中复用，_qiling_last_used 记录在这里"""
+
+    def __init__(self):
+        self.dead = False
+
+
+class _FakeConnection:
+    """对应 PooledDB.connection() 返回的包装，close 时把底层连接放回池中"""
+
+    def __init__(self, pool, steady):
+        self.pool = pool
+        self._con = steady
+        self.closed = False
+
+    def ping(self, reconnect=False):
+        self.pool.pings += 1
+        if self.pool.ping_error:
+            self._con.dead = True
+            raise pymysql.err.OperationalError(2006, "MySQL server has gone away")
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+        if not self._con.dead:
+            self.pool.idle.append(self._con)
+
+
+class _FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=()):
+        errors = self.connection.pool.query_errors
+        if errors:
+            self.connection._con.dead = True
+            raise errors.pop(0)
+        return 1
+
+    def fetchall(self):
+        return [{"id": 1}]
+
+
+class _FakePool:
+    def __init__(self):
+        self.connect_errors = []
+        self.query_errors = []
+        self.ping_error = False
+        self.pings = 0
+        self.idle = []
+        self.created = 0
+
+    def connection(self):
+        if self.connect_errors:
+            raise self.connect_errors.pop(0)
+        if not self.idle:
+            self.created += 1
+            self.idle.append(_SteadyConnection())
+        return _FakeConnection(self, self.idle.pop())
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = _FakePool()
+    monkeypatch.setattr(DatabaseHandler, "_pool", pool)
+    monkeypatch.setattr(DatabaseHandler, "_slots", threading.BoundedSemaphore(2))
+    monkeypatch.setattr(database_handler, "pool_metrics", PoolMetrics())
+    return pool
+
+
+def _handler():
+    return DatabaseHandler("localhost", 3306, "root", "", "lizi")
+
+
+def _free_slots():
+    slots = DatabaseHandler._slots
+    count = 0
+    while slots.acquire(blocking=False):
+        count += 1
+    for _ in range(count):
+        slots.release()
+    return count
+
+
+def test_acquire_times_out_when_pool_is_full(pool):
+    first, second, waiting = _handler(), _handler(), _handler()
+    assert first.connect() and second.connect()
+
+    started = time.monotonic()
+    assert not waiting.connect(timeout=0.05)
+
+    assert time.monotonic() - started >= 0.05
+    stats = database_handler.pool_stats()
+    assert stats["timeouts"] == 1 and stats["in_use"] == 2
+
+    # 其他线程归还连接后，等待中的获取成功并计入等待指标
+    threading.Timer(0.05, first.close).start()
+    assert waiting.connect(timeout=5)
+    stats = database_handler.pool_stats()
+    assert stats["waits"] == 1 and stats["in_use"] == 2 and stats["max_wait_ms"] > 0
+    second.close()
+    waiting.close()
+    assert _free_slots() == 2 and database_handler.pool_stats()["in_use"] == 0
+
+
+@pytest.mark.parametrize("error", [pymysql.err.OperationalError(2003, "Can't connect to MySQL server"),
+                                   RuntimeError("连接池内部错误")], ids=["mysql_error", "other_error"])
+def test_connection_error_releases_slot(pool, error):
+    pool.connect_errors = [error, error]
+    handler = _handler()
+
+    assert not handler.connect()
+    assert handler.execute_query("SELECT 1") == []
+
+    assert _free_slots() == 2
+    assert database_handler.pool_stats()["in_use"] == 0
+    assert handler.execute_query("SELECT 1") == [{"id": 1}]
+
+
+def test_idle_connection_is_pinged_and_replaced_when_dead(pool):
+    handler = _handler()
+    assert handler.execute_query("SELECT 1") == [{"id": 1}]
+    handler.close()
+
+    # 刚使用过的连接不 ping
+    assert handler.execute_query("SELECT 1") == [{"id": 1}]
+    assert pool.pings == 0
+    handler.close()
+
+    assert pool.created == 1
+    steady = pool.idle[0]
+    steady._qiling_last_used -= DB_PING_IDLE_SECONDS + 1
+    pool.ping_error = True
+    assert handler.execute_query("SELECT 1") == [{"id": 1}]
+
+    assert pool.pings == 1 and pool.created == 2
+    stats = database_handler.pool_stats()
+    assert stats["pings"] == 1 and stats["reconnects"] == 1 and stats["in_use"] == 1
+    handler.close()
+    assert _free_slots() == 2
+
+
+def test_lost_connection_during_query_reconnects_without_leaking(pool):
+    pool.query_errors = [pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query")]
+    handler = _handler()
+
+    # 断开的连接归还后换一个新连接，名额没有重复占用
+    assert handler.execute_query("SELECT 1") == []
+    assert database_handler.pool_stats()["in_use"] == 1 and _free_slots() == 1
+    assert handler.execute_query("SELECT 1") == [{"id": 1}]
+    assert pool.created == 2
+
+    del handler
+    assert _free_slots() == 2 and database_handler.pool_stats()["in_use"] == 0
@@ -0,0 +1,75 @@
+# 文档存储测试：写入 / 读取往返、空存储，以及发布新版本时已打开的读者
+import glob
+
+import pytest
+
+from document_store import DocumentStore, open_document_store, store_exists, store_files, write_documents
+
+DOCUMENTS = [
+    {
+        "content": "文物名称：青花缠枝莲纹瓶\n历史：明代宣德年间景德镇御窑烧造 🏺",
+        "metadata": {
+            "artifact_name": "青花缠枝莲纹瓶", "image_url": "https://example.com/青花.jpg",
+            "number_period": "故００００１-明", "history": "明代宣德年间景德镇御窑烧造", "craft": "青花",
+            "index": 0, "recognition_result": {"artifact_type": "瓷器", "confidence": 0.9},
+            "source_sheet": "瓷器卷",
+        },
+    },
+    {
+        "content": "Ｔｈｅ Ｇｏｌｄｅｎ Ｃｕｐ — 金瓯永固杯",
+        "metadata": {"artifact_name": "金瓯永固杯", "image_url": "", "number_period": "故00003-清",
+                     "history": "", "craft": "錾刻镶嵌", "index": 12},
+    },
+    {
+        "content": "",
+        "metadata": {"artifact_name": "", "image_url": "", "number_period": "", "history": "", "craft": ""},
+    },
+]
+
+
+def test_round_trip_preserves_unicode_and_metadata(tmp_path):
+    prefix = str(tmp_path / "documents")
+
+    assert write_documents(prefix, DOCUMENTS) == 3
+    store = open_document_store(prefix)
+
+    assert len(store) == 3
+    assert list(store) == DOCUMENTS
+    assert store[-1] == DOCUMENTS[2]
+    assert store.get_field(0, "recognition_result") == {"artifact_type": "瓷器", "confidence": 0.9}
+    assert store.get_field(1, "index") == 12
+    assert store.get_field(2, "index") is None
+    with pytest.raises(IndexError):
+        store.get_field(3, "content")
+
+
+def test_empty_store(tmp_path):
+    prefix = str(tmp_path / "documents")
+    assert open_document_store(prefix) is None
+
+    assert write_documents(prefix, []) == 0
+
+    assert store_exists(prefix)
+    store = DocumentStore(prefix)
+    assert len(store) == 0
+    assert list(store) == []
+    store.close()
+
+
+def test_open_reader_keeps_previous_version_across_publish(tmp_path):
+    prefix = str(tmp_path / "documents")
+    write_documents(prefix, DOCUMENTS[:1])
+    reader = DocumentStore(prefix)
+
+    write_documents(prefix, DOCUMENTS[1:])
+
+    # 已打开的读者继续读取旧版本，新打开的读者读到新版本
+    assert list(reader) == DOCUMENTS[:1]
+    assert list(DocumentStore(prefix)) == DOCUMENTS[1:]
+
+    # 再发布一次后，只保留当前与上一个版本的数据文件；旧读者的内存映射仍然可用
+    write_documents(prefix, DOCUMENTS)
+    assert len(glob.glob(glob.escape(prefix) + ".*.heap")) == 2
+    assert len(store_files(prefix)) == 5
+    assert list(reader) == DOCUMENTS[:1]
+    assert list(DocumentStore(prefix)) == DOCUMENTS
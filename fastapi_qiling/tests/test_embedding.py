@@ -0,0 +1,106 @@
+# 文本向量化测试：批量分词、词向量查表，以及裁剪词向量表与完整模型的一致性
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import vector_db_service
+import vocab_table
+from conftest import catalogue_row, write_catalogue
+from vector_db_service import VectorDatabaseService, _cut_texts, create_tokenize_pool, row_to_document
+from vocab_table import VocabEmbeddingTable, open_vocab_table, write_vocab_table
+
+TEXTS = ["青花缠枝莲纹瓶，明代宣德年间景德镇御窑烧造", "金瓯永固杯是乾隆皇帝元旦开笔时使用的酒杯", "清明上河图"] * 4
+
+
+def test_service_tokenizes_in_process_without_a_pool(tmp_path):
+    service = VectorDatabaseService(str(tmp_path / "catalogue.csv"), str(tmp_path / "vector_db"), load=False)
+
+    assert service.tokenize_pool is None
+    assert service._tokenize_texts(TEXTS) == _cut_texts(TEXTS)
+
+
+def test_build_pool_tokenizes_in_spawned_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_db_service, "EMBED_TOKENIZE_WORKERS", 2)
+    monkeypatch.setattr(vector_db_service, "EMBED_PARALLEL_THRESHOLD", 4)
+    service = VectorDatabaseService(str(tmp_path / "catalogue.csv"), str(tmp_path / "vector_db"), load=False)
+    service.tokenize_pool = create_tokenize_pool()
+    try:
+        assert service.tokenize_pool._mp_context.get_start_method() == "spawn"
+        assert service._tokenize_texts(TEXTS) == _cut_texts(TEXTS)
+    finally:
+        service.tokenize_pool.shutdown()
+
+
+ROWS = [
+    catalogue_row("青花缠枝莲纹瓶", "故00001-明", "明代宣德年间景德镇御窑烧造", "青花"),
+    catalogue_row("金瓯永固杯", "故00003-清", "乾隆皇帝元旦开笔时使用", "錾刻镶嵌"),
+]
+GENERAL_WORDS = ["的", "是", "在", "博物馆", "展览"]
+
+
+class _FullModel:
+    """完整词向量模型（TokenEmbedding）的最小替身：按词频排序的词表，未登录词排在最后"""
+
+    unknown_token = "[UNK]"
+
+    def __init__(self, words):
+        self.vocab = types.SimpleNamespace(token_to_idx={word: idx for idx, word in enumerate(words)})
+        self.weight = types.SimpleNamespace(
+            numpy=lambda: np.random.default_rng(0).normal(size=(len(words), 8)).astype(np.float32))
+
+    def get_idx_from_word(self, word):
+        return self.vocab.token_to_idx.get(word, self.vocab.token_to_idx[self.unknown_token])
+
+
+def _service(tmp_path, model):
+    return VectorDatabaseService(str(tmp_path / "catalogue.csv"), str(tmp_path / "vector_db"), load=False,
+                                 embedding_model=model)
+
+
+def test_unknown_tokens_use_the_unk_row(tmp_path):
+    prefix = str(tmp_path / "vocab")
+    write_vocab_table(prefix, ["青花", "[UNK]", "瓷器"], np.arange(6, dtype=np.float32).reshape(3, 2), "[UNK]")
+    table = open_vocab_table(prefix)
+
+    assert (len(table), table.dimension, table.unk_idx) == (3, 2, 1)
+    assert table.matrix.dtype == np.float16
+    service = _service(tmp_path, table)
+    vectors = service._embed_tokenized([["青花"], ["没有收录的词"], ["青花", "没有收录的词"], []])
+    assert vectors.tolist() == [[0, 1], [2, 3], [1, 2], [0, 0]]
+
+
+def test_row_count_must_match_vocab_size(tmp_path):
+    prefix = str(tmp_path / "vocab")
+    write_vocab_table(prefix, ["青花", "[UNK]"], np.zeros((3, 2)), "[UNK]")
+
+    with pytest.raises(ValueError):
+        VocabEmbeddingTable(prefix)
+    assert open_vocab_table(str(tmp_path / "missing")) is None
+
+
+def test_trimmed_table_matches_full_model_for_catalogue_tokens(tmp_path, monkeypatch):
+    catalogue = tmp_path / "catalogue.csv"
+    write_catalogue(catalogue, ROWS)
+    contents = [row_to_document(row)["content"] for row in ROWS]
+    catalogue_words = sorted({word for words in _cut_texts(contents) for word in words})
+    # 完整词表：常用词在前，文物表中的词与未收录的生僻词在后
+    model = _FullModel([*GENERAL_WORDS, "生僻", *catalogue_words, "[UNK]"])
+    paddlenlp = types.ModuleType("paddlenlp")
+    paddlenlp.embeddings = types.SimpleNamespace(TokenEmbedding=lambda name: model)
+    monkeypatch.setitem(sys.modules, "paddlenlp", paddlenlp)
+    monkeypatch.setitem(sys.modules, "paddlenlp.embeddings", paddlenlp.embeddings)
+    prefix = str(tmp_path / "vocab")
+
+    assert vocab_table.main(["--excel", str(catalogue), "--output", prefix, "--general-size", "3"]) == 0
+
+    table = VocabEmbeddingTable(prefix)
+    assert table.tokens == [*GENERAL_WORDS[:3], *catalogue_words, "[UNK]"]
+    full, trimmed = _service(tmp_path, model), _service(tmp_path, table)
+    queries = [*contents, "明代的青花", "博物馆里的生僻词"]
+    expected, actual = full.embed_texts(queries), trimmed.embed_texts(queries)
+    # 文物文档与只含收录词的查询与完整模型一致（float16 精度）
+    np.testing.assert_allclose(actual[:3], expected[:3], rtol=1e-3, atol=1e-3)
+    # 超出常用词数的词（博物馆）与生僻词在裁剪表中按未登录词处理
+    assert not np.allclose(actual[3], expected[3], atol=1e-3)
@@ -0,0 +1,68 @@
+# 接口测试：不进入 lifespan，依赖的大模型客户端与消息保存替换为内存中的实现
+import asyncio
+import io
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from conftest import catalogue_row, reopen
+from readiness import ReadinessRegistry
+
+
+class _StubChatClient:
+    def __init__(self, reply):
+        self.reply = reply
+
+    async def chat_completion(self, messages):
+        return self.reply
+
+
+def _png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), (200, 30, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_reply_is_returned_when_saving_the_turn_fails(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "async_multimodal_client", _StubChatClient("这是一件青花瓷。"))
+    saved = []
+    monkeypatch.setattr(app_module, "_save_message", lambda *args, **kwargs: saved.append(args[1:3]) or True)
+
+    def write_upload(file_ext, content):
+        raise OSError("磁盘已满")
+
+    monkeypatch.setattr(app_module, "_write_upload", write_upload)
+    app_module.context_cache.set("7", [{"role": "user", "content": "你好"}])
+
+    response = TestClient(app_module.app).post(
+        "/api/chat/send", data={"message": "这是什么文物"}, headers={"x-user-id": "7"},
+        files={"image": ("artifact.png", _png_bytes(), "image/png")})
+
+    assert response.status_code == 200
+    assert response.json()["data"]["ai_response"] == "这是一件青花瓷。"
+    # 图片无法保存时仍保存完整的一轮对话（文字消息 + 回复）
+    assert saved == [("user", "这是什么文物"), ("assistant", "这是一件青花瓷。")]
+
+
+def test_readiness_probe_is_ready_only_after_warm_up(app_module, vector_db_factory, monkeypatch):
+    service = reopen(vector_db_factory([catalogue_row("金瓯永固杯", "故00003-清", "乾隆皇帝元旦开笔时使用")]),
+                     load=False)
+    registry = ReadinessRegistry()
+    registry.register("vector_db", check=service.is_ready)
+    monkeypatch.setattr(app_module, "readiness", registry)
+    monkeypatch.setattr(app_module, "vector_db_service", service)
+    client = TestClient(app_module.app)
+
+    response = client.get("/api/health/ready")
+    assert response.status_code == 503
+    assert response.json()["state"] == "starting"
+    # 存活探针始终返回 200，并保留原有的 status 字段
+    health = client.get("/api/health")
+    assert health.status_code == 200
+    assert health.json()["status"] == "healthy" and not health.json()["ready"]
+
+    asyncio.run(app_module._warm_up())
+
+    response = client.get("/api/health/ready")
+    assert response.status_code == 200
+    assert response.json()["components"]["vector_db"]["status"] == "ready"
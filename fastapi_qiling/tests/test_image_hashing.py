@@ -0,0 +1,89 @@
+# 近重复图片检索测试：多索引哈希与暴力检索一致，重新编码 / 缩放的图片在阈值内命中，不同图片不命中
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from image_hashing import (IMAGE_HASH_MAX_DISTANCE, SOURCE_CATALOGUE, SOURCE_UPLOAD, MultiIndexHash,
+                           NearDuplicateIndex, compute_image_hashes, hamming_distance)
+
+RECOGNITION = {"artifact_type": "瓷器", "artifact_name": "青花缠枝莲纹瓶", "confidence": 0.9}
+
+
+def _photo(seed, size=(320, 240)):
+    """平滑的色块背景上叠加若干圆形，近似一张照片的低频结构"""
+    rng = np.random.default_rng(seed)
+    image = Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)).resize(size, Image.BICUBIC)
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x, y, radius = int(rng.integers(0, size[0])), int(rng.integers(0, size[1])), int(rng.integers(15, 60))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                     fill=tuple(int(value) for value in rng.integers(0, 256, 3)))
+    return image
+
+
+def _encode(image, image_format="PNG", **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def test_multi_index_search_matches_brute_force():
+    rng = np.random.default_rng(7)
+    values = [int(value) for value in rng.integers(0, 2 ** 63, 500, dtype=np.uint64)]
+    query = values[0]
+    # 与查询相差恰好 8 位和 9 位的哈希
+    values += [query ^ 0xFF, query ^ 0x1FF]
+    index = MultiIndexHash()
+    for key, value in enumerate(values):
+        index.add(value, key)
+
+    for query in (values[0], values[123]):
+        expected = sorted((hamming_distance(query, value), key) for key, value in enumerate(values)
+                          if hamming_distance(query, value) <= 8)
+        assert sorted(index.search(query, 8)) == expected
+
+    assert [key for _, key in index.search(values[0], 8)] == [0, 500]
+    assert len(index) == len(values)
+
+
+@pytest.mark.parametrize("variant", [
+    lambda image: _encode(image, "JPEG", quality=55),
+    lambda image: _encode(image.resize((160, 120)), "JPEG", quality=80),
+    lambda image: _encode(image.resize((1024, 768))),
+], ids=["reencoded", "downscaled", "upscaled"])
+def test_reencoded_or_resized_copy_is_found_and_different_image_is_not(tmp_path, variant):
+    index = NearDuplicateIndex(str(tmp_path / "image_hashes.db"))
+    original = _photo(1)
+    index.add(SOURCE_UPLOAD, "original", compute_image_hashes(_encode(original)), recognition=RECOGNITION)
+
+    found = index.lookup(compute_image_hashes(variant(original)))
+
+    assert found is not None and found["key"] == "original"
+    assert found["distance"] <= IMAGE_HASH_MAX_DISTANCE
+    assert found["recognition"] == RECOGNITION
+    for seed in range(100, 110):
+        assert index.lookup(compute_image_hashes(_encode(_photo(seed)))) is None
+    assert index.stats()["hits"] == 1 and index.stats()["misses"] == 10
+
+
+def test_lookup_filters_and_entries_persist(tmp_path):
+    path = str(tmp_path / "image_hashes.db")
+    index = NearDuplicateIndex(path)
+    hashes = compute_image_hashes(_encode(_photo(2)))
+    index.add(SOURCE_CATALOGUE, "https://example.com/故00001-明.jpg", hashes,
+              artifact={"文物名称": "青花缠枝莲纹瓶"})
+
+    assert index.lookup(hashes, source=SOURCE_UPLOAD) is None
+    assert index.lookup(hashes, require_recognition=True) is None
+    assert index.lookup(hashes, source=SOURCE_CATALOGUE)["artifact"] == {"文物名称": "青花缠枝莲纹瓶"}
+
+    # 另一个进程打开同一文件时载入已有条目
+    reopened = NearDuplicateIndex(path)
+    assert len(reopened) == 1
+    assert reopened.lookup(hashes)["distance"] == 0
+
+
+def test_undecodable_bytes_have_no_hash():
+    assert compute_image_hashes(b"not an image") is None
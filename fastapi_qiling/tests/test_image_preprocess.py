@@ -0,0 +1,116 @@
+# 图片预处理测试：原图直通、按原始尺寸缩小、去除 EXIF，以及按字节数淘汰的 LRU 缓存
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_preprocess
+from image_preprocess import PreparedImage, PreparedImageCache, prepare_image_bytes
+
+ORIENTATION = 0x0112
+MAKE = 0x010F
+
+
+@pytest.fixture(autouse=True)
+def max_edge(monkeypatch):
+    monkeypatch.setattr(image_preprocess, "IMAGE_MAX_EDGE", 100)
+    return 100
+
+
+def _gradient(width, height):
+    x = np.linspace(0, 255, width, dtype=np.float64)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float64)[:, None]
+    pixels = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                       np.full((height, width), 128.0)], axis=-1)
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+def _encode(image, image_format="JPEG", **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def _decode(prepared):
+    with Image.open(io.BytesIO(prepared.data)) as image:
+        image.load()
+        return image
+
+
+def test_small_jpeg_is_passed_through():
+    original = _encode(_gradient(90, 60), quality=80)
+
+    prepared = prepare_image_bytes(original, use_cache=False)
+
+    assert prepared.data is original
+    assert (prepared.mime_type, prepared.width, prepared.height) == ("image/jpeg", 90, 60)
+
+
+def test_jpeg_that_draft_shrinks_to_the_limit_is_still_downscaled():
+    # 200x200 的 JPEG 按 1/2 draft 解码后恰好是 100x100，但原始内容仍超过尺寸上限
+    original = _encode(_gradient(200, 200), quality=50)
+
+    prepared = prepare_image_bytes(original, use_cache=False)
+
+    assert prepared.data != original
+    assert _decode(prepared).size == (100, 100)
+
+
+def test_large_png_is_downscaled_and_reencoded():
+    prepared = prepare_image_bytes(_encode(_gradient(400, 300), "PNG"), use_cache=False)
+
+    assert prepared.mime_type == "image/jpeg"
+    assert (prepared.width, prepared.height) == (100, 75)
+    decoded = _decode(prepared)
+    assert decoded.format == "JPEG" and decoded.size == (100, 75)
+
+
+def test_exif_is_applied_and_stripped():
+    exif = Image.Exif()
+    exif[ORIENTATION] = 6  # 顺时针旋转 90 度显示
+    exif[MAKE] = "Canon"
+    original = _encode(_gradient(80, 40), quality=90, exif=exif.tobytes())
+
+    prepared = prepare_image_bytes(original, use_cache=False)
+
+    # 尺寸未超限也要重新编码：按方向摆正后不再携带 EXIF
+    decoded = _decode(prepared)
+    assert decoded.size == (40, 80) and (prepared.width, prepared.height) == (40, 80)
+    assert "exif" not in decoded.info
+    assert not decoded.getexif()
+
+
+def test_undecodable_bytes_are_returned_with_guessed_mime_type():
+    prepared = prepare_image_bytes(b"not an image", "photo.webp", use_cache=False)
+
+    assert prepared.data == b"not an image" and prepared.mime_type == "image/webp"
+
+
+def test_results_are_cached_by_content():
+    original = _encode(_gradient(120, 90), quality=80)
+
+    assert prepare_image_bytes(original) is prepare_image_bytes(original)
+
+
+def test_cache_evicts_least_recently_used_by_bytes():
+    def image(size):
+        # 缓存按原始字节、base64 与 data URL 三份计算：300 字节计为 1100
+        return PreparedImage(b"x" * size, "image/jpeg")
+
+    cache = PreparedImageCache(max_bytes=2500)
+    cache.put("a", image(300))
+    cache.put("b", image(300))
+    assert cache.get("a") is not None
+
+    cache.put("c", image(300))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    # 同一个键重新写入时替换旧条目，不会挤掉其他条目
+    cache.put("c", image(30))
+    cache.put("d", image(30))
+    assert all(cache.get(key) is not None for key in ("a", "c", "d"))
+    # 超过容量的条目不缓存，也不清空已有条目
+    cache.put("e", image(1000))
+    assert cache.get("e") is None and cache.get("a") is not None
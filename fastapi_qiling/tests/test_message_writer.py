@@ -0,0 +1,139 @@
+# 消息批量写入器测试（使用内存中的写入函数代替数据库）
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from context_cache import ConversationContextCache
+from message_writer import MessageWriter
+
+
+def test_failed_messages_invalidate_cached_context(tmp_path):
+    cache = ConversationContextCache()
+    cache.set("1", [{"role": "user", "content": "早先的消息"}])
+    cache.set("2", [{"role": "user", "content": "其他用户"}])
+
+    def save_batch(messages):
+        raise ConnectionError("数据库不可用")
+
+    writer = MessageWriter(save_batch, max_retries=0, spool_path=str(tmp_path / "spool.jsonl"),
+                           on_failure=lambda messages: [cache.invalidate(m["user_id"]) for m in messages])
+    writer.start()
+    writer.submit(1, "user", "写入失败的消息")
+    cache.append("1", {"role": "user", "content": "写入失败的消息"})
+    assert writer.flush(5)
+    writer.close(5)
+
+    assert cache.get("1") is None
+    assert cache.get("2") is not None
+    assert writer.stats()["spooled"] == 1
+
+
+def _spool_records(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"user_id": 1, "role": "user", "content_type": "text", "content": f"消息{i}",
+                                "attachments": None, "timestamp": "2024-01-01T00:00:00"}, ensure_ascii=False) + "\n")
+
+
+def _replay_in_worker(spool_path, output_path, start):
+    def save_batch(messages):
+        # 模拟较慢的数据库写入，使各 worker 的补写过程互相重叠
+        time.sleep(0.2)
+        with open(output_path, "a", encoding="utf-8") as f:
+            f.write("".join(message["content"] + "\n" for message in messages))
+
+    start.wait()
+    MessageWriter(save_batch, spool_path=spool_path)._replay_spool()
+
+
+def test_spool_is_replayed_by_only_one_worker(tmp_path):
+    spool_path, output_path = str(tmp_path / "spool.jsonl"), str(tmp_path / "saved.txt")
+    _spool_records(spool_path, 3)
+
+    context = multiprocessing.get_context("fork" if sys.platform != "win32" else "spawn")
+    start = context.Event()
+    workers = [context.Process(target=_replay_in_worker, args=(spool_path, output_path, start)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    for worker in workers:
+        worker.join(10)
+
+    with open(output_path, encoding="utf-8") as f:
+        assert sorted(f.read().split()) == ["消息0", "消息1", "消息2"]
+    assert os.listdir(tmp_path) == ["saved.txt"]
+
+
+def test_failed_replay_returns_messages_to_spool(tmp_path):
+    spool_path = str(tmp_path / "spool.jsonl")
+    _spool_records(spool_path, 2)
+
+    def save_batch(messages):
+        raise ConnectionError("数据库不可用")
+
+    MessageWriter(save_batch, spool_path=spool_path)._replay_spool()
+
+    assert os.listdir(tmp_path) == ["spool.jsonl"]
+    with open(spool_path, encoding="utf-8") as f:
+        assert [json.loads(line)["content"] for line in f] == ["消息0", "消息1"]
+
+
+def test_corrupt_spool_lines_are_skipped_and_replayed_in_batches(tmp_path):
+    spool_path = str(tmp_path / "spool.jsonl")
+    _spool_records(spool_path, 5)
+    with open(spool_path, "a", encoding="utf-8") as f:
+        f.write('{"user_id": 1, "role": "user", "content": "缺少时间"}\n')
+        f.write('{"user_id": 1, "role": "user", "content": "时间错误", "timestamp": "昨天"}\n')
+        f.write('{"user_id": 1, "role": "us\n')
+    batches = []
+
+    writer = MessageWriter(lambda messages: batches.append([m["content"] for m in messages]),
+                           batch_size=2, spool_path=spool_path)
+    writer._replay_spool()
+
+    assert batches == [["消息0", "消息1"], ["消息2", "消息3"], ["消息4"]]
+    assert writer.written == 5
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_replay_batch_returns_only_unsaved_messages(tmp_path):
+    spool_path = str(tmp_path / "spool.jsonl")
+    _spool_records(spool_path, 5)
+    calls = []
+
+    def save_batch(messages):
+        calls.append(len(messages))
+        if len(calls) == 2:
+            raise ConnectionError("数据库不可用")
+
+    MessageWriter(save_batch, batch_size=2, spool_path=spool_path)._replay_spool()
+
+    with open(spool_path, encoding="utf-8") as f:
+        assert [json.loads(line)["content"] for line in f] == ["消息2", "消息3", "消息4"]
+
+
+def test_writer_keeps_running_when_spooling_fails(tmp_path):
+    # 落盘文件的上级“目录”是普通文件，写入落盘文件时抛出 OSError
+    (tmp_path / "blocked").write_text("")
+    failed = []
+    saved = []
+
+    def save_batch(messages):
+        if any(m["content"] == "坏消息" for m in messages):
+            raise ValueError("无法写入")
+        saved.extend(m["content"] for m in messages)
+
+    writer = MessageWriter(save_batch, max_retries=0, spool_path=str(tmp_path / "blocked" / "spool.jsonl"),
+                           on_failure=failed.extend)
+    writer.start()
+    writer.submit(1, "user", "坏消息")
+    assert writer.flush(5)
+    writer.submit(1, "user", "好消息")
+    assert writer.flush(5)
+    writer.close(5)
+
+    assert [m["content"] for m in failed] == ["坏消息"]
+    assert saved == ["好消息"]
+    assert not writer.has_pending(1)
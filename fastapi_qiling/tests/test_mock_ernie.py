@@ -0,0 +1,35 @@
+# 基于模拟 ERNIE 服务的客户端测试
+import asyncio
+
+from PIL import Image
+
+import mock_ernie_server
+from ernie_multimodal import AsyncERNIE4_5MultimodalClient
+
+
+def _collect_stream(stream_factory):
+    """在新的事件循环中创建客户端并收集流式输出的全部分片"""
+    async def run():
+        client = AsyncERNIE4_5MultimodalClient()
+        try:
+            return [text async for text in stream_factory(client)]
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+
+def test_text_stream_yields_reply_in_chunks(ernie_env):
+    chunks = _collect_stream(lambda client: client.text_only_stream("青花瓷有什么特点"))
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == "这是模拟回复。您的问题是：青花瓷有什么特点"
+
+
+def test_multimodal_stream_sends_local_image(ernie_env, tmp_path):
+    image_path = tmp_path / "artifact.png"
+    Image.new("RGB", (64, 48), (30, 60, 120)).save(image_path)
+
+    chunks = _collect_stream(lambda client: client.multimodal_stream("这是什么文物", image_path=str(image_path)))
+
+    # 模拟服务收到图片时返回识别类回复
+    assert "".join(chunks) == mock_ernie_server.RECOGNITION_REPLY
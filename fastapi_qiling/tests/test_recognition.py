@@ -0,0 +1,37 @@
+# 基于模拟 ERNIE 服务的图片识别测试：识别结果解析与缓存
+import mock_ernie_server
+from artifact_recognition_service import ArtifactRecognitionService
+from image_hashing import NearDuplicateIndex
+from recognition_cache import RecognitionCache
+
+
+def test_recognize_image_from_mock_endpoint(ernie_env, tmp_path):
+    cache = RecognitionCache(str(tmp_path / "recognition_cache.db"))
+    service = ArtifactRecognitionService(cache=cache, image_index=NearDuplicateIndex(str(tmp_path / "image_hashes.db")))
+    image_url = f"{ernie_env}/images/sample.png"
+
+    result = service.classify_artifact_image_from_url(image_url)
+
+    assert result[:3] == ("瓷器", "青花缠枝莲纹瓶", 0.88)
+    assert cache.stats()["entries"] == 1
+    # 相同图片再次识别时命中缓存
+    assert service.classify_artifact_image_from_url(image_url) == result
+    assert cache.stats()["hits"] == 1
+
+
+def test_unparsed_reply_is_not_cached(ernie_env, tmp_path, monkeypatch):
+    reply = mock_ernie_server.RECOGNITION_REPLY
+    monkeypatch.setattr(mock_ernie_server, "RECOGNITION_REPLY", "图片太模糊，无法判断。")
+    cache = RecognitionCache(str(tmp_path / "recognition_cache.db"))
+    image_index = NearDuplicateIndex(str(tmp_path / "image_hashes.db"))
+    service = ArtifactRecognitionService(cache=cache, image_index=image_index)
+    image_url = f"{ernie_env}/images/sample.png"
+
+    result = service.classify_artifact_image_from_url(image_url)
+
+    assert result[:3] == ("未知文物", "未知", 0.0)
+    assert cache.stats()["entries"] == 0
+    assert image_index.stats()["entries"] == 0
+    # 模型恢复正常后重新识别，不会一直返回“未知”
+    monkeypatch.setattr(mock_ernie_server, "RECOGNITION_REPLY", reply)
+    assert service.classify_artifact_image_from_url(image_url)[:3] == ("瓷器", "青花缠枝莲纹瓶", 0.88)
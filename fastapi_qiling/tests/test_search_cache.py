@@ -0,0 +1,78 @@
+# 搜索结果缓存测试：LRU / TTL / 按数据库版本失效，以及向量数据库服务中的使用
+import search_cache
+from conftest import catalogue_row
+from search_cache import SearchResultCache, normalize_query
+
+ROWS = [
+    catalogue_row("青花缠枝莲纹瓶", "故00001-明", "明代宣德年间景德镇御窑烧造", "青花"),
+    catalogue_row("金瓯永固杯", "故00003-清", "乾隆皇帝元旦开笔时使用", "錾刻镶嵌"),
+]
+
+
+def test_normalize_query_folds_width_and_whitespace():
+    assert normalize_query("  青花　瓷\n\tＡＢＣ ") == "青花 瓷 ABC"
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SearchResultCache(max_entries=2, ttl=0)
+    cache.put("a", "g1", [{"id": 1}])
+    cache.put("b", "g1", [{"id": 2}])
+    assert cache.get("a", "g1") == [{"id": 1}]
+
+    cache.put("c", "g1", [{"id": 3}])
+
+    assert cache.get("b", "g1") is None
+    assert cache.get("a", "g1") == [{"id": 1}]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(search_cache.time, "monotonic", lambda: now[0])
+    cache = SearchResultCache(max_entries=8, ttl=10)
+    cache.put("a", "g1", [{"id": 1}])
+
+    now[0] += 9
+    assert cache.get("a", "g1") == [{"id": 1}]
+    now[0] += 2
+    assert cache.get("a", "g1") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_new_generation_invalidates_and_old_results_are_not_cached():
+    cache = SearchResultCache(max_entries=8, ttl=0)
+    cache.put("a", "1-g", [{"id": 1}])
+
+    assert cache.get("a", "2-g") is None
+    assert cache.stats()["invalidations"] == 1
+    # 搜索期间数据库已更新：旧版本的结果不写入，也不会把缓存退回旧版本
+    cache.put("a", "1-g", [{"id": 1}])
+    assert cache.get("a", "2-g") is None
+    cache.put("a", "2-g", [{"id": 2}])
+    assert cache.get("a", "2-g") == [{"id": 2}]
+
+
+def test_disabled_cache_stores_nothing():
+    cache = SearchResultCache(max_entries=0)
+    cache.put("a", "g1", [{"id": 1}])
+    assert cache.get("a", "g1") is None
+
+
+def test_search_embeds_original_query_and_cache_follows_generation(vector_db_factory, monkeypatch):
+    service = vector_db_factory(ROWS, extra_rows=[catalogue_row("兰亭序摹本", "故00005-唐", "唐代摹本", "纸本")])
+    embedded = []
+    embed_texts = service.embed_texts
+    monkeypatch.setattr(service, "embed_texts", lambda texts: embedded.extend(texts) or embed_texts(texts))
+
+    first = service.search_normal("青花　缠枝莲", top_k=1)
+    assert service.search_normal("青花 缠枝莲", top_k=1) == first
+
+    # 缓存键按规范化后的文本计算，向量化使用原始文本
+    assert embedded == ["青花　缠枝莲"]
+    assert service.result_cache.stats()["hits"] == 1
+
+    # 数据库变化（版本号改变）后重新搜索
+    service.upsert_artifacts([catalogue_row("兰亭序摹本", "故00005-唐", "唐代摹本", "纸本")])
+    embedded.clear()
+    assert service.search_normal("青花 缠枝莲", top_k=1) == first
+    assert embedded == ["青花 缠枝莲"]
@@ -0,0 +1,97 @@
+# 多实例共用数据库目录：版本号变化后重新加载、修改前先同步其他实例的变更，以及跨进程写锁
+import os
+import subprocess
+import sys
+import time
+
+from conftest import catalogue_row, reopen
+from vector_db_service import _StoreWriteLock, artifact_id_for, row_to_document
+
+ROWS = [
+    catalogue_row("青花缠枝莲纹瓶", "故00001-明", "明代宣德年间景德镇御窑烧造", "青花"),
+    catalogue_row("金瓯永固杯", "故00003-清", "乾隆皇帝元旦开笔时使用", "錾刻镶嵌"),
+    catalogue_row("清明上河图", "故00004-北宋", "北宋张择端绘制的风俗画", "绢本设色"),
+]
+NEW_ROW = catalogue_row("兰亭序摹本", "故00005-唐", "唐代冯承素摹写的王羲之书法", "纸本墨迹")
+
+
+def _names(service, row):
+    query = row_to_document(row)["content"]
+    return [result["metadata"]["artifact_name"] for result in service.search_normal(query, top_k=len(ROWS) + 1)]
+
+
+def _id(row):
+    return artifact_id_for(row_to_document(row)["metadata"])
+
+
+def test_other_instance_reloads_new_generation(vector_db_factory):
+    writer = vector_db_factory(ROWS, extra_rows=[NEW_ROW])
+    reader = reopen(writer)
+    assert reader._generation == writer._generation
+    assert "兰亭序摹本" not in _names(reader, NEW_ROW)
+
+    writer.upsert_artifacts([NEW_ROW])
+
+    # 重新加载前仍是旧版本（搜索缓存也不会返回新版本的结果）
+    assert reader._generation != writer._generation
+    assert reader.document_count() == len(ROWS)
+    assert reader.reload_if_changed()
+    assert reader._generation == writer._generation
+    assert reader.document_count() == len(ROWS) + 1
+    assert "兰亭序摹本" in _names(reader, NEW_ROW)
+    assert not reader.reload_if_changed()
+
+
+def test_mutation_refreshes_before_writing(vector_db_factory):
+    first = vector_db_factory(ROWS, extra_rows=[NEW_ROW])
+    second = reopen(first)
+    first.upsert_artifacts([NEW_ROW])
+
+    # second 未重新加载就删除：先同步 first 的新增，删除后不会丢掉它
+    assert second.delete_artifacts([_id(ROWS[0])]) == 1
+
+    expected = sorted([_id(ROWS[1]), _id(ROWS[2]), _id(NEW_ROW)])
+    assert sorted(second._live_hashes()) == expected
+    assert first.reload_if_changed()
+    assert sorted(first._live_hashes()) == expected
+    assert sorted(reopen(first)._live_hashes()) == expected
+
+
+def test_generation_watcher_reloads_in_background(vector_db_factory):
+    writer = vector_db_factory(ROWS, extra_rows=[NEW_ROW])
+    reader = reopen(writer)
+    reader.start_generation_watcher(interval=0.05)
+
+    writer.upsert_artifacts([NEW_ROW])
+
+    deadline = time.monotonic() + 10
+    while reader.document_count() != len(ROWS) + 1:
+        assert time.monotonic() < deadline, "后台线程没有重新加载新版本"
+        time.sleep(0.05)
+    assert "兰亭序摹本" in _names(reader, NEW_ROW)
+
+
+def test_write_lock_excludes_other_processes(vector_db_factory, tmp_path):
+    service = vector_db_factory(ROWS)
+    held = tmp_path / "held"
+    # 子进程持有写锁 0.5 秒
+    child = subprocess.Popen([sys.executable, "-c", (
+        "import sys, time\n"
+        "from vector_db_service import _StoreWriteLock\n"
+        "with _StoreWriteLock.for_path(sys.argv[1]).hold():\n"
+        "    open(sys.argv[2], 'w').close()\n"
+        "    time.sleep(0.5)\n"
+    ), service.write_lock_file, str(held)], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        deadline = time.monotonic() + 30
+        while not held.exists():
+            assert time.monotonic() < deadline and child.poll() is None, "子进程没有取得写锁"
+            time.sleep(0.01)
+
+        started = time.monotonic()
+        with _StoreWriteLock.for_path(service.write_lock_file).hold():
+            waited = time.monotonic() - started
+    finally:
+        assert child.wait(timeout=30) == 0
+
+    assert waited >= 0.3
@@ -0,0 +1,124 @@
+# 向量数据库增量更新测试：IndexIDMap2 + 增量覆盖、增量日志重放与压缩（小型 flat / HNSW 索引）
+import json
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from conftest import catalogue_row, reopen
+from vector_db_service import artifact_id_for, row_to_document
+
+ROWS = [
+    catalogue_row("青花缠枝莲纹瓶", "故00001-明", "明代宣德年间景德镇御窑烧造", "青花"),
+    catalogue_row("粉彩九桃天球瓶", "故00002-清", "清代雍正年间景德镇官窑烧造", "粉彩"),
+    catalogue_row("金瓯永固杯", "故00003-清", "乾隆皇帝元旦开笔时使用", "錾刻镶嵌"),
+    catalogue_row("清明上河图", "故00004-北宋", "北宋张择端绘制的风俗画", "绢本设色"),
+]
+NEW_ROW = catalogue_row("兰亭序摹本", "故00005-唐", "唐代冯承素摹写的王羲之书法", "纸本墨迹")
+UPDATED_ROW = catalogue_row("青花缠枝莲纹瓶", "故00001-明", "嘉靖年间改烧的釉里红瓷器", "釉里红")
+
+
+def _content(row):
+    return row_to_document(row)["content"]
+
+
+def _id(row):
+    return artifact_id_for(row_to_document(row)["metadata"])
+
+
+def _names(results):
+    return [result["metadata"]["artifact_name"] for result in results]
+
+
+@pytest.fixture(params=["flat", "hnsw"])
+def service(request, vector_db_factory):
+    return vector_db_factory(ROWS, extra_rows=[NEW_ROW, UPDATED_ROW], index_type=request.param)
+
+
+def test_upsert_new_artifact_is_searchable(service):
+    assert service.upsert_artifacts([NEW_ROW]) == [_id(NEW_ROW)]
+
+    results = service.search_normal(_content(NEW_ROW), top_k=1)
+
+    assert _names(results) == ["兰亭序摹本"]
+    assert results[0]["metadata"]["artifact_id"] == str(_id(NEW_ROW))
+    assert service.document_count() == len(ROWS) + 1
+
+
+def test_upsert_existing_artifact_replaces_content_and_vector(service):
+    before = service.search_normal(_content(ROWS[0]), top_k=1)[0]["score"]
+
+    service.upsert_artifacts([UPDATED_ROW])
+    updated = service.search_normal(_content(UPDATED_ROW), top_k=len(ROWS))
+    old_query = service.search_normal(_content(ROWS[0]), top_k=len(ROWS))
+
+    assert service.document_count() == len(ROWS)
+    assert updated[0]["metadata"]["artifact_id"] == str(_id(ROWS[0]))
+    assert "釉里红" in updated[0]["content"]
+    # 按更新后的向量计分：新内容完全匹配，旧内容不再完全匹配（HNSW 中残留的旧向量不参与计分）
+    assert updated[0]["score"] == pytest.approx(before)
+    old_hit = next(result for result in old_query if result["metadata"]["artifact_id"] == str(_id(ROWS[0])))
+    assert old_hit["score"] < before
+    assert len({result["metadata"]["artifact_id"] for result in updated}) == len(updated)
+
+
+def test_delete_removes_artifact_from_results(service):
+    assert service.delete_artifacts([_id(ROWS[1]), 12345]) == 1
+
+    results = service.search_normal(_content(ROWS[1]), top_k=len(ROWS))
+
+    assert "粉彩九桃天球瓶" not in _names(results)
+    assert len(results) == len(ROWS) - 1
+    assert service.delete_artifacts([_id(ROWS[1])]) == 0
+
+
+def test_delta_log_is_replayed_on_reload(service):
+    service.upsert_artifacts([NEW_ROW, UPDATED_ROW])
+    service.delete_artifacts([_id(ROWS[2])])
+
+    reloaded = reopen(service)
+
+    assert reloaded.document_count() == len(ROWS)
+    assert _names(reloaded.search_normal(_content(NEW_ROW), top_k=1)) == ["兰亭序摹本"]
+    assert "釉里红" in reloaded.search_normal(_content(UPDATED_ROW), top_k=1)[0]["content"]
+    assert "金瓯永固杯" not in _names(reloaded.search_normal(_content(ROWS[2]), top_k=len(ROWS)))
+
+
+def test_compact_keeps_live_set(service):
+    service.upsert_artifacts([NEW_ROW, UPDATED_ROW])
+    service.delete_artifacts([_id(ROWS[3])])
+
+    assert service.compact()
+
+    assert not os.path.exists(service.delta_log_file)
+    expected = sorted([_id(ROWS[0]), _id(ROWS[1]), _id(ROWS[2]), _id(NEW_ROW)])
+    assert sorted(service._base_ids.tolist()) == expected
+    assert service._stale_count == 0 and not service._overlay
+    reloaded = reopen(service)
+    assert sorted(reloaded._live_hashes()) == expected
+    assert "釉里红" in reloaded.search_normal(_content(UPDATED_ROW), top_k=1)[0]["content"]
+    assert not service.compact()
+
+
+def test_load_ignores_stale_files_after_model_py_rebuild(vector_db_factory):
+    service = vector_db_factory(ROWS, extra_rows=[NEW_ROW])
+    service.upsert_artifacts([NEW_ROW])
+    # model.py 重新生成按行号编号的 flat 索引与 documents.json，旧的元数据、文物ID与增量日志仍在目录中
+    documents = [row_to_document(row) for row in reversed(ROWS)]
+    vectors = service.embed_texts([doc["content"] for doc in documents])
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    faiss.write_index(index, service.vector_index_file)
+    with open(service.docs_info_file, "w", encoding="utf-8") as f:
+        json.dump(documents, f, ensure_ascii=False)
+    assert json.load(open(service.index_meta_file, encoding="utf-8"))["id_map"]
+
+    reloaded = reopen(service)
+
+    assert reloaded.document_count() == len(ROWS)
+    for row in ROWS:
+        result = reloaded.search_normal(_content(row), top_k=1)[0]
+        assert result["metadata"]["artifact_name"] == row["文物名称"]
+        assert result["metadata"]["artifact_id"] == str(_id(row))
+    assert "兰亭序摹本" not in _names(reloaded.search_normal(_content(NEW_ROW), top_k=len(ROWS)))
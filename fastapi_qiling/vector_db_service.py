@@ -1,97 +1,700 @@
 # 故宫博物院向量数据库服务
 import os
 import json
+import base64
+import hashlib
+import shutil
+import threading
+import time
+import uuid
 import pandas as pd
 import numpy as np
 import faiss
 import jieba
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只在进程内互斥
+    fcntl = None
 import logging
-from paddlenlp.embeddings import TokenEmbedding
-from typing import List, Dict, Optional, Tuple
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, List, Dict, Optional, Tuple
+from rerank_index import RerankTermIndex
+from ingestion import REQUIRED_COLUMNS, CatalogueFormatError, iter_catalogue_documents
+from document_store import DocumentStore, DocumentStoreWriter, open_document_store, store_exists, store_files, write_documents
+from vocab_table import EMBEDDING_MODEL_NAME, VOCAB_TABLE_PATH, VocabEmbeddingTable, open_vocab_table
+from search_cache import SearchResultCache, normalize_query
 
 logger = logging.getLogger(__name__)
 
+# 批量向量化配置
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 1024))
+# 并行分词的进程数（1表示不启用多进程）与启用阈值（文本条数），只在构建子进程中启用（见 create_tokenize_pool）
+EMBED_TOKENIZE_WORKERS = int(os.environ.get("EMBED_TOKENIZE_WORKERS", min(4, os.cpu_count() or 1)))
+EMBED_PARALLEL_THRESHOLD = int(os.environ.get("EMBED_PARALLEL_THRESHOLD", 2000))
+
+
+# 支持的FAISS索引类型
+SUPPORTED_INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# 支持的相似度度量：l2 为欧氏距离；ip 为归一化向量上的内积（即余弦相似度）
+SUPPORTED_METRICS = ("l2", "ip")
+
+# 向量存储精度：归一化后向量范数固定，可用 float16 / int8 标量量化压缩存储
+SCALAR_QUANTIZER_TYPES = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# 索引构建与查询的默认参数
+DEFAULT_INDEX_PARAMS = {
+    "metric": "l2",          # 相似度度量（l2 / ip）
+    "storage": "float32",    # 向量存储精度（float32 / float16 / int8，ivf_pq 不适用）
+    "nlist": None,           # IVF聚类中心数，None表示按 4*sqrt(N) 自动确定
+    "pq_m": 30,              # PQ子空间数（需整除向量维度300）
+    "pq_nbits": 8,           # 每个子空间的编码位数
+    "hnsw_m": 32,            # HNSW每个节点的邻居数
+    "ef_construction": 200,  # HNSW构建时的搜索深度
+    "train_size": 100000,    # 训练样本上限
+    "nprobe": 16,            # IVF查询时访问的聚类数
+    "ef_search": 64,         # HNSW查询时的搜索深度
+}
+
+# 构建索引时每批加入的向量数（向量先落盘，再分批读取加入，限制峰值内存）
+INDEX_ADD_BATCH_SIZE = int(os.environ.get("INDEX_ADD_BATCH_SIZE", 50000))
+
+# 增量日志累积的变更条数达到该值后自动压缩（合并进基础索引与文档存储）
+DELTA_COMPACT_THRESHOLD = int(os.environ.get("VECTOR_DELTA_COMPACT_THRESHOLD", 1000))
+
+# 以内存映射方式加载索引（多个 worker 进程共享操作系统的页缓存，不各自复制一份）
+VECTOR_INDEX_MMAP = os.environ.get("VECTOR_INDEX_MMAP", "1").lower() not in ("0", "false", "no")
+# 检查数据库版本（其他进程是否修改或替换了数据库）的间隔（秒），0 表示不检查
+VECTOR_RELOAD_INTERVAL = float(os.environ.get("VECTOR_RELOAD_INTERVAL", 5))
+
+# 切换到新构建（或重新加载）的数据库时，各个需要一并替换的运行状态
+SERVING_STATE = ("index", "documents", "index_meta", "rerank_index", "_base_ids", "_sorted_ids", "_sorted_rows",
+                 "_overlay", "_overlay_rerank", "_live_count", "_delta_count", "_stale_count",
+                 "_index_mmapped", "_generation")
+
+
+def _cut_texts(texts: List[str]) -> List[List[str]]:
+    """对一批文本分词（供多进程调用，需为模块级函数）"""
+    return [jieba.lcut(text) for text in texts]
+
+
+def create_tokenize_pool() -> Optional[ProcessPoolExecutor]:
+    """创建并行分词的进程池，由构建子进程在整个构建期间持有；EMBED_TOKENIZE_WORKERS <= 1 时返回None
+    
+    以 spawn 方式启动工作进程：服务进程是多线程的（数据库、大模型、IO 线程池），
+    fork 会复制其他线程持有的锁，子进程可能因此死锁，因此服务进程内始终在本进程中分词。
+    """
+    if EMBED_TOKENIZE_WORKERS <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=EMBED_TOKENIZE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _cell_text(row, column: str) -> str:
+    """读取一行中的单元格文本，缺失值（None / NaN）返回空字符串"""
+    value = row.get(column)
+    if value is None:
+        return ""
+    try:
+        if pd.isna(value):
+            return ""
+    except (TypeError, ValueError):
+        pass
+    return str(value)
+
+
+def row_to_document(row, idx: Optional[int] = None) -> Optional[Dict]:
+    """将一行文物数据（Excel列名）转换为文档对象
+    
+    Args:
+        row: 包含 文物名称 / 图片地址 / 编号-年代 / 历史 / 工艺 的字典或 pandas 行，
+            可选 artifact_id（显式指定文物ID）与 recognition_result（图片识别结果）
+        idx: 数据在源表中的行号
+    
+    Returns:
+        dict: 文档对象；内容为空时返回None
+    """
+    artifact_name = _cell_text(row, '文物名称')
+    image_url = _cell_text(row, '图片地址')
+    number_period = _cell_text(row, '编号-年代')
+    history = _cell_text(row, '历史')
+    craft = _cell_text(row, '工艺')
+    
+    # 组合文本内容用于向量化
+    content_parts = []
+    if artifact_name:
+        content_parts.append(f"文物名称：{artifact_name}")
+    if number_period:
+        content_parts.append(f"编号年代：{number_period}")
+    if history:
+        content_parts.append(f"历史：{history}")
+    if craft:
+        content_parts.append(f"工艺：{craft}")
+    
+    content = "\n".join(content_parts)
+    if not content.strip():
+        return None
+    
+    metadata = {
+        "artifact_name": artifact_name,
+        "image_url": image_url,
+        "number_period": number_period,
+        "history": history,
+        "craft": craft
+    }
+    if idx is not None:
+        metadata["index"] = int(idx)
+    recognition_result = row.get("recognition_result")
+    if isinstance(recognition_result, dict) and recognition_result:
+        metadata["recognition_result"] = recognition_result
+    artifact_id = _cell_text(row, "artifact_id")
+    if artifact_id:
+        metadata["artifact_id"] = artifact_id
+    return {"content": content, "metadata": metadata}
+
+
+def artifact_id_for(metadata: Dict, salt: str = "") -> int:
+    """文物的稳定ID（63位非负整数，可直接作为FAISS的向量ID）
+    
+    显式提供 artifact_id 时直接使用；否则由 编号-年代 + 文物名称 哈希得到，
+    同一件文物在重建前后保持相同的ID，增量更新时据此定位。
+    
+    Raises:
+        ValueError: 显式提供的 artifact_id 不是 63 位以内的非负整数
+    """
+    explicit = metadata.get("artifact_id")
+    if explicit not in (None, "") and not salt:
+        try:
+            artifact_id = int(str(explicit).strip())
+        except ValueError:
+            artifact_id = -1
+        if not 0 <= artifact_id < (1 << 63):
+            raise ValueError(f"无效的文物ID: {explicit}，应为非负整数")
+        return artifact_id
+    key = f"{metadata.get('number_period', '')}|{metadata.get('artifact_name', '')}{salt}"
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") & ((1 << 63) - 1)
+
+
+def assign_artifact_ids(documents: Iterable[Dict], seen: Optional[set] = None) -> np.ndarray:
+    """为一批文档分配互不重复的文物ID（键重复时追加序号再哈希）
+    
+    Args:
+        documents: 文档列表
+        seen: 已分配的ID集合（分块导入时跨块共享，分配的ID会加入其中）
+    """
+    ids = []
+    seen = set() if seen is None else seen
+    for doc in documents:
+        metadata = doc.get("metadata", {})
+        artifact_id = artifact_id_for(metadata)
+        attempt = 0
+        while artifact_id in seen:
+            attempt += 1
+            artifact_id = artifact_id_for(metadata, salt=f"#{attempt}")
+        if attempt:
+            logger.warning(f"⚠️ 文物 {metadata.get('artifact_name', '')} 的ID重复，已分配新ID {artifact_id}")
+        seen.add(artifact_id)
+        ids.append(artifact_id)
+    return np.array(ids, dtype=np.int64)
+
+
+# 参与变更检测的字段（对应Excel的 文物名称 / 图片地址 / 编号-年代 / 历史 / 工艺 列）
+HASHED_FIELDS = ("artifact_name", "image_url", "number_period", "history", "craft")
+
+
+def document_hashes(documents: Iterable[Dict]) -> np.ndarray:
+    """计算各文档源数据字段的内容哈希（uint64），用于判断数据是否变化"""
+    hashes = []
+    for doc in documents:
+        metadata = doc.get("metadata", {})
+        text = "\x1f".join(str(metadata.get(name, "") or "") for name in HASHED_FIELDS)
+        hashes.append(int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big"))
+    return np.array(hashes, dtype=np.uint64)
+
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vector(text: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+class _StoreWriteLock:
+    """修改磁盘上向量数据库时持有的跨进程写锁（fcntl.flock），同一线程可重入
+    
+    同一进程内按锁文件路径共用一个实例（包括重新加载时创建的临时服务对象），
+    避免同一进程对同一锁文件重复加锁而阻塞自己。
+    """
+    
+    _instances: Dict[str, "_StoreWriteLock"] = {}
+    _instances_lock = threading.Lock()
+    
+    @classmethod
+    def for_path(cls, path: str) -> "_StoreWriteLock":
+        path = os.path.abspath(path)
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path)
+            return cls._instances[path]
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._mutex = threading.RLock()
+        self._depth = 0
+        self._file = None
+    
+    @contextmanager
+    def hold(self):
+        with self._mutex:
+            if self._depth == 0:
+                lock_file = open(self.path, 'a')
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                    except OSError:
+                        lock_file.close()
+                        raise
+                self._file = lock_file
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    # 关闭文件即释放 flock
+                    self._file.close()
+                    self._file = None
+
+
+class _ReadWriteLock:
+    """读写锁：并发搜索共享读锁，增量更新与压缩独占写锁（写者优先，避免被持续的搜索饿死）"""
+    
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def write_index_atomic(index, path: str):
+    """写入索引文件（先写临时文件再原子替换，以内存映射方式打开旧文件的进程不受影响）"""
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def save_array_atomic(path: str, array: np.ndarray):
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def read_index(path: str, mmap: bool = VECTOR_INDEX_MMAP):
+    """读取索引；mmap 时以只读内存映射方式打开，向量数据按需从页缓存读取"""
+    if mmap:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return faiss.read_index(path)
+
+
+def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    """返回L2归一化后的向量副本（零向量保持为零）"""
+    vectors = np.array(vectors, dtype=np.float32, order="C", copy=True)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def create_faiss_index(embeddings: np.ndarray, index_type: str = "flat", params: Optional[Dict] = None,
+                       ids: Optional[np.ndarray] = None, progress: Optional[Callable[[int], None]] = None):
+    """按配置创建并填充FAISS索引
+    
+    Args:
+        embeddings: 形状为 (N, d) 的 float32 向量矩阵（可以是磁盘上的 np.memmap，按批读取）
+        index_type: 索引类型（flat / ivf_flat / ivf_pq / hnsw）
+        params: 索引参数，未提供的项使用 DEFAULT_INDEX_PARAMS
+        ids: 与向量一一对应的 int64 文物ID；提供时搜索返回文物ID而非行号，并支持按ID增删
+            （IVF索引原生支持自定义ID，其余类型包装为 IndexIDMap2）
+        progress: 每加入一批向量后调用，参数为已加入的向量数
+    
+    Returns:
+        tuple: (index, meta) 索引对象和实际使用的参数（用于持久化）
+    """
+    if index_type not in SUPPORTED_INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选: {SUPPORTED_INDEX_TYPES}")
+    
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    metric = params["metric"]
+    storage = params["storage"]
+    if metric not in SUPPORTED_METRICS:
+        raise ValueError(f"不支持的相似度度量: {metric}，可选: {SUPPORTED_METRICS}")
+    if storage != "float32" and storage not in SCALAR_QUANTIZER_TYPES:
+        raise ValueError(f"不支持的存储精度: {storage}")
+    
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    
+    def prepare(block):
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        return normalize_vectors(block) if metric == "ip" else block
+    
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "ip" else faiss.METRIC_L2
+    n, dimension = embeddings.shape
+    meta = {"index_type": index_type, "metric": metric, "storage": storage,
+            "dimension": int(dimension), "count": int(n)}
+    
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = params["nlist"] or int(4 * np.sqrt(n))
+        # 每个聚类中心至少需要若干训练样本，数据量太少时退化为暴力搜索
+        nlist = max(1, min(nlist, n // 39))
+        if index_type == "ivf_pq" and n < (1 << params["pq_nbits"]) * 39:
+            logger.warning(f"⚠️ 数据量 {n} 不足以训练PQ编码，改用 ivf_flat")
+            index_type = "ivf_flat"
+        if nlist < 2:
+            logger.warning(f"⚠️ 数据量 {n} 过少，IVF索引退化为 flat")
+            index_type = "flat"
+        meta["index_type"] = index_type
+    if index_type == "ivf_pq":
+        # PQ自带压缩，不再叠加标量量化
+        meta["storage"] = storage = "pq"
+    
+    qtype = SCALAR_QUANTIZER_TYPES.get(storage)
+    if index_type == "flat":
+        if qtype is not None:
+            index = faiss.IndexScalarQuantizer(dimension, qtype, faiss_metric)
+        elif metric == "ip":
+            index = faiss.IndexFlatIP(dimension)
+        else:
+            index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(dimension, qtype, params["hnsw_m"], faiss_metric)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, params["hnsw_m"], faiss_metric)
+        index.hnsw.efConstruction = params["ef_construction"]
+        meta.update(hnsw_m=params["hnsw_m"], ef_construction=params["ef_construction"],
+                    ef_search=params["ef_search"])
+    else:
+        quantizer = faiss.IndexFlatIP(dimension) if metric == "ip" else faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, params["pq_m"], params["pq_nbits"], faiss_metric)
+            meta.update(pq_m=params["pq_m"], pq_nbits=params["pq_nbits"])
+        elif qtype is not None:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, qtype, faiss_metric)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss_metric)
+        meta.update(nlist=nlist, nprobe=params["nprobe"])
+    
+    # 需要训练的索引（IVF聚类中心、PQ码本、int8量化范围）在随机样本上训练
+    if not index.is_trained:
+        train_size = min(n, params["train_size"])
+        if train_size < n:
+            sample = np.random.default_rng(0).choice(n, train_size, replace=False)
+            train_vectors = prepare(embeddings[np.sort(sample)])
+        else:
+            train_vectors = prepare(embeddings)
+        logger.info(f"正在训练 {index_type} 索引（样本数={train_size}）...")
+        index.train(train_vectors)
+        meta["train_size"] = int(train_size)
+    
+    if ids is not None:
+        # IVF 倒排表自带ID且删除时不保持顺序，不能再包装 IndexIDMap2
+        if not index_type.startswith("ivf"):
+            index = faiss.IndexIDMap2(index)
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        meta["id_map"] = True
+    
+    for start in range(0, n, INDEX_ADD_BATCH_SIZE):
+        block = prepare(embeddings[start:start + INDEX_ADD_BATCH_SIZE])
+        if ids is None:
+            index.add(block)
+        else:
+            index.add_with_ids(block, ids[start:start + INDEX_ADD_BATCH_SIZE])
+        if progress is not None:
+            progress(min(start + INDEX_ADD_BATCH_SIZE, n))
+    return index, meta
+
 class VectorDatabaseService:
     """向量数据库服务类"""
     
     def __init__(self, 
                  excel_file_path: str = "./故宫博物院数字文物库.xlsx",
-                 vector_db_path: str = "./data/vector_db"):
+                 vector_db_path: str = "./data/vector_db",
+                 index_type: Optional[str] = None,
+                 index_params: Optional[Dict] = None,
+                 embedding_model=None,
+                 load: bool = True):
         """
         初始化向量数据库服务
         
         Args:
-            excel_file_path: Excel文件路径
+            excel_file_path: 文物表路径（Excel / CSV / Parquet，按扩展名分块读取）
             vector_db_path: 向量数据库存储路径
+            index_type: 构建时使用的索引类型（flat / ivf_flat / ivf_pq / hnsw），
+                默认读取环境变量 VECTOR_INDEX_TYPE，未设置时为 flat
+            index_params: 索引参数，覆盖 DEFAULT_INDEX_PARAMS 中的对应项；
+                metric / storage 未指定时读取环境变量 VECTOR_METRIC / VECTOR_STORAGE
+            embedding_model: 已加载的词嵌入模型（加载新构建的数据库时与当前服务共用），未提供时自行加载
+            load: 是否立即加载词嵌入模型与向量数据库；为 False 时由 warm_up() 加载（服务启动后在后台调用）
         """
         self.excel_file_path = excel_file_path
         self.vector_db_path = vector_db_path
         self.vector_index_file = os.path.join(vector_db_path, "faiss.index")
+        # 旧版本的文档文件（JSON），加载时自动转换为内存映射文档存储
         self.docs_info_file = os.path.join(vector_db_path, "documents.json")
+        self.doc_store_prefix = os.path.join(vector_db_path, "documents")
+        self.index_meta_file = os.path.join(vector_db_path, "index_meta.json")
+        self.rerank_terms_file = os.path.join(vector_db_path, "rerank_terms.npz")
+        self.rerank_vocab_file = os.path.join(vector_db_path, "rerank_vocab.json")
+        # 文档存储每一行对应的文物ID，以及增量更新的追加日志
+        self.artifact_ids_file = os.path.join(vector_db_path, "artifact_ids.npy")
+        self.delta_log_file = os.path.join(vector_db_path, "delta.log")
+        # 上次从Excel导入时各文物的内容哈希，同步时只重新向量化有变化的行
+        self.manifest_file = os.path.join(vector_db_path, "manifest.npz")
+        # 数据库版本：每次修改（增量更新、压缩、重建）后更新，其他进程据此重新加载
+        self.generation_file = os.path.join(vector_db_path, "generation")
+        # 跨进程写锁文件：放在数据库目录旁边，切换新构建的数据库（替换整个目录）时仍是同一个文件
+        self.write_lock_file = f"{os.path.normpath(vector_db_path)}.write.lock"
+        self.index_type = index_type or os.environ.get("VECTOR_INDEX_TYPE", "flat")
+        self.index_params = {
+            **DEFAULT_INDEX_PARAMS,
+            "metric": os.environ.get("VECTOR_METRIC", DEFAULT_INDEX_PARAMS["metric"]),
+            "storage": os.environ.get("VECTOR_STORAGE", DEFAULT_INDEX_PARAMS["storage"]),
+            **(index_params or {})
+        }
+        if self.index_type not in SUPPORTED_INDEX_TYPES:
+            raise ValueError(f"不支持的索引类型: {self.index_type}，可选: {SUPPORTED_INDEX_TYPES}")
         
-        # 创建必要的目录
+        # 上次切换数据库时中断则先恢复，再创建必要的目录
+        self._recover_interrupted_swap()
         os.makedirs(vector_db_path, exist_ok=True)
         
         # 初始化模型和索引
-        self.embedding_model = None
+        self.embedding_model = embedding_model
         self.index = None
+        # 文档集合：加载后为内存映射的 DocumentStore（按下标访问时才解码）
         self.documents = []
+        # 当前加载的索引的元数据（类型、维度、参数）
+        self.index_meta = {}
+        # 增强搜索重排序用的预分词索引
+        self.rerank_index = None
+        # 词向量矩阵与词表映射，首次批量向量化时从模型中提取
+        self._embedding_table = None
+        # 并行分词的进程池（只由构建子进程设置，见 create_tokenize_pool），为 None 时在本进程中分词
+        self.tokenize_pool: Optional[ProcessPoolExecutor] = None
         
-        # 加载词嵌入模型
-        self._load_embedding_model()
+        # 文档存储行号 <-> 文物ID（按ID排序的副本用于二分查找）
+        self._base_ids = np.empty(0, dtype=np.int64)
+        self._sorted_ids = np.empty(0, dtype=np.int64)
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        # 尚未压缩的增量变更：文物ID -> 新文档（None 表示已删除），及其重排序词索引
+        self._overlay: Dict[int, Optional[Dict]] = {}
+        self._overlay_rerank: Dict[int, RerankTermIndex] = {}
+        self._live_count = 0
+        # 增量日志中的变更条数
+        self._delta_count = 0
+        # HNSW 不支持从索引中删除向量，被删除/覆盖的旧向量留在索引中，搜索时过滤
+        self._stale_count = 0
+        # 搜索共享读锁，增量更新与压缩独占写锁
+        self._lock = _ReadWriteLock()
+        # 多个 worker 修改同一数据库时互斥（先取此锁，再取 self._lock 的写锁）
+        self._store_lock = _StoreWriteLock.for_path(self.write_lock_file)
+        # 索引是否为只读内存映射（IVF 倒排表在首次修改前需复制到内存）
+        self._index_mmapped = False
+        # 当前加载的数据库版本
+        self._generation: Optional[str] = None
+        self._watcher: Optional[threading.Thread] = None
+        # 搜索结果缓存（按数据库版本号失效）
+        self.result_cache = SearchResultCache()
+        
+        if load:
+            self.warm_up()
+    
+    def warm_up(self) -> bool:
+        """加载词嵌入模型、分词词典和已存在的向量数据库
         
-        # 尝试加载已存在的向量数据库
-        self._load_vector_db()
+        Returns:
+            bool: 向量数据库是否可用于搜索
+        """
+        if self.embedding_model is None:
+            self._load_embedding_model()
+        if self.embedding_model is not None:
+            # 提前取出词向量矩阵并加载分词词典，避免第一次搜索时才加载
+            self._get_embedding_table()
+            jieba.initialize()
+        if self.index is None:
+            self._load_vector_db()
+        return self.is_ready()
     
     def _load_embedding_model(self):
-        """加载词嵌入模型"""
+        """加载词嵌入模型：优先使用裁剪后的词向量表（内存映射，多进程共享），不存在时加载完整模型"""
+        try:
+            self.embedding_model = open_vocab_table(VOCAB_TABLE_PATH)
+            if self.embedding_model is not None:
+                logger.info(f"✓ 裁剪词向量表加载成功（{len(self.embedding_model)} 个词，内存映射）")
+                return
+        except Exception as e:
+            logger.warning(f"⚠️ 裁剪词向量表加载失败，改用完整模型: {str(e)}")
         try:
-            self.embedding_model = TokenEmbedding("w2v.baidu_encyclopedia.target.word-word.dim300")
+            # paddlenlp 导入较慢，需要时才导入
+            from paddlenlp.embeddings import TokenEmbedding
+            self.embedding_model = TokenEmbedding(EMBEDDING_MODEL_NAME)
             logger.info("✓ 词嵌入模型加载成功")
         except Exception as e:
             logger.error(f"❌ 加载词嵌入模型失败: {str(e)}")
             self.embedding_model = None
     
-    def _embed_text(self, text: str) -> np.ndarray:
-        """将文本转换为向量嵌入
+    def _get_embedding_table(self) -> Tuple[np.ndarray, Dict[str, int], int]:
+        """获取词向量矩阵、词表映射和未登录词的行号
+        
+        Returns:
+            tuple: (matrix, token_to_idx, unk_idx)
+        """
+        if self._embedding_table is None and isinstance(self.embedding_model, VocabEmbeddingTable):
+            # float16 内存映射矩阵，查表后再转换为 float32
+            self._embedding_table = (self.embedding_model.matrix, self.embedding_model.token_to_idx,
+                                     self.embedding_model.unk_idx)
+        if self._embedding_table is None:
+            matrix = self.embedding_model.weight.numpy()
+            # 模型权重通常已是 float32，直接使用，避免再复制一份完整的词向量矩阵
+            if matrix.dtype != np.float32:
+                matrix = matrix.astype(np.float32)
+            token_to_idx = self.embedding_model.vocab.token_to_idx
+            unk_idx = self.embedding_model.get_idx_from_word(self.embedding_model.unknown_token)
+            self._embedding_table = (matrix, token_to_idx, unk_idx)
+        return self._embedding_table
+    
+    def _tokenize_texts(self, texts: List[str]) -> List[List[str]]:
+        """批量分词，设置了进程池（构建子进程中）且文本较多时使用多进程并行"""
+        if self.tokenize_pool is None or len(texts) < EMBED_PARALLEL_THRESHOLD:
+            return _cut_texts(texts)
+        
+        chunk_size = max(1, len(texts) // (EMBED_TOKENIZE_WORKERS * 4))
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        tokenized = []
+        for part in self.tokenize_pool.map(_cut_texts, chunks):
+            tokenized.extend(part)
+        return tokenized
+    
+    def _embed_tokenized(self, tokenized: List[List[str]]) -> np.ndarray:
+        """将已分词的一批文本转换为向量（一次向量化查表 + 分段求均值）"""
+        matrix, token_to_idx, unk_idx = self._get_embedding_table()
+        dimension = matrix.shape[1]
+        
+        # 每条文本的词数及其在扁平数组中的起始位置（CSR格式）
+        lengths = np.fromiter((len(words) for words in tokenized), dtype=np.int64, count=len(tokenized))
+        starts = np.zeros(len(tokenized), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        
+        lookup = token_to_idx.get
+        total = int(lengths.sum())
+        token_ids = np.fromiter(
+            (lookup(word, unk_idx) for words in tokenized for word in words),
+            dtype=np.int64,
+            count=total
+        )
+        
+        vectors = np.zeros((len(tokenized), dimension), dtype=np.float32)
+        if total == 0:
+            return vectors
+        
+        # 一次性取出所有词向量，按段求和后除以词数得到均值（空文本保持零向量）
+        gathered = np.asarray(matrix[token_ids], dtype=np.float32)
+        non_empty = lengths > 0
+        sums = np.add.reduceat(gathered, starts[non_empty], axis=0)
+        vectors[non_empty] = sums / lengths[non_empty, None]
+        return vectors
+    
+    def embed_texts(self, texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+        """批量将文本转换为向量嵌入
         
         Args:
-            text: 要向量化的文本
+            texts: 要向量化的文本列表
+            batch_size: 每批处理的文本数量（限制查表时的峰值内存）
         
         Returns:
-            numpy.ndarray: 文本的向量表示（300维）
+            numpy.ndarray: 形状为 (len(texts), 300) 的 float32 矩阵
         """
-        if self.embedding_model is None:
-            return np.zeros(300)
+        if self.embedding_model is None or not texts:
+            return np.zeros((len(texts), 300), dtype=np.float32)
         
         try:
-            words = list(jieba.cut(text))
-            word_embeddings = self.embedding_model.search(words)
-            
-            if len(word_embeddings) > 0:
-                return np.mean(word_embeddings, axis=0)
-            else:
-                return np.zeros(300)
+            tokenized = self._tokenize_texts(texts)
+            batches = []
+            for start in range(0, len(tokenized), batch_size):
+                batches.append(self._embed_tokenized(tokenized[start:start + batch_size]))
+                if len(texts) > batch_size:
+                    logger.info(f"  已向量化 {min(start + batch_size, len(texts))}/{len(texts)} 条数据...")
+            return np.vstack(batches)
         except Exception as e:
             logger.error(f"文本嵌入过程出错: {str(e)}")
-            return np.zeros(300)
+            return np.zeros((len(texts), 300), dtype=np.float32)
     
-    def build_vector_database(self, ernie_client=None, force_rebuild=False):
-        """从Excel文件构建故宫博物院文物知识的向量数据库
+    def _embed_text(self, text: str) -> np.ndarray:
+        """将文本转换为向量嵌入
+        
+        Args:
+            text: 要向量化的文本
+        
+        Returns:
+            numpy.ndarray: 文本的向量表示（300维）
+        """
+        return self.embed_texts([text])[0]
+    
+    def build_vector_database(self, ernie_client=None, force_rebuild=False,
+                              progress: Optional[Callable[[str, int], None]] = None):
+        """从文物表（Excel / CSV / Parquet）构建故宫博物院文物知识的向量数据库
         
         Args:
             ernie_client: ERNIE客户端（用于图片识别，可选）
             force_rebuild: 是否强制重建（删除已存在的数据库）
+            progress: 进度回调 progress(stage, count)，stage 为 read / embedded / indexed，
+                count 为该阶段已完成的行数
         
         Returns:
             bool: 是否构建成功
         """
+        with self._store_lock.hold():
+            return self._build_vector_database(ernie_client, force_rebuild, progress)
+    
+    def _build_vector_database(self, ernie_client, force_rebuild, progress):
         # 如果需要强制重建，删除已存在的数据库
         if force_rebuild:
             self._delete_existing_vector_db()
         
         # 如果已存在数据库，直接加载
-        if os.path.exists(self.vector_index_file) and os.path.exists(self.docs_info_file):
+        if self._vector_db_exists():
             logger.info("向量数据库已存在，直接加载")
             return self._load_vector_db()
         
@@ -104,118 +707,202 @@ class VectorDatabaseService:
             logger.error(f"❌ 错误: 找不到Excel文件 '{self.excel_file_path}'")
             return False
         
+        # 向量先按块写入磁盘，全部导入后再分批加入索引
+        spill_file = os.path.join(self.vector_db_path, "embeddings.tmp")
         try:
-            # 读取Excel文件
-            logger.info(f"正在读取Excel文件: {self.excel_file_path}")
-            converters = {'图片地址': str}  # 确保图片地址列作为字符串完整读取
-            df = pd.read_excel(self.excel_file_path, converters=converters)
+            logger.info(f"正在读取文物表: {self.excel_file_path}")
+            artifact_ids, hashes = [], []
+            seen = set()
+            count, dimension = 0, None
+            with DocumentStoreWriter(self.doc_store_prefix) as writer, open(spill_file, 'wb') as spill:
+                for documents in iter_catalogue_documents(self.excel_file_path):
+                    if progress is not None:
+                        progress("read", count + len(documents))
+                    vectors = self.embed_texts([doc["content"] for doc in documents])
+                    dimension = vectors.shape[1]
+                    spill.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                    artifact_ids.append(assign_artifact_ids(documents, seen))
+                    hashes.append(document_hashes(documents))
+                    writer.extend(documents)
+                    count += len(documents)
+                    if progress is not None:
+                        progress("embedded", count)
+                    logger.info(f"  已处理 {count} 条文物数据...")
             
-            # 检查必需的列是否存在
-            required_columns = ['文物名称', '图片地址', '编号-年代', '历史', '工艺']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                logger.error(f"❌ 错误: Excel文件缺少必需的列: {missing_columns}")
+            logger.info(f"✓ 处理完成，共 {count} 条有效文物数据")
+            if not count:
+                logger.error("❌ 没有找到有效数据，无法构建向量数据库")
                 return False
+            artifact_ids = np.concatenate(artifact_ids)
             
-            logger.info(f"✓ 成功读取 {len(df)} 条文物数据")
-            
-            # 处理每一行数据
-            documents = []
-            logger.info("开始处理数据...")
-            
-            for idx, row in df.iterrows():
-                # 获取各个字段
-                artifact_name = str(row['文物名称']) if pd.notna(row['文物名称']) else ""
-                image_url = str(row['图片地址']) if pd.notna(row['图片地址']) else ""
-                number_period = str(row['编号-年代']) if pd.notna(row['编号-年代']) else ""
-                history = str(row['历史']) if pd.notna(row['历史']) else ""
-                craft = str(row['工艺']) if pd.notna(row['工艺']) else ""
-                
-                # 组合文本内容用于向量化
-                content_parts = []
-                if artifact_name:
-                    content_parts.append(f"文物名称：{artifact_name}")
-                if number_period:
-                    content_parts.append(f"编号年代：{number_period}")
-                if history:
-                    content_parts.append(f"历史：{history}")
-                if craft:
-                    content_parts.append(f"工艺：{craft}")
-                
-                content = "\n".join(content_parts)
-                
-                if not content.strip():
-                    continue  # 跳过空内容
-                
-                # 构建文档对象
-                doc = {
-                    "content": content,
-                    "metadata": {
-                        "artifact_name": artifact_name,
-                        "image_url": image_url,
-                        "number_period": number_period,
-                        "history": history,
-                        "craft": craft,
-                        "index": int(idx)
-                    }
-                }
-                documents.append(doc)
-            
-            logger.info(f"✓ 处理完成，共 {len(documents)} 条有效文物数据")
-            
-            # 生成向量嵌入
-            logger.info("正在生成向量嵌入...")
-            embeddings = []
-            valid_docs = []
-            
-            for i, doc in enumerate(documents):
-                if (i + 1) % 1000 == 0:
-                    logger.info(f"  已处理 {i + 1}/{len(documents)} 条数据...")
-                
-                vector = self._embed_text(doc["content"])
-                if vector is not None and vector.size > 0:
-                    embeddings.append(vector)
-                    valid_docs.append(doc)
-            
-            documents = valid_docs
-            
-            if not embeddings:
-                logger.error("❌ 无法生成文档嵌入，无法构建向量数据库")
-                return False
-            
-            # 构建FAISS索引
+            # 构建FAISS索引（以文物ID为向量ID，支持后续增量更新）
             logger.info("正在构建FAISS索引...")
-            embeddings_np = np.array(embeddings).astype('float32')
-            
-            if len(embeddings_np.shape) < 2:
-                logger.warning(f"⚠️ 嵌入数组形状不正确: {embeddings_np.shape}")
-                if embeddings_np.size > 0:
-                    embeddings_np = embeddings_np.reshape(1, -1)
-                else:
-                    return False
+            embeddings = np.memmap(spill_file, dtype=np.float32, mode="r", shape=(count, dimension))
+            index, index_meta = create_faiss_index(
+                embeddings, self.index_type, self.index_params, ids=artifact_ids,
+                progress=None if progress is None else lambda added: progress("indexed", added))
+            del embeddings
             
-            dimension = embeddings_np.shape[1]
-            index = faiss.IndexFlatL2(dimension)
-            index.add(embeddings_np)
-            
-            # 保存索引和文档信息
-            faiss.write_index(index, self.vector_index_file)
-            with open(self.docs_info_file, 'w', encoding='utf-8') as f:
-                json.dump(documents, f, ensure_ascii=False, indent=2)
+            # 保存索引、索引元数据和文档信息
+            write_index_atomic(index, self.vector_index_file)
+            with open(self.index_meta_file, 'w', encoding='utf-8') as f:
+                json.dump(index_meta, f, ensure_ascii=False, indent=2)
+            save_array_atomic(self.artifact_ids_file, artifact_ids)
+            self._save_manifest(artifact_ids, np.concatenate(hashes))
+            documents = DocumentStore(self.doc_store_prefix)
+            rerank_index = RerankTermIndex.build(documents)
+            rerank_index.save(self.rerank_terms_file, self.rerank_vocab_file)
+            if os.path.exists(self.delta_log_file):
+                os.remove(self.delta_log_file)
             
-            self.index = index
-            self.documents = documents
+            with self._lock.write():
+                self.index = index
+                self.rerank_index = rerank_index
+                self.index_meta = index_meta
+                self.documents = documents
+                self._index_mmapped = False
+                self._set_base_ids(artifact_ids)
+                self._generation = self._bump_generation()
             
             logger.info(f"✅ 向量数据库构建完成！")
-            logger.info(f"   - 包含 {len(documents)} 个文物文档")
-            logger.info(f"   - 向量维度: {dimension}")
+            logger.info(f"   - 包含 {count} 个文物文档")
+            logger.info(f"   - 向量维度: {index_meta['dimension']}")
+            logger.info(f"   - 索引类型: {index_meta['index_type']}（度量: {index_meta['metric']}，存储: {index_meta['storage']}）")
             return True
             
+        except CatalogueFormatError as e:
+            logger.error(f"❌ 错误: {str(e)}")
+            return False
         except Exception as e:
             logger.error(f"❌ 构建向量数据库时出错: {str(e)}")
             import traceback
             traceback.print_exc()
             return False
+        finally:
+            if os.path.exists(spill_file):
+                os.remove(spill_file)
+    
+    def install_build(self, build_path: str) -> bool:
+        """用 build_path 中新构建的数据库替换当前数据库
+        
+        新数据库在锁外加载完毕后，才在写锁内切换目录与运行状态；切换前的搜索继续使用旧索引。
+        旧数据库目录被删除后，仍在使用的内存映射由垃圾回收释放。
+        
+        Args:
+            build_path: 新数据库所在目录（与 vector_db_path 位于同一文件系统）
+        
+        Returns:
+            bool: 是否切换成功（新数据库无法加载时保持当前数据库不变）
+        """
+        staged = VectorDatabaseService(self.excel_file_path, build_path, self.index_type, self.index_params,
+                                       embedding_model=self.embedding_model, load=False)
+        if not staged._load_vector_db() or not staged.is_ready():
+            logger.error(f"❌ 新构建的向量数据库无法加载: {build_path}")
+            return False
+        
+        backup_path = self._backup_path()
+        with self._store_lock.hold(), self._lock.write():
+            if os.path.exists(backup_path):
+                shutil.rmtree(backup_path)
+            os.replace(self.vector_db_path, backup_path)
+            os.replace(build_path, self.vector_db_path)
+            self._adopt(staged)
+        shutil.rmtree(backup_path, ignore_errors=True)
+        logger.info(f"✓ 已切换到新构建的向量数据库，包含 {self._live_count} 个文档")
+        return True
+    
+    def _adopt(self, staged: "VectorDatabaseService"):
+        """换用另一个服务对象加载的运行状态（需持有写锁）"""
+        for name in SERVING_STATE:
+            setattr(self, name, getattr(staged, name))
+    
+    def _read_generation(self) -> Optional[str]:
+        try:
+            with open(self.generation_file, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+    
+    def _bump_generation(self) -> str:
+        """写入新的数据库版本号并返回"""
+        generation = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        with open(self.generation_file + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(generation)
+        os.replace(self.generation_file + ".tmp", self.generation_file)
+        return generation
+    
+    def reload_if_changed(self) -> bool:
+        """数据库被其他进程修改或替换后（版本号变化）重新加载
+        
+        新状态在锁外加载（索引与文档均为内存映射，不会复制一份数据），只在切换时短暂持有写锁。
+        
+        Returns:
+            bool: 是否重新加载
+        """
+        generation = self._read_generation()
+        if generation is None or generation == self._generation:
+            return False
+        # 持有跨进程写锁加载，不会读到其他进程修改到一半的数据库
+        with self._store_lock.hold():
+            staged = VectorDatabaseService(self.excel_file_path, self.vector_db_path, self.index_type, self.index_params,
+                                           embedding_model=self.embedding_model, load=False)
+            if not staged._load_vector_db():
+                return False
+            with self._lock.write():
+                self._adopt(staged)
+        logger.info(f"✓ 向量数据库已更新到新版本，包含 {self._live_count} 个文档")
+        return True
+    
+    def _refresh_from_disk(self):
+        """修改数据库前调用（需持有跨进程写锁）：其他进程已修改过数据库时先重新加载，
+        保证在最新状态上修改，不会覆盖其他进程的变更"""
+        generation = self._read_generation()
+        if generation is not None and generation != self._generation and not self.reload_if_changed():
+            raise RuntimeError("无法加载其他进程修改后的向量数据库")
+    
+    def start_generation_watcher(self, interval: float = VECTOR_RELOAD_INTERVAL):
+        """启动后台线程，定期检查数据库版本并在变化时重新加载（多 worker 部署时使各进程保持一致）"""
+        if interval <= 0 or self._watcher is not None:
+            return
+        
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    logger.warning(f"⚠️ 重新加载向量数据库失败，稍后重试: {str(e)}")
+        
+        self._watcher = threading.Thread(target=watch, name="vector-db-watcher", daemon=True)
+        self._watcher.start()
+    
+    def _ensure_mutable_index(self):
+        """修改索引前调用：以内存映射方式加载的 IVF 倒排表是只读的，先复制到内存
+        （flat / HNSW 在首次修改时由 FAISS 自动复制）"""
+        if not self._index_mmapped:
+            return
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            source = ivf.invlists
+            invlists = faiss.ArrayInvertedLists(ivf.nlist, ivf.code_size)
+            for list_no in range(ivf.nlist):
+                size = source.list_size(list_no)
+                if size:
+                    invlists.add_entries(list_no, size, source.get_ids(list_no), source.get_codes(list_no))
+            # 倒排表交由索引释放
+            invlists.this.disown()
+            ivf.replace_invlists(invlists, True)
+        self._index_mmapped = False
+    
+    def _backup_path(self) -> str:
+        return os.path.normpath(self.vector_db_path) + ".old"
+    
+    def _recover_interrupted_swap(self):
+        """切换数据库时在两次目录重命名之间中断，会导致数据库目录缺失，此时恢复旧数据库"""
+        backup_path = self._backup_path()
+        if os.path.isdir(backup_path) and not os.path.exists(self.vector_db_path):
+            os.replace(backup_path, self.vector_db_path)
+            logger.warning(f"⚠️ 上次切换向量数据库时中断，已恢复: {self.vector_db_path}")
     
     def _delete_existing_vector_db(self):
         """删除已存在的向量数据库文件"""
@@ -230,149 +917,641 @@ class VectorDatabaseService:
             deleted_files.append(self.docs_info_file)
             logger.info(f"✓ 已删除: {self.docs_info_file}")
         
+        for path in [self.index_meta_file, self.rerank_terms_file, self.rerank_vocab_file,
+                     self.artifact_ids_file, self.delta_log_file, self.manifest_file] + store_files(self.doc_store_prefix):
+            if os.path.exists(path):
+                os.remove(path)
+                deleted_files.append(path)
+        
         if deleted_files:
             logger.info(f"已删除 {len(deleted_files)} 个向量数据库文件，将重新构建")
     
+    def _vector_db_exists(self) -> bool:
+        """索引文件与文档（新格式存储或旧版JSON）均存在"""
+        return os.path.exists(self.vector_index_file) and (
+            store_exists(self.doc_store_prefix) or os.path.exists(self.docs_info_file)
+        )
+    
+    def _legacy_documents_pending(self) -> bool:
+        """存在尚未转换（或比文档存储更新，如 model.py 重新生成）的 documents.json"""
+        if not os.path.exists(self.docs_info_file):
+            return False
+        if not store_exists(self.doc_store_prefix):
+            return True
+        store_meta_file = store_files(self.doc_store_prefix)[-1]
+        return os.path.getmtime(self.docs_info_file) > os.path.getmtime(store_meta_file)
+    
+    def _discard_legacy_stale_files(self):
+        """model.py 只重新生成 faiss.index（按行号编号的 flat 索引）与 documents.json，
+        上一个数据库留下的元数据、文物ID、增量日志、导入清单与重排序词索引都已过期，转换前删除"""
+        stale_files = [path for path in (self.index_meta_file, self.artifact_ids_file, self.delta_log_file,
+                                         self.manifest_file, self.rerank_terms_file, self.rerank_vocab_file)
+                       if os.path.exists(path)]
+        for path in stale_files:
+            os.remove(path)
+        if stale_files:
+            logger.info(f"已删除 {len(stale_files)} 个过期的向量数据库文件（documents.json 已重新生成）")
+    
+    def _convert_legacy_documents(self):
+        """将旧版 documents.json 转换为内存映射文档存储（仅执行一次）"""
+        logger.info(f"正在将 {self.docs_info_file} 转换为文档存储...")
+        with open(self.docs_info_file, 'r', encoding='utf-8') as f:
+            documents = json.load(f)
+        count = write_documents(self.doc_store_prefix, documents)
+        logger.info(f"✓ 已转换 {count} 个文档")
+    
     def _load_vector_db(self) -> bool:
         """加载向量数据库
         
         Returns:
             bool: 是否加载成功
         """
-        if os.path.exists(self.vector_index_file) and os.path.exists(self.docs_info_file):
-            try:
-                self.index = faiss.read_index(self.vector_index_file)
-                with open(self.docs_info_file, 'r', encoding='utf-8') as f:
-                    self.documents = json.load(f)
-                logger.info(f"✓ 向量数据库加载成功，包含 {len(self.documents)} 个文档")
-                return True
-            except Exception as e:
-                logger.error(f"❌ 加载向量数据库失败: {str(e)}")
+        with self._store_lock.hold():
+            if self._vector_db_exists():
+                try:
+                    with self._lock.write():
+                        # 先读取版本号：加载期间数据库再次变化时，下次检查会重新加载
+                        self._generation = self._read_generation()
+                        self.index = read_index(self.vector_index_file)
+                        self._index_mmapped = VECTOR_INDEX_MMAP
+                        legacy_pending = self._legacy_documents_pending()
+                        if legacy_pending:
+                            self._discard_legacy_stale_files()
+                            self._convert_legacy_documents()
+                        self.documents = open_document_store(self.doc_store_prefix)
+                        # 旧版本构建的数据库没有元数据文件，均为 flat 索引
+                        if os.path.exists(self.index_meta_file):
+                            with open(self.index_meta_file, 'r', encoding='utf-8') as f:
+                                self.index_meta = json.load(f)
+                        else:
+                            self.index_meta = {"index_type": "flat", "metric": "l2", "storage": "float32",
+                                               "dimension": int(self.index.d), "count": int(self.index.ntotal)}
+                        self._load_artifact_ids(legacy_pending)
+                        self.rerank_index = self._load_rerank_index()
+                        self._replay_delta_log()
+                    logger.info(f"✓ 向量数据库加载成功，包含 {self._live_count} 个文档"
+                                f"（索引类型: {self.index_meta.get('index_type')}）")
+                    return True
+                except Exception as e:
+                    logger.error(f"❌ 加载向量数据库失败: {str(e)}")
+                    return False
+            else:
+                logger.warning("❌ 向量数据库文件不存在")
                 return False
-        else:
-            logger.warning("❌ 向量数据库文件不存在")
-            return False
     
-    def search_normal(self, query_text: str, top_k: int = 5) -> List[Dict]:
-        """普通向量搜索（基于文本相似度）
+    def _set_base_ids(self, artifact_ids: np.ndarray):
+        """设置文档存储各行的文物ID，并清空增量状态"""
+        self._base_ids = np.asarray(artifact_ids, dtype=np.int64)
+        order = np.argsort(self._base_ids, kind="stable")
+        self._sorted_ids = self._base_ids[order]
+        self._sorted_rows = order.astype(np.int64)
+        self._overlay = {}
+        self._overlay_rerank = {}
+        self._live_count = len(self._base_ids)
+        self._delta_count = 0
+        self._stale_count = 0
+    
+    def _load_artifact_ids(self, legacy_pending: bool = False):
+        """加载文物ID；旧版本数据库（按行号编号的索引）在此升级为以文物ID编号的 IndexIDMap2"""
+        if (not legacy_pending and self.index_meta.get("id_map")
+                and os.path.exists(self.artifact_ids_file)):
+            artifact_ids = np.load(self.artifact_ids_file)
+            if len(artifact_ids) == len(self.documents):
+                self._set_base_ids(artifact_ids)
+                return
+        
+        logger.info("正在为向量数据库分配文物ID（升级为支持增量更新的索引）...")
+        artifact_ids = assign_artifact_ids(self.documents)
+        if not self.index_meta.get("id_map"):
+            if self.index.ntotal != len(self.documents):
+                raise RuntimeError(f"索引向量数({self.index.ntotal})与文档数({len(self.documents)})不一致，请重建向量数据库")
+            ivf = faiss.try_extract_index_ivf(self.index)
+            if ivf is not None:
+                ivf.make_direct_map()
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)
+            params = {**self.index_params, **{k: v for k, v in self.index_meta.items() if k in DEFAULT_INDEX_PARAMS}}
+            self.index, self.index_meta = create_faiss_index(
+                vectors, self.index_meta.get("index_type", "flat"), params, ids=artifact_ids)
+            self._index_mmapped = False
+            write_index_atomic(self.index, self.vector_index_file)
+            with open(self.index_meta_file, 'w', encoding='utf-8') as f:
+                json.dump(self.index_meta, f, ensure_ascii=False, indent=2)
+        save_array_atomic(self.artifact_ids_file, artifact_ids)
+        self._set_base_ids(artifact_ids)
+        self._generation = self._bump_generation()
+    
+    def _lookup_rows(self, artifact_ids: np.ndarray) -> np.ndarray:
+        """文物ID -> 文档存储行号（不在基础存储中的为 -1）"""
+        artifact_ids = np.asarray(artifact_ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.full(len(artifact_ids), -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, artifact_ids)
+        pos = np.minimum(pos, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[pos] == artifact_ids
+        return np.where(found, self._sorted_rows[pos], -1)
+    
+    def _contains(self, artifact_id: int) -> bool:
+        """文物当前是否存在（未被删除）"""
+        if artifact_id in self._overlay:
+            return self._overlay[artifact_id] is not None
+        return bool(self._lookup_rows([artifact_id])[0] >= 0)
+    
+    def _get_document(self, artifact_id: int, row: int) -> Dict:
+        """读取文档（增量覆盖的文物优先），并在元数据中附带文物ID"""
+        doc = self._overlay[artifact_id] if row < 0 else self.documents[row]
+        metadata = {**doc["metadata"], "artifact_id": str(artifact_id)}
+        return {"content": doc["content"], "metadata": metadata}
+    
+    def _remove_from_index(self, artifact_ids: List[int]):
+        """从索引中批量移除文物的向量；索引不支持删除（HNSW）时留作过期向量，搜索时过滤"""
+        if not artifact_ids:
+            return
+        self._ensure_mutable_index()
+        try:
+            # remove_ids 需要扫描整个索引，因此每批变更只调用一次
+            self.index.remove_ids(np.array(artifact_ids, dtype=np.int64))
+        except RuntimeError:
+            self._stale_count += len(artifact_ids)
+    
+    def _apply_upserts(self, artifact_ids: List[int], documents: List[Dict], vectors: np.ndarray):
+        """在内存中应用一批新增/更新（同一批中重复的文物以最后一条为准）"""
+        latest = {artifact_id: i for i, artifact_id in enumerate(artifact_ids)}
+        positions = sorted(latest.values())
+        ids = [artifact_ids[i] for i in positions]
+        existing = [artifact_id for artifact_id in ids if self._contains(artifact_id)]
+        self._remove_from_index(existing)
+        
+        vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32)[positions])
+        if self.index_meta.get("metric") == "ip":
+            vectors = normalize_vectors(vectors)
+        self._ensure_mutable_index()
+        self.index.add_with_ids(vectors, np.array(ids, dtype=np.int64))
+        for i, artifact_id in zip(positions, ids):
+            self._overlay[artifact_id] = documents[i]
+            self._overlay_rerank[artifact_id] = RerankTermIndex.build([documents[i]])
+        self._live_count += len(ids) - len(existing)
+    
+    def _apply_deletes(self, artifact_ids: List[int]) -> List[int]:
+        """在内存中应用一批删除，返回实际存在并被删除的文物ID"""
+        deleted = [artifact_id for artifact_id in dict.fromkeys(artifact_ids) if self._contains(artifact_id)]
+        self._remove_from_index(deleted)
+        for artifact_id in deleted:
+            self._overlay[artifact_id] = None
+            self._overlay_rerank.pop(artifact_id, None)
+        self._live_count -= len(deleted)
+        return deleted
+    
+    def _append_delta_log(self, records: List[Dict]):
+        """将变更追加写入增量日志并落盘，保证进程崩溃后可重放"""
+        with open(self.delta_log_file, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._delta_count += len(records)
+        self._generation = self._bump_generation()
+    
+    def _replay_delta_log(self):
+        """加载时重放上次压缩之后的增量变更（连续的同类变更合并为一批应用）"""
+        if not os.path.exists(self.delta_log_file):
+            return
+        records = []
+        with open(self.delta_log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 最后一行可能在写入时中断，忽略
+                    logger.warning("⚠️ 增量日志中存在不完整的记录，已忽略")
+        
+        start = 0
+        while start < len(records):
+            op = records[start]["op"]
+            end = start
+            while end < len(records) and records[end]["op"] == op:
+                end += 1
+            batch = records[start:end]
+            artifact_ids = [int(record["id"]) for record in batch]
+            if op == "upsert":
+                vectors = np.vstack([_decode_vector(record["vector"]) for record in batch])
+                self._apply_upserts(artifact_ids, [record["doc"] for record in batch], vectors)
+            else:
+                self._apply_deletes(artifact_ids)
+            start = end
+        self._delta_count = len(records)
+        if records:
+            logger.info(f"✓ 已重放 {len(records)} 条增量变更")
+    
+    def upsert_artifacts(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """新增或更新文物，无需重建整个向量数据库
+        
+        Args:
+            rows: 文物数据列表，列名与Excel一致（文物名称 / 图片地址 / 编号-年代 / 历史 / 工艺），
+                可选 artifact_id；未指定时由 编号-年代 + 文物名称 生成
+        
+        Returns:
+            list: 各条数据对应的文物ID（内容为空的数据被跳过）
+        
+        Raises:
+            ValueError: artifact_id 格式错误
+        """
+        if self.index is None or self.embedding_model is None:
+            raise RuntimeError("向量数据库未就绪")
+        
+        documents = [doc for doc in (row_to_document(row) for row in rows) if doc is not None]
+        artifact_ids = [artifact_id_for(doc["metadata"]) for doc in documents]
+        for doc in documents:
+            doc["metadata"].pop("artifact_id", None)
+        self._upsert_documents(artifact_ids, documents)
+        return artifact_ids
+    
+    def _upsert_documents(self, artifact_ids: List[int], documents: List[Dict]):
+        """向量化并写入一批文档（应用到内存并追加增量日志）"""
+        if not documents:
+            return
+        # 向量化不需要持有锁
+        vectors = self.embed_texts([doc["content"] for doc in documents])
+        
+        with self._store_lock.hold():
+            self._refresh_from_disk()
+            with self._lock.write():
+                self._apply_upserts(artifact_ids, documents, vectors)
+                self._append_delta_log([
+                    {"op": "upsert", "id": str(artifact_id), "doc": doc, "vector": _encode_vector(vector)}
+                    for artifact_id, doc, vector in zip(artifact_ids, documents, vectors)
+                ])
+        logger.info(f"✓ 已增量更新 {len(documents)} 个文物")
+        self._maybe_compact()
+    
+    def delete_artifacts(self, artifact_ids: List[int]) -> int:
+        """按文物ID删除文物
+        
+        Returns:
+            int: 实际删除的文物数
+        """
+        if self.index is None:
+            raise RuntimeError("向量数据库未就绪")
+        
+        with self._store_lock.hold():
+            self._refresh_from_disk()
+            with self._lock.write():
+                deleted = self._apply_deletes([int(artifact_id) for artifact_id in artifact_ids])
+                if deleted:
+                    self._append_delta_log([{"op": "delete", "id": str(artifact_id)} for artifact_id in deleted])
+        logger.info(f"✓ 已删除 {len(deleted)} 个文物")
+        self._maybe_compact()
+        return len(deleted)
+    
+    def _save_manifest(self, artifact_ids: np.ndarray, hashes: np.ndarray):
+        """保存导入清单（文物ID与内容哈希），先写临时文件再原子替换"""
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, ids=np.asarray(artifact_ids, dtype=np.int64), hashes=np.asarray(hashes, dtype=np.uint64))
+        os.replace(tmp_file, self.manifest_file)
+    
+    def _load_manifest(self) -> Dict[int, int]:
+        """加载导入清单：基础文档存储中的文物ID -> 内容哈希（需持有锁）
+        
+        清单在构建与压缩时随基础存储一同写入；不存在或与基础存储不一致时（旧版本构建的数据库），
+        由当前文档内容重新生成
+        """
+        if os.path.exists(self.manifest_file):
+            with np.load(self.manifest_file) as data:
+                ids, hashes = data["ids"], data["hashes"]
+            if np.array_equal(ids, self._base_ids):
+                return dict(zip(ids.tolist(), hashes.tolist()))
+        
+        logger.info("导入清单不存在或已过期，正在根据当前文档生成...")
+        hashes = document_hashes(self.documents)
+        self._save_manifest(self._base_ids, hashes)
+        return dict(zip(self._base_ids.tolist(), hashes.tolist()))
+    
+    def _live_hashes(self) -> Dict[int, int]:
+        """当前存在的各文物的内容哈希：基础存储的清单叠加增量变更（需持有锁）
+        
+        包含通过增量接口新增、更新与删除的结果，同步文物表时以此为准
+        """
+        hashes = self._load_manifest()
+        for artifact_id, doc in self._overlay.items():
+            if doc is None:
+                hashes.pop(artifact_id, None)
+            else:
+                hashes[artifact_id] = int(document_hashes([doc])[0])
+        return hashes
+    
+    def sync_catalogue(self) -> Optional[Dict[str, int]]:
+        """将Excel文物表的变化同步到向量数据库
+        
+        分块读取文物表，按 文物名称 / 图片地址 / 编号-年代 / 历史 / 工艺 计算每行的内容哈希并与数据库中
+        当前的文物比较（含通过增量接口做的修改），只向量化新增或内容有变化的行，删除表中不存在的文物，
+        其余文物沿用索引中已有的向量。
+        数据库不存在时执行完整构建。
+        
+        Returns:
+            dict: 各类变更的数量（added / updated / deleted / unchanged），失败时返回None
+        """
+        # 整个同步期间持有跨进程写锁，比较所用的当前文物与写入时一致
+        with self._store_lock.hold():
+            self._refresh_from_disk()
+            return self._sync_catalogue()
+    
+    def _sync_catalogue(self) -> Optional[Dict[str, int]]:
+        if self.index is None:
+            if not self.build_vector_database():
+                return None
+            return {"added": self.document_count(), "updated": 0, "deleted": 0, "unchanged": 0}
+        
+        if self.embedding_model is None:
+            logger.error("❌ 词嵌入模型未加载，无法同步向量数据库")
+            return None
+        if not os.path.exists(self.excel_file_path):
+            logger.error(f"❌ 错误: 找不到Excel文件 '{self.excel_file_path}'")
+            return None
+        
+        with self._lock.read():
+            manifest = self._live_hashes()
+        seen = set()
+        added = updated = unchanged = 0
+        try:
+            # 逐块比较内容哈希，只向量化有变化的行
+            for documents in iter_catalogue_documents(self.excel_file_path):
+                chunk_ids = assign_artifact_ids(documents, seen)
+                chunk_hashes = document_hashes(documents)
+                changed = [i for i, (artifact_id, digest) in enumerate(zip(chunk_ids.tolist(), chunk_hashes.tolist()))
+                           if manifest.get(artifact_id) != digest]
+                chunk_added = sum(1 for i in changed if int(chunk_ids[i]) not in manifest)
+                added += chunk_added
+                updated += len(changed) - chunk_added
+                unchanged += len(documents) - len(changed)
+                if changed:
+                    self._upsert_documents([int(chunk_ids[i]) for i in changed], [documents[i] for i in changed])
+        except CatalogueFormatError as e:
+            logger.error(f"❌ 错误: {str(e)}")
+            return None
+        
+        removed = [artifact_id for artifact_id in manifest if artifact_id not in seen]
+        if removed:
+            self.delete_artifacts(removed)
+        logger.info(f"✓ 同步文物表完成：新增 {added}，更新 {updated}，删除 {len(removed)}，未变化 {unchanged}")
+        
+        return {"added": added, "updated": updated, "deleted": len(removed), "unchanged": unchanged}
+    
+    def _maybe_compact(self):
+        if self._delta_count >= DELTA_COMPACT_THRESHOLD:
+            self.compact()
+    
+    def compact(self) -> bool:
+        """将增量变更合并进基础文档存储与索引，并清空增量日志
+        
+        Returns:
+            bool: 是否执行了压缩
+        """
+        with self._store_lock.hold():
+            # 先合并其他进程追加的增量，压缩后删除的增量日志中不会有未加载的变更
+            self._refresh_from_disk()
+            with self._lock.write():
+                if not self._overlay and not os.path.exists(self.delta_log_file):
+                    return False
+                logger.info(f"正在压缩增量变更（{len(self._overlay)} 个文物）...")
+                live_hashes = self._live_hashes()
+            
+                # 保留未被覆盖或删除的基础文档，再追加增量中的新文档
+                artifact_ids = []
+                with DocumentStoreWriter(self.doc_store_prefix) as writer:
+                    for row in range(len(self.documents)):
+                        artifact_id = int(self._base_ids[row])
+                        if artifact_id not in self._overlay:
+                            writer.append(self.documents[row])
+                            artifact_ids.append(artifact_id)
+                    for artifact_id, doc in self._overlay.items():
+                        if doc is not None:
+                            writer.append(doc)
+                            artifact_ids.append(artifact_id)
+                artifact_ids = np.array(artifact_ids, dtype=np.int64)
+            
+                # 索引中残留过期向量时（HNSW），按最新向量重建索引
+                if self._stale_count:
+                    vectors = np.vstack([self.index.reconstruct(int(i)) for i in artifact_ids]) \
+                        if len(artifact_ids) else np.empty((0, self.index.d), dtype=np.float32)
+                    params = {**self.index_params,
+                              **{k: v for k, v in self.index_meta.items() if k in DEFAULT_INDEX_PARAMS}}
+                    self.index, self.index_meta = create_faiss_index(
+                        vectors, self.index_meta.get("index_type", "flat"), params, ids=artifact_ids)
+                self.index_meta["count"] = int(len(artifact_ids))
+            
+                write_index_atomic(self.index, self.vector_index_file)
+                with open(self.index_meta_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.index_meta, f, ensure_ascii=False, indent=2)
+                save_array_atomic(self.artifact_ids_file, artifact_ids)
+                self._save_manifest(artifact_ids, np.array([live_hashes[artifact_id] for artifact_id in artifact_ids.tolist()],
+                                                           dtype=np.uint64))
+                # 旧的内存映射由垃圾回收释放，避免影响仍在使用它的读者
+                self.documents = DocumentStore(self.doc_store_prefix)
+                self.rerank_index = RerankTermIndex.build(self.documents)
+                self.rerank_index.save(self.rerank_terms_file, self.rerank_vocab_file)
+                self._set_base_ids(artifact_ids)
+                if os.path.exists(self.delta_log_file):
+                    os.remove(self.delta_log_file)
+                self._generation = self._bump_generation()
+        logger.info(f"✓ 压缩完成，当前包含 {len(artifact_ids)} 个文档")
+        return True
+    
+    def _search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """根据索引类型构造查询参数（不修改共享索引对象，可在多线程中安全使用）"""
+        index_type = self.index_meta.get("index_type", "flat")
+        if index_type.startswith("ivf"):
+            nprobe = nprobe or self.index_meta.get("nprobe") or self.index_params["nprobe"]
+            return faiss.SearchParametersIVF(nprobe=int(nprobe))
+        if index_type == "hnsw":
+            ef_search = ef_search or self.index_meta.get("ef_search") or self.index_params["ef_search"]
+            return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+        return None
+    
+    def _search_index(self, query_embedding: np.ndarray, k: int,
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """执行FAISS搜索，附带查询时参数"""
+        if self.index_meta.get("metric") == "ip":
+            query_embedding = normalize_vectors(query_embedding)
+        params = self._search_params(nprobe, ef_search)
+        if params is None:
+            return self.index.search(query_embedding, k)
+        return self.index.search(query_embedding, k, params=params)
+    
+    def _current_distance(self, query_embedding: np.ndarray, artifact_id: int) -> float:
+        """查询与文物最新向量的距离（IndexIDMap2 中同一ID对应最后加入的向量）"""
+        vector = self.index.reconstruct(artifact_id)
+        if self.index_meta.get("metric") == "ip":
+            return float(np.dot(normalize_vectors(query_embedding)[0], vector))
+        return float(np.sum((query_embedding[0] - vector) ** 2))
+    
+    def _to_similarity(self, distance: float) -> float:
+        """将索引返回的距离转换为相似度分数
+        
+        ip（余弦）索引直接返回 [-1, 1] 的余弦相似度；l2 索引沿用 1/(1+d) 的换算
+        """
+        if self.index_meta.get("metric") == "ip":
+            return float(distance)
+        return 1.0 / (1.0 + float(distance))
+    
+    def _load_rerank_index(self) -> RerankTermIndex:
+        """加载重排序词索引；不存在或与文档数不一致时（如由 model.py 构建的数据库）重新生成"""
+        rerank_index = RerankTermIndex.load(self.rerank_terms_file, self.rerank_vocab_file)
+        if rerank_index is None or len(rerank_index) != len(self.documents):
+            logger.info("正在生成重排序词索引...")
+            rerank_index = RerankTermIndex.build(self.documents)
+            rerank_index.save(self.rerank_terms_file, self.rerank_vocab_file)
+        return rerank_index
+    
+    def _search_candidates(self, query_text: str, k: int, nprobe: Optional[int] = None,
+                           ef_search: Optional[int] = None):
+        """向量检索候选文物（需持有读锁）
+        
+        Returns:
+            tuple: (artifact_ids, base_scores, rows) 已过滤删除与重复结果的文物ID、相似度，
+                以及文档存储行号（增量中的文档为 -1）
+        """
+        query_embedding = self.embed_texts([query_text])
+        # 索引中残留过期向量时多取一些，保证过滤后仍有 k 个结果
+        fetch_k = min(k + self._stale_count, self.index.ntotal)
+        distances, labels = self._search_index(query_embedding, fetch_k, nprobe, ef_search)
+        
+        artifact_ids, base_scores = [], []
+        seen = set()
+        for distance, label in zip(distances[0], labels[0]):
+            label = int(label)
+            if label == -1 or label in seen or (label in self._overlay and self._overlay[label] is None):
+                continue
+            seen.add(label)
+            if self._stale_count and label in self._overlay:
+                # 命中的可能是更新前残留的旧向量，按最新向量重新计算距离
+                distance = self._current_distance(query_embedding, label)
+            artifact_ids.append(label)
+            base_scores.append(self._to_similarity(distance))
+            if len(artifact_ids) == k and not self._stale_count:
+                break
+        
+        if self._stale_count:
+            # 重新计算后的分数可能改变排序，排序后再截取前 k 个
+            order = np.argsort(-np.array(base_scores, dtype=np.float32), kind="stable")[:k]
+            artifact_ids = [artifact_ids[i] for i in order]
+            base_scores = [base_scores[i] for i in order]
+        
+        artifact_ids = np.array(artifact_ids, dtype=np.int64)
+        rows = self._lookup_rows(artifact_ids)
+        if self._overlay:
+            rows[np.isin(artifact_ids, np.fromiter(self._overlay, dtype=np.int64))] = -1
+        return artifact_ids, np.array(base_scores, dtype=np.float32), rows
+    
+    def search_normal(self, query_text: str, top_k: int = 5,
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Dict]:
+        """普通向量搜索（基于文本相似度），相同的查询在数据库变化前直接返回缓存的结果
         
         Args:
             query_text: 查询文本
             top_k: 返回最相似的文档数量
+            nprobe: IVF索引查询的聚类数（可选，越大召回越高、越慢）
+            ef_search: HNSW索引查询的搜索深度（可选）
         
         Returns:
             list: 相似文档列表，每个元素包含content、metadata和score
         """
-        if self.index is None or not self.documents or self.embedding_model is None:
+        if self.index is None or not self._live_count or self.embedding_model is None:
             return []
         
+        # 规范化只用于缓存键，向量化与重排序仍使用原始查询文本，缓存不改变搜索结果
+        cache_key = ("normal", normalize_query(query_text), top_k, nprobe, ef_search)
+        cached = self.result_cache.get(cache_key, self._generation)
+        if cached is not None:
+            return cached
+        
         try:
-            # 将查询文本转换为向量
-            query_embedding = self._embed_text(query_text)
-            if query_embedding is None or query_embedding.size == 0:
-                return []
-            
-            query_embedding = np.array([query_embedding]).astype('float32')
-            
-            # 执行向量搜索
-            distances, indices = self.index.search(query_embedding, top_k)
-            
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx != -1 and idx < len(self.documents):
-                    similarity = 1.0 / (1.0 + float(distances[0][i]))
-                    
+            with self._lock.read():
+                generation = self._generation
+                artifact_ids, scores, rows = self._search_candidates(query_text, top_k, nprobe, ef_search)
+                
+                results = []
+                for artifact_id, score, row in zip(artifact_ids, scores, rows):
+                    doc = self._get_document(int(artifact_id), int(row))
                     results.append({
-                        "content": self.documents[idx]["content"],
-                        "metadata": self.documents[idx]["metadata"],
-                        "score": similarity
+                        "content": doc["content"],
+                        "metadata": doc["metadata"],
+                        "score": float(score)
                     })
             
+            self.result_cache.put(cache_key, generation, results)
             return results
         except Exception as e:
             logger.error(f"❌ 普通向量搜索过程出错: {str(e)}")
             return []
     
-    def search_enhanced(self, query_text: str, top_k: int = 5, image_weight: float = 0.3) -> List[Dict]:
-        """增强向量搜索（结合图片描述信息）
+    def search_enhanced(self, query_text: str, top_k: int = 5, image_weight: float = 0.3,
+                        nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Dict]:
+        """增强向量搜索（结合图片描述信息），相同的查询在数据库变化前直接返回缓存的结果
         
         Args:
             query_text: 查询文本
             top_k: 返回最相似的文档数量
             image_weight: 图片描述权重（0-1之间），默认0.3
+            nprobe: IVF索引查询的聚类数（可选）
+            ef_search: HNSW索引查询的搜索深度（可选）
         
         Returns:
             list: 相似文档列表，每个元素包含content、metadata和score
         """
-        if self.index is None or not self.documents or self.embedding_model is None:
+        if self.index is None or not self._live_count or self.embedding_model is None:
             return []
         
+        # 规范化只用于缓存键，向量化与重排序仍使用原始查询文本，缓存不改变搜索结果
+        cache_key = ("enhanced", normalize_query(query_text), top_k, float(image_weight), nprobe, ef_search)
+        cached = self.result_cache.get(cache_key, self._generation)
+        if cached is not None:
+            return cached
+        
         try:
-            # 先进行普通向量搜索，获取更多候选结果
-            candidate_k = min(top_k * 3, len(self.documents))
-            
-            query_embedding = self._embed_text(query_text)
-            if query_embedding is None or query_embedding.size == 0:
-                return []
-            
-            query_embedding = np.array([query_embedding]).astype('float32')
-            distances, indices = self.index.search(query_embedding, candidate_k)
-            
-            # 对查询文本进行分词，用于匹配图片描述
-            query_words = set(jieba.cut(query_text.lower()))
-            
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx != -1 and idx < len(self.documents):
-                    # 基础相似度分数
-                    base_similarity = 1.0 / (1.0 + float(distances[0][i]))
-                    
-                    # 获取图片识别结果
-                    metadata = self.documents[idx].get("metadata", {})
-                    recognition_result = metadata.get("recognition_result", {})
-                    
-                    # 计算图片描述匹配分数
-                    image_score = 0.0
-                    if recognition_result:
-                        artifact_type = recognition_result.get("artifact_type", "")
-                        recognized_name = recognition_result.get("recognized_name", "")
-                        description = recognition_result.get("description", "")
-                        
-                        # 构建图片描述文本
-                        image_text = f"{artifact_type} {recognized_name} {description}".lower()
-                        image_words = set(jieba.cut(image_text))
-                        
-                        # 计算查询词与图片描述的重叠度
-                        if len(query_words) > 0 and len(image_words) > 0:
-                            overlap = len(query_words & image_words)
-                            image_score = overlap / max(len(query_words), 1)
-                        
-                        # 考虑识别置信度
-                        confidence = recognition_result.get("confidence", 0.0)
-                        image_score = image_score * (0.5 + confidence * 0.5)
-                    
-                    # 综合分数
-                    final_score = (1 - image_weight) * base_similarity + image_weight * image_score
-                    
+            with self._lock.read():
+                generation = self._generation
+                # 先进行普通向量搜索，获取更多候选结果
+                candidate_k = min(top_k * 3, self._live_count)
+                artifact_ids, base_scores, rows = self._search_candidates(query_text, candidate_k, nprobe, ef_search)
+                
+                # 基于预分词的词ID集合计算查询与图片描述的重叠度（已考虑识别置信度）
+                image_scores = np.zeros(len(rows), dtype=np.float32)
+                in_store = rows >= 0
+                if self.rerank_index is not None:
+                    image_scores[in_store] = self.rerank_index.score(query_text, rows[in_store])
+                for i in np.flatnonzero(~in_store):
+                    image_scores[i] = self._overlay_rerank[int(artifact_ids[i])].score(query_text, np.zeros(1, dtype=np.int64))[0]
+                
+                # 综合分数，按最终分数重新排序
+                final_scores = (1 - image_weight) * base_scores + image_weight * image_scores
+                order = np.argsort(-final_scores, kind="stable")[:top_k]
+                
+                results = []
+                for i in order:
+                    doc = self._get_document(int(artifact_ids[i]), int(rows[i]))
                     results.append({
-                        "content": self.documents[idx]["content"],
-                        "metadata": self.documents[idx]["metadata"],
-                        "score": final_score,
-                        "base_score": base_similarity,
-                        "image_score": image_score
+                        "content": doc["content"],
+                        "metadata": doc["metadata"],
+                        "score": float(final_scores[i]),
+                        "base_score": float(base_scores[i]),
+                        "image_score": float(image_scores[i])
                     })
             
-            # 按最终分数重新排序
-            results.sort(key=lambda x: x["score"], reverse=True)
-            
-            # 返回 top_k 个结果
-            return results[:top_k]
+            self.result_cache.put(cache_key, generation, results)
+            return results
             
         except Exception as e:
             logger.error(f"❌ 增强向量搜索过程出错: {str(e)}")
             return []
     
+    def document_count(self) -> int:
+        """当前文物数（含未压缩的增量变更）"""
+        return self._live_count
+    
     def is_ready(self) -> bool:
         """检查向量数据库是否已准备好"""
-        return self.index is not None and len(self.documents) > 0
+        return self.index is not None and self._live_count > 0
 
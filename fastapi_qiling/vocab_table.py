@@ -0,0 +1,143 @@
+# 裁剪后的词向量表：float16 内存映射矩阵 + 词 -> 行号索引
+#
+# 完整的 w2v.baidu_encyclopedia 词向量有数百万词，每个服务进程加载一份要占用数GB内存，
+# 而文物表与常见查询只用到其中很小一部分。本工具从完整模型中抽取
+#   1. 文物表分词后出现的所有词（保证文物文档的向量与完整模型一致）
+#   2. 词表中排在最前面的常用词（模型词表按词频排序），覆盖查询中的一般词语
+# 保存为 float16 的 .npy 文件。服务加载时以只读内存映射打开，多个 uvicorn worker
+# 共享操作系统的同一份页缓存；未收录的词按未登录词处理（与完整模型中不存在的词相同）。
+#
+# 文件布局（以 prefix 为前缀）：
+#   {prefix}.npy          (N, 300) float16 词向量矩阵
+#   {prefix}.vocab.json   行号顺序的词列表、未登录词及来源模型
+#
+# 用法（文物表有较大变化后重新生成）：
+#     python vocab_table.py --excel ./故宫博物院数字文物库.xlsx --general-size 200000
+import argparse
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "w2v.baidu_encyclopedia.target.word-word.dim300"
+# 裁剪词向量表的路径前缀，设为空字符串时直接加载完整模型
+VOCAB_TABLE_PATH = os.environ.get("VOCAB_TABLE_PATH", "./data/vocab_table")
+# 除文物表中的词外，额外收录的常用词数
+VOCAB_GENERAL_SIZE = int(os.environ.get("VOCAB_GENERAL_SIZE", 200000))
+
+
+def table_files(prefix: str) -> Tuple[str, str]:
+    return f"{prefix}.npy", f"{prefix}.vocab.json"
+
+
+def table_exists(prefix: str) -> bool:
+    return bool(prefix) and all(os.path.exists(path) for path in table_files(prefix))
+
+
+class VocabEmbeddingTable:
+    """只读的裁剪词向量表（矩阵为内存映射，按行读取时才访问磁盘页）"""
+
+    def __init__(self, prefix: str):
+        matrix_path, vocab_path = table_files(prefix)
+        with open(vocab_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.matrix = np.load(matrix_path, mmap_mode="r")
+        self.tokens: List[str] = meta["tokens"]
+        self.token_to_idx: Dict[str, int] = {token: row for row, token in enumerate(self.tokens)}
+        self.unknown_token = meta["unknown_token"]
+        self.unk_idx = self.token_to_idx[self.unknown_token]
+        self.source = meta.get("source")
+        if self.matrix.shape[0] != len(self.tokens):
+            raise ValueError(f"词向量表行数 {self.matrix.shape[0]} 与词表大小 {len(self.tokens)} 不一致")
+
+    @property
+    def dimension(self) -> int:
+        return int(self.matrix.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+
+def open_vocab_table(prefix: str = VOCAB_TABLE_PATH) -> Optional[VocabEmbeddingTable]:
+    """打开裁剪词向量表，不存在时返回None"""
+    if not table_exists(prefix):
+        return None
+    return VocabEmbeddingTable(prefix)
+
+
+def write_vocab_table(prefix: str, tokens: List[str], matrix: np.ndarray, unknown_token: str,
+                      source: str = EMBEDDING_MODEL_NAME) -> None:
+    """写入词向量表（先写临时文件再原子替换，正在映射旧文件的进程不受影响）"""
+    matrix_path, vocab_path = table_files(prefix)
+    directory = os.path.dirname(matrix_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(matrix_path + ".tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float16))
+    with open(vocab_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"source": source, "unknown_token": unknown_token, "tokens": tokens}, f, ensure_ascii=False)
+    os.replace(matrix_path + ".tmp", matrix_path)
+    os.replace(vocab_path + ".tmp", vocab_path)
+
+
+def catalogue_token_counts(excel_file_path: str) -> Dict[str, int]:
+    """文物表中各词出现的次数（分词方式与向量化时相同）"""
+    from ingestion import iter_catalogue_documents
+    from vector_db_service import _cut_texts
+
+    counts: Dict[str, int] = {}
+    for documents in iter_catalogue_documents(excel_file_path):
+        for words in _cut_texts([doc["content"] for doc in documents]):
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="从完整词向量模型中抽取裁剪后的 float16 词向量表")
+    parser.add_argument("--excel", default="./故宫博物院数字文物库.xlsx", help="文物表路径（Excel / CSV / Parquet）")
+    parser.add_argument("--output", default=VOCAB_TABLE_PATH, help="输出路径前缀")
+    parser.add_argument("--general-size", type=int, default=VOCAB_GENERAL_SIZE, help="额外收录的常用词数")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME, help="完整词向量模型名")
+    args = parser.parse_args(argv)
+    if not args.output:
+        parser.error("--output 不能为空")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from paddlenlp.embeddings import TokenEmbedding
+
+    model = TokenEmbedding(args.model)
+    weight = model.weight.numpy()
+    token_to_idx = model.vocab.token_to_idx
+    unknown_token = model.unknown_token
+    logger.info(f"✓ 完整词向量模型: {weight.shape[0]} 个词，{weight.nbytes / 1024 / 1024:.0f} MB")
+
+    counts = catalogue_token_counts(args.excel)
+    catalogue_rows = {token_to_idx[word] for word in counts if word in token_to_idx}
+    covered = sum(count for word, count in counts.items() if word in token_to_idx)
+    total = sum(counts.values())
+    if not total:
+        logger.error("❌ 文物表中没有任何词")
+        return 1
+    logger.info(f"✓ 文物表共 {len(counts)} 个不同的词，其中 {len(catalogue_rows)} 个在词表中"
+                f"（按出现次数覆盖 {covered / total:.1%}）")
+
+    # 保持原词表顺序（即词频顺序），常用词的行集中在文件前部
+    rows = sorted(catalogue_rows | set(range(min(args.general_size, weight.shape[0])))
+                  | {token_to_idx[unknown_token]})
+    idx_to_token = {idx: token for token, idx in token_to_idx.items()}
+    tokens = [idx_to_token[row] for row in rows]
+    matrix = np.asarray(weight[rows], dtype=np.float16)
+    write_vocab_table(args.output, tokens, matrix, unknown_token, source=args.model)
+
+    logger.info(f"✅ 已写入 {table_files(args.output)[0]}: {len(rows)} 个词，{matrix.nbytes / 1024 / 1024:.0f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
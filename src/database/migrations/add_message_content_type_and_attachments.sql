@@ -0,0 +1,15 @@
+-- 消息表结构化：区分消息类型，附件单独存放，按 (userid, timestamp) 建联合索引
+-- 字段说明：
+--   content_type: 消息类型 (text/image)，纯文本消息为 text
+--   attachments: 附件列表（JSON 数组），如 [{"type": "image", "file_id": "<uploads 下的文件名>"}]
+--   content: 只保存消息正文，不再保存 str(dict) 形式的图片消息
+-- 执行顺序：
+--   1. 执行本脚本修改表结构
+--   2. 运行 fastapi_qiling/migrate_message_schema.py 将已有的图片消息转换为新格式
+--      （该脚本也会在列不存在时自动执行本脚本的结构修改，可以直接运行）
+
+ALTER TABLE messages
+    ADD COLUMN content_type VARCHAR(20) NOT NULL DEFAULT 'text' COMMENT '消息类型 (text/image)' AFTER role,
+    ADD COLUMN attachments JSON NULL COMMENT '附件列表（JSON 数组）' AFTER content,
+    ADD INDEX idx_userid_timestamp (userid, timestamp),
+    DROP INDEX idx_userid;
@@ -0,0 +1,9 @@
+-- 聊天历史按游标分页：联合索引显式包含主键 id
+-- 历史接口按 (timestamp DESC, id DESC) 排序，并以上一页最后一条消息的 (timestamp, id) 作为游标，
+-- 查询条件 userid = ? AND (timestamp, id) < (?, ?) 直接在该索引上定位并顺序读取一页，
+-- 无论用户有多少条消息，每页的开销都只与页大小有关。
+-- 可在 add_message_content_type_and_attachments.sql 之后执行，或运行 fastapi_qiling/migrate_message_schema.py
+
+ALTER TABLE messages
+    ADD INDEX idx_userid_timestamp_id (userid, timestamp, id),
+    DROP INDEX idx_userid_timestamp;
@@ -117,9 +117,13 @@ async function request(endpoint, options = {}) {
       });
     },
 
-    // 获取聊天历史
-    getChatHistory: async () => {
-      return request('/chat/history');
+    // 获取聊天历史（before 为上一页返回的 next_before 游标，不传时获取最新一页）
+    getChatHistory: async (before = null, limit = 20) => {
+      const params = new URLSearchParams({ limit: String(limit) });
+      if (before) {
+        params.append('before', before);
+      }
+      return request(`/chat/history?${params.toString()}`);
     },
     
     // 获取最近5条消息